@@ -0,0 +1,183 @@
+"""センサー履歴の時刻範囲集計
+
+get_history の集計モードで使う。生データの配列を LLM に渡す代わりに、
+時間バケットごとの count / mean / min / max / p50 / p95 を計算して
+コンパクトなサマリーとして返す。
+
+- 直近のデータはメモリ上のリングバッファの列（二分探索で範囲を特定）から計算する
+- メモリにない古い範囲は永続化ストアの 1分 / 1時間ロールアップから計算する
+  （ロールアップには分位点がないため p50 / p95 は含まれない）
+"""
+
+import math
+import re
+import time
+
+import numpy as np
+
+from agent.history import SensorHistory, format_timestamp, parse_timestamp
+
+_MAX_BUCKETS = 60  # これを超えるバケット数になる場合はバケット幅を広げる
+# バケット幅を広げるときの候補（秒）
+_NICE_BUCKETS = (1, 5, 10, 15, 30, 60, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400)
+
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+_DURATION_RE = re.compile(r"^(\d+(?:\.\d+)?)([smhd])$")
+
+
+def parse_duration(value: str) -> float:
+    """"30s" / "5m" / "1h" / "1d" 形式の期間を秒に変換する"""
+    match = _DURATION_RE.match(value.strip())
+    if not match:
+        raise ValueError(f"期間の形式が不正です: {value}（例: 30s, 5m, 1h, 1d）")
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+def parse_time(value: str | None, now: float | None = None) -> float | None:
+    """ISO 8601 または "-15m" のような現在時刻からの相対指定を UNIX 秒に変換する"""
+    if value is None or value == "":
+        return None
+    value = value.strip()
+    if value.startswith("-"):
+        return (now if now is not None else time.time()) - parse_duration(value[1:])
+    ts = parse_timestamp(value)
+    if ts is None:
+        raise ValueError(f"時刻の形式が不正です: {value}（例: 2026-02-28T10:00:00Z, -15m）")
+    return ts
+
+
+def _widen(bucket: float | None, since: float | None, until: float | None) -> float | None:
+    if bucket is None or since is None or until is None:
+        return bucket
+    needed = (until - since) / _MAX_BUCKETS
+    if bucket >= needed:
+        return bucket
+    for nice in _NICE_BUCKETS:
+        if nice >= needed:
+            return float(nice)
+    return math.ceil(needed / 86400) * 86400.0
+
+
+def _label(seconds: float) -> str:
+    for unit, width in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= width and seconds % width == 0:
+            return f"{int(seconds // width)}{unit}"
+    return f"{int(seconds)}s"
+
+
+def _stats(values: np.ndarray) -> dict:
+    return {
+        "count": int(len(values)),
+        "mean": round(float(values.mean()), 3),
+        "min": round(float(values.min()), 3),
+        "max": round(float(values.max()), 3),
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+    }
+
+
+def summarize(ts: np.ndarray, values: np.ndarray, bucket: float | None) -> dict:
+    """(タイムスタンプ, 値) の配列をバケットごとに集計する"""
+    mask = ~np.isnan(values)
+    ts, values = ts[mask], values[mask]
+    if not len(values):
+        return {"total": {"count": 0}, "buckets": []}
+    result = {"total": _stats(values)}
+    if bucket:
+        keys = np.floor(ts / bucket) * bucket
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        ends = np.r_[starts[1:], len(keys)]
+        result["buckets"] = [
+            {"t": format_timestamp(float(keys[s])), **_stats(values[s:e])}
+            for s, e in zip(starts, ends)
+        ]
+    return result
+
+
+def summarize_rollups(rows: list[dict], bucket: float | None, width: float) -> dict:
+    """ストアのロールアップ行をバケットごとに再集計する（分位点なし）"""
+    rows = [r for r in rows if r["count"]]
+    if not rows:
+        return {"total": {"count": 0}, "buckets": []}
+
+    def merge(group: list[dict]) -> dict:
+        count = sum(r["count"] for r in group)
+        return {
+            "count": count,
+            "mean": round(sum(r["sum"] for r in group) / count, 3),
+            "min": round(min(r["min"] for r in group), 3),
+            "max": round(max(r["max"] for r in group), 3),
+        }
+
+    result = {"total": merge(rows)}
+    if bucket:
+        step = max(bucket, width)
+        groups: dict[float, list[dict]] = {}
+        for row in rows:
+            groups.setdefault(row["bucket"] - row["bucket"] % step, []).append(row)
+        result["buckets"] = [{"t": format_timestamp(key), **merge(group)} for key, group in groups.items()]
+    return result
+
+
+def aggregate_history(
+    history: SensorHistory,
+    store,
+    sensor_type: str,
+    field: str | None,
+    since: float | None,
+    until: float | None,
+    device_id: str | None,
+    bucket: float | None,
+) -> dict:
+    """メモリ上の履歴またはストアのロールアップから集計サマリーを作る
+
+    Args:
+        history: メモリ上の履歴
+        store: 永続化ストア（None ならメモリのみ）
+        sensor_type: センサー種別
+        field: 集計するフィールド（None なら全数値フィールド）
+        since / until: 時刻範囲（UNIX 秒）
+        device_id: デバイスID（None なら全デバイス）
+        bucket: バケット幅（秒）。None なら範囲全体の集計のみ
+
+    Returns:
+        {"sensor_type", "source", "since", "until", "bucket", "fields": {field: {"total", "buckets"}}}
+    """
+    oldest = history.oldest(sensor_type, device_id)
+    use_memory = store is None or (oldest is not None and (since is None or since >= oldest))
+
+    if use_memory:
+        fields = [field] if field else history.numeric_fields(sensor_type)
+        if since is None:
+            since = oldest
+        end = until if until is not None else time.time()
+        bucket = _widen(bucket, since, end)
+        summary = {}
+        for name in fields:
+            ts, values = history.columns(sensor_type, name, since, until, device_id)
+            summary[name] = summarize(ts, values, bucket)
+        source = "memory"
+    else:
+        store.flush()
+        fields = [field] if field else store.fields(sensor_type)
+        end = until if until is not None else time.time()
+        bucket = _widen(bucket, since, end)
+        resolution = "1h" if (bucket or (end - (since or 0))) >= 3600 else "1m"
+        width = 3600 if resolution == "1h" else 60
+        summary = {}
+        for name in fields:
+            rows = store.rollups(sensor_type, name, resolution, since, until, device_id)
+            summary[name] = summarize_rollups(rows, bucket, width)
+        source = f"rollup_{resolution}"
+        if bucket:
+            bucket = max(bucket, width)
+
+    return {
+        "sensor_type": sensor_type,
+        "device_id": device_id,
+        "source": source,
+        "since": format_timestamp(since) if since is not None else None,
+        "until": format_timestamp(until) if until is not None else None,
+        "bucket": _label(bucket) if bucket else None,
+        "fields": summary,
+    }
@@ -0,0 +1,290 @@
+"""ストリーミング異常検知エンジン
+
+デバイス × フィールド（bpm / heart_rate / acceleration_magnitude）ごとに
+検知器を持ち、受信したサンプルを LLM を介さずにその場で評価する。
+
+- ローリング z スコア: 直前 window 件の平均・分散からの偏差（スパイク検知）
+- EWMA: 平滑化した水準（ダッシュボード・説明用）
+- CUSUM: z スコアの累積和による緩やかな上昇・下降（ドリフト）検知
+
+1サンプルの更新は O(1)（窓は NumPy のリング配列 + 累積和で管理）。
+score_batch() は同じ計算を窓全体に対してベクトル化して一度に行う。
+"""
+
+import math
+from collections import deque
+
+import numpy as np
+
+_WINDOW = 60           # ローリング統計の窓幅（サンプル数）
+_MIN_SAMPLES = 10      # これ未満の間は z スコアを 0 とみなす（ウォームアップ）
+_EWMA_ALPHA = 0.1
+_Z_THRESHOLD = 4.0     # |z| がこれを超えたらスパイク
+_CUSUM_K = 0.5         # CUSUM の許容偏差（σ単位）
+_CUSUM_H = 5.0         # CUSUM の判定閾値（σ単位）
+_STD_FLOOR = 1e-6
+_EWMA_BLOCK = 64       # score_batch の EWMA をまとめて計算するブロック長
+_RECENT_ANOMALIES = 100
+
+# ストリーミング検知の対象フィールド
+FIELDS = ("bpm", "heart_rate", "acceleration_magnitude")
+
+
+def acceleration_magnitude(acceleration: dict) -> float | None:
+    """加速度ベクトル {"x", "y", "z"} の大きさを返す"""
+    try:
+        return math.sqrt(sum(float(acceleration[axis]) ** 2 for axis in ("x", "y", "z")))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class StreamingDetector:
+    """1系列分の z スコア / EWMA / CUSUM 検知器"""
+
+    __slots__ = (
+        "window", "_buf", "_pos", "_count", "_sum", "_sumsq", "ewma", "cusum_pos", "cusum_neg", "samples",
+        "last_value", "last_z",
+    )
+
+    def __init__(self, window: int = _WINDOW):
+        self.window = window
+        self._buf = np.zeros(window, dtype=np.float64)
+        self._pos = 0
+        self._count = 0
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self.ewma: float | None = None
+        self.cusum_pos = 0.0
+        self.cusum_neg = 0.0
+        self.samples = 0
+        self.last_value: float | None = None   # 最後に評価したサンプルと、窓に加える前に求めた z スコア
+        self.last_z = 0.0
+
+    def _window_values(self) -> np.ndarray:
+        """窓内の値を古い順に返す"""
+        if self._count < self.window:
+            return self._buf[:self._count].copy()
+        return np.roll(self._buf, -self._pos)
+
+    def zscore(self, value: float) -> float:
+        """直前の窓に対する z スコアを返す（状態は更新しない）"""
+        if self._count < _MIN_SAMPLES:
+            return 0.0
+        mean = self._sum / self._count
+        var = max(self._sumsq / self._count - mean * mean, 0.0)
+        return (value - mean) / max(math.sqrt(var), _STD_FLOOR)
+
+    def update(self, value: float) -> dict:
+        """1サンプルを評価して統計を更新する（O(1)）
+
+        Returns:
+            {"value", "z", "ewma", "cusum_pos", "cusum_neg", "kinds": [...]}
+        """
+        z = self.zscore(value)
+        prev_pos, prev_neg = self.cusum_pos, self.cusum_neg
+        self.cusum_pos = max(0.0, prev_pos + z - _CUSUM_K)
+        self.cusum_neg = max(0.0, prev_neg - z - _CUSUM_K)
+        self.ewma = value if self.ewma is None else self.ewma + _EWMA_ALPHA * (value - self.ewma)
+
+        # 窓の更新（最古の値を差し引いて新しい値を加える）
+        if self._count == self.window:
+            old = float(self._buf[self._pos])
+            self._sum -= old
+            self._sumsq -= old * old
+        else:
+            self._count += 1
+        self._buf[self._pos] = value
+        self._pos = (self._pos + 1) % self.window
+        self._sum += value
+        self._sumsq += value * value
+        self.samples += 1
+        self.last_value, self.last_z = value, z
+
+        kinds = []
+        if abs(z) > _Z_THRESHOLD:
+            kinds.append("spike")
+        if self.cusum_pos > _CUSUM_H >= prev_pos:
+            kinds.append("drift_up")
+        if self.cusum_neg > _CUSUM_H >= prev_neg:
+            kinds.append("drift_down")
+        return {
+            "value": value,
+            "z": z,
+            "ewma": self.ewma,
+            "cusum_pos": self.cusum_pos,
+            "cusum_neg": self.cusum_neg,
+            "kinds": kinds,
+        }
+
+    def score_batch(self, values, update: bool = True) -> dict[str, np.ndarray]:
+        """窓全体をベクトル化して評価する（update() を順に呼んだ結果と一致する）
+
+        Args:
+            values: 評価する値の配列（古い順）
+            update: True なら評価後に検知器の状態を進める
+
+        Returns:
+            {"z", "ewma", "cusum_pos", "cusum_neg", "spike", "drift_up", "drift_down"} の配列
+        """
+        x = np.asarray(values, dtype=np.float64)
+        n = len(x)
+        history = self._window_values()
+        h = len(history)
+        ext = np.concatenate([history, x])
+
+        # ローリング統計: ext[i] の直前 min(window, i) 件
+        csum = np.concatenate([[0.0], np.cumsum(ext)])
+        csumsq = np.concatenate([[0.0], np.cumsum(ext * ext)])
+        idx = np.arange(h, h + n)
+        lo = np.maximum(idx - self.window, 0)
+        counts = idx - lo
+        safe_counts = np.maximum(counts, 1)
+        mean = (csum[idx] - csum[lo]) / safe_counts
+        var = np.maximum((csumsq[idx] - csumsq[lo]) / safe_counts - mean * mean, 0.0)
+        z = np.where(counts >= _MIN_SAMPLES, (x - mean) / np.maximum(np.sqrt(var), _STD_FLOOR), 0.0)
+
+        # CUSUM: S_t = max(0, S_{t-1} + d_t) は累積和と累積最小値で閉じた形に書ける
+        def _cusum(d: np.ndarray, s0: float) -> np.ndarray:
+            c = np.cumsum(d)
+            return c - np.minimum(np.minimum.accumulate(c), -s0)
+
+        cusum_pos = _cusum(z - _CUSUM_K, self.cusum_pos)
+        cusum_neg = _cusum(-z - _CUSUM_K, self.cusum_neg)
+
+        # EWMA: y_j = (1-a)^j * (y_0 + a * Σ_k x_k / (1-a)^k) を数値的に安定な長さのブロックごとに計算
+        ewma = np.empty(n)
+        level = self.ewma
+        start = 0
+        if level is None and n:
+            level = ewma[0] = x[0]
+            start = 1
+        for block_start in range(start, n, _EWMA_BLOCK):
+            chunk = x[block_start:block_start + _EWMA_BLOCK]
+            powers = (1.0 - _EWMA_ALPHA) ** np.arange(1, len(chunk) + 1)
+            out = powers * (level + _EWMA_ALPHA * np.cumsum(chunk / powers))
+            ewma[block_start:block_start + len(chunk)] = out
+            level = out[-1]
+
+        prev_pos = np.concatenate([[self.cusum_pos], cusum_pos[:-1]])
+        prev_neg = np.concatenate([[self.cusum_neg], cusum_neg[:-1]])
+        result = {
+            "z": z,
+            "ewma": ewma,
+            "cusum_pos": cusum_pos,
+            "cusum_neg": cusum_neg,
+            "spike": np.abs(z) > _Z_THRESHOLD,
+            "drift_up": (cusum_pos > _CUSUM_H) & (prev_pos <= _CUSUM_H),
+            "drift_down": (cusum_neg > _CUSUM_H) & (prev_neg <= _CUSUM_H),
+        }
+
+        if update and n:
+            tail = ext[-self.window:]
+            self._buf[:] = 0.0
+            self._buf[:len(tail)] = tail
+            self._count = len(tail)
+            self._pos = len(tail) % self.window
+            self._sum = float(tail.sum())
+            self._sumsq = float((tail * tail).sum())
+            self.ewma = float(ewma[-1])
+            self.cusum_pos = float(cusum_pos[-1])
+            self.cusum_neg = float(cusum_neg[-1])
+            self.samples += n
+            self.last_value, self.last_z = float(x[-1]), float(z[-1])
+        return result
+
+    def snapshot(self) -> dict:
+        mean = self._sum / self._count if self._count else None
+        return {
+            "samples": self.samples,
+            "mean": mean,
+            "ewma": self.ewma,
+            "cusum_pos": self.cusum_pos,
+            "cusum_neg": self.cusum_neg,
+        }
+
+
+class AnomalyEngine:
+    """デバイス × フィールドごとの検知器の集合"""
+
+    def __init__(self, window: int = _WINDOW):
+        self.window = window
+        self._detectors: dict[tuple[str, str], StreamingDetector] = {}
+        self.recent: deque[dict] = deque(maxlen=_RECENT_ANOMALIES)
+
+    def detector(self, device_id: str, field: str) -> StreamingDetector:
+        key = (device_id, field)
+        det = self._detectors.get(key)
+        if det is None:
+            det = StreamingDetector(self.window)
+            self._detectors[key] = det
+        return det
+
+    @staticmethod
+    def extract(message: dict) -> dict[str, float]:
+        """メッセージから検知対象の数値フィールドを取り出す"""
+        values = {}
+        for field in FIELDS:
+            value = message.get(field)
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+                values[field] = float(value)
+        if "acceleration_magnitude" not in values and isinstance(message.get("acceleration"), dict):
+            magnitude = acceleration_magnitude(message["acceleration"])
+            if magnitude is not None:
+                values["acceleration_magnitude"] = magnitude
+        return values
+
+    def ingest(self, message: dict) -> list[dict]:
+        """受信メッセージを評価し、検知した異常のリストを返す"""
+        device_id = str(message.get("device_id", ""))
+        anomalies = []
+        for field, value in self.extract(message).items():
+            score = self.detector(device_id, field).update(value)
+            for kind in score["kinds"]:
+                anomaly = {
+                    "device_id": device_id,
+                    "field": field,
+                    "kind": kind,
+                    "value": value,
+                    "z": round(score["z"], 3),
+                    "ewma": round(score["ewma"], 3),
+                    "sample_timestamp": message.get("timestamp"),
+                }
+                anomalies.append(anomaly)
+                self.recent.append(anomaly)
+        return anomalies
+
+    def score_window(self, device_id: str, field: str, values, update: bool = False) -> dict[str, np.ndarray]:
+        """デバイス・フィールドの検知器で窓全体をまとめて評価する"""
+        return self.detector(device_id, field).score_batch(values, update=update)
+
+    def outliers(self, message: dict) -> list[tuple[str, float, float]]:
+        """メッセージの各フィールドを検知器の窓と比較し、外れ値を返す（状態は更新しない）
+
+        subscriber は run_agent の前に ingest() するので、直前に取り込んだサンプルと同じ値は
+        取り込み時（窓に加える前）の z スコアを使う（自身を含む窓と比べると z が 0 に寄る）。
+
+        Returns:
+            [(フィールド名, 値, z スコア), ...]
+        """
+        device_id = str(message.get("device_id", ""))
+        result = []
+        for field, value in self.extract(message).items():
+            det = self._detectors.get((device_id, field))
+            if det is None:
+                continue
+            z = det.last_z if det.last_value == value else det.zscore(value)
+            if abs(z) > _Z_THRESHOLD:
+                result.append((field, value, z))
+        return result
+
+    def snapshot(self, device_id: str | None = None) -> dict:
+        """検知器の状態を返す（device_id 省略時は全デバイス）"""
+        return {
+            f"{dev}/{field}": det.snapshot()
+            for (dev, field), det in self._detectors.items()
+            if device_id is None or dev == device_id
+        }
+
+
+# プロセス共通のエンジン（IoT 受信時に subscriber から更新される）
+ENGINE = AnomalyEngine()
@@ -0,0 +1,177 @@
+"""planner / coder / reviewer の1回の呼び出しごとの予算
+
+固定のイテレーション上限の代わりに、ノード × ティアごとに次の4項目の予算を設け、
+いずれかを使い切った時点でツールループを打ち切る。
+
+- 経過時間（秒）: LLM 呼び出しは残り時間でタイムアウトさせる。ツールの実行中は打ち切らず、実行後に判定する
+- 入力トークン / 出力トークン: 応答の usage_metadata を積算する（入力は毎回の履歴全体の合計）
+- ツール呼び出し回数
+
+残りの予算はプロンプトとツール結果の末尾に添えてモデルに伝え、収束を促す。
+使い切った場合は途中までの書き込みをそのまま残し、ツールなしでまとめの応答を1回だけ求める。
+全体の倍率は AGENT_BUDGET_SCALE（既定 1.0）で調整できる。
+"""
+
+import os
+import time
+from dataclasses import dataclass
+
+_SCALE = max(0.1, float(os.environ.get("AGENT_BUDGET_SCALE", "1.0")))
+_LOW_RATIO = 0.2   # 残りがこの割合を下回った項目があれば、まとめに入るよう促す
+
+
+@dataclass(frozen=True)
+class Limits:
+    """1回の呼び出しの予算"""
+
+    seconds: float
+    input_tokens: int
+    output_tokens: int
+    tool_calls: int
+
+    def scaled(self, factor: float) -> "Limits":
+        return Limits(
+            self.seconds * factor,
+            int(self.input_tokens * factor),
+            int(self.output_tokens * factor),
+            max(1, int(self.tool_calls * factor)),
+        )
+
+
+# ノード → ティア → 予算（上位ティアほど1ステップが遅く、大きなタスクを任されるため多めに取る）
+_LIMITS = {
+    "planner": {
+        "haiku":  Limits(120, 150_000, 8_000, 10),
+        "sonnet": Limits(180, 150_000, 8_000, 10),
+        "opus":   Limits(240, 150_000, 8_000, 10),
+    },
+    "coder": {
+        "haiku":  Limits(300, 600_000, 32_000, 30),
+        "sonnet": Limits(480, 800_000, 48_000, 40),
+        "opus":   Limits(600, 1_000_000, 64_000, 40),
+    },
+    "reviewer": {
+        "haiku":  Limits(180, 300_000, 8_000, 15),
+        "sonnet": Limits(240, 400_000, 12_000, 20),
+        "opus":   Limits(300, 400_000, 12_000, 20),
+    },
+}
+
+# 表示用の項目名
+_LABELS = {
+    "seconds": "時間",
+    "input_tokens": "入力トークン",
+    "output_tokens": "出力トークン",
+    "tool_calls": "ツール呼び出し",
+}
+
+
+def limits_for(node: str, tier: str) -> Limits:
+    """ノードとティアの予算（未知のティアは haiku、未知のノードは coder の予算）"""
+    by_tier = _LIMITS.get(node, _LIMITS["coder"])
+    return by_tier.get(tier, by_tier["haiku"]).scaled(_SCALE)
+
+
+class Budget:
+    """1回のエージェント呼び出しで使った量と残り"""
+
+    def __init__(self, node: str, tier: str, limits: Limits | None = None):
+        self.node = node
+        self.tier = tier
+        self.limits = limits or limits_for(node, tier)
+        self.started = time.monotonic()
+        self.finished: float | None = None
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.tool_calls = 0
+        self.llm_calls = 0
+        self.exhausted = ""   # 使い切った項目（"seconds" など。使い切っていなければ ""）
+
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    def finish(self) -> None:
+        """呼び出しの終了時刻を記録する（以降の経過時間はこの時点で止まる）"""
+        self.finished = self.finished or time.monotonic()
+
+    def remaining_seconds(self) -> float:
+        return max(0.0, self.limits.seconds - self.elapsed())
+
+    def remaining_tool_calls(self) -> int:
+        return max(0, self.limits.tool_calls - self.tool_calls)
+
+    def charge(self, message) -> None:
+        """LLM の応答1件分のトークンを積算する"""
+        self.llm_calls += 1
+        usage = getattr(message, "usage_metadata", None) or {}
+        self.input_tokens += usage.get("input_tokens", 0) or 0
+        self.output_tokens += usage.get("output_tokens", 0) or 0
+
+    def charge_tools(self, count: int) -> None:
+        self.tool_calls += count
+
+    def exhaust(self, item: str) -> None:
+        self.exhausted = self.exhausted or item
+
+    def check(self) -> str:
+        """使い切った項目を返す（なければ ""）"""
+        if not self.exhausted:
+            used = self._used()
+            for item in _LABELS:
+                if used[item] >= getattr(self.limits, item):
+                    self.exhausted = item
+                    break
+        return self.exhausted
+
+    def _used(self) -> dict:
+        return {
+            "seconds": self.elapsed(),
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "tool_calls": self.tool_calls,
+        }
+
+    def is_low(self) -> bool:
+        used = self._used()
+        return any(
+            getattr(self.limits, item) - used[item] < getattr(self.limits, item) * _LOW_RATIO for item in _LABELS
+        )
+
+    def remaining_note(self) -> str:
+        """モデルに伝える残り予算"""
+        used = self._used()
+        note = (
+            f"【残り予算】時間 {self.remaining_seconds():.0f}秒 / "
+            f"入力トークン {max(0, self.limits.input_tokens - used['input_tokens']):,} / "
+            f"出力トークン {max(0, self.limits.output_tokens - used['output_tokens']):,} / "
+            f"ツール呼び出し {self.remaining_tool_calls()} 回"
+        )
+        if self.is_low():
+            note += "\n予算が残りわずかです。新しい調査は控え、作業をまとめて最終的な回答を返してください。"
+        return note
+
+    def exhausted_note(self) -> str:
+        """使い切ったときにまとめの応答を求める指示"""
+        return (
+            f"【予算切れ（{_LABELS.get(self.exhausted, self.exhausted)}）】これ以上ツールは使えません。"
+            f"ここまでの作業内容をもとに、指示された形式で最終的な回答を返してください。"
+        )
+
+    def snapshot(self) -> dict:
+        """task_status イベントに載せる使用量"""
+        return {
+            "node": self.node,
+            "tier": self.tier,
+            "seconds": round(self.elapsed(), 1),
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "tool_calls": self.tool_calls,
+            "llm_calls": self.llm_calls,
+            "limits": {
+                "seconds": self.limits.seconds,
+                "input_tokens": self.limits.input_tokens,
+                "output_tokens": self.limits.output_tokens,
+                "tool_calls": self.limits.tool_calls,
+            },
+            "exhausted": self.exhausted,
+        }
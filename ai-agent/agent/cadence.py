@@ -0,0 +1,242 @@
+"""ケイデンス（歩数/分）と運動強度の推定
+
+ESP32 は加速度の大きさ（|x|+|y|+|z|、m/s²）を bpm キーで送ってくるだけなので、
+エージェント側でデバイスごとのサンプル列から走行指標を求める。
+
+- 強度: 直近 _LEVEL_SECONDS 秒の加速度の大きさの平均（level）と窓全体のばらつき（variability）
+- ケイデンス: 窓付き FFT のピーク周波数（0.8〜3.8Hz = 48〜228 歩/分）。
+  高頻度のサンプル列（{"samples": [...], "sample_rate": Hz}）を送ってきた場合だけ求まる。
+  現在のファームウェアは 5 秒ごとの平均値（0.2Hz）しか送らないので常に None
+- 活動判定: ケイデンスが十分な信頼度で取れればそれを優先し、取れなければ
+  level にファームウェアと同じ閾値（20 / 30）をヒステリシス付きで適用する。
+  つまり現在のファームウェアでは、判定の改善は閾値付近でのステータスのばたつきを抑えることだけ
+
+1サンプルの追加は O(1)（窓の合計・二乗和・直近 level 分の合計を差分で更新する）。
+FFT と、サンプリング周波数から決まる level の件数の見直しは _HOP サンプルごとにまとめて行う。
+"""
+
+import math
+import time
+
+import numpy as np
+
+from agent.anomaly import acceleration_magnitude
+from agent.history import parse_timestamp
+
+_WINDOW = 256             # FFT の窓長（サンプル数）
+_HOP = 32                 # スペクトルを再計算する間隔（サンプル数）
+_MIN_FFT_SAMPLES = 64     # これ未満ではケイデンスを推定しない
+_BAND_HZ = (0.8, 3.8)     # ケイデンスとみなす周波数帯
+_MIN_CONFIDENCE = 0.3     # 帯域内パワーに占めるピークの割合がこれ以上なら採用
+_LEVEL_SECONDS = 5.0      # level を平均する時間幅（ファームウェアの平均化と同じ 5 秒）
+_RUN_LEVEL = 30.0         # ファームウェア（activity_status_from_magnitude）と同じ閾値
+_WALK_LEVEL = 20.0
+_HYSTERESIS = 2.0         # 状態を抜けるときは閾値からこれだけ下がるまで維持する
+_RUN_CADENCE = 140.0      # 歩/分
+_WALK_CADENCE = 60.0
+
+
+class CadenceEstimator:
+    """1デバイス分のサンプル窓とケイデンス・強度の推定器"""
+
+    __slots__ = (
+        "_values", "_ts", "_pos", "_count", "_pending", "_rate", "_dt", "_last_ts",
+        "_sum", "_sumsq", "_level_n", "_level_sum", "cadence", "confidence", "activity",
+    )
+
+    def __init__(self, window: int = _WINDOW):
+        self._values = np.zeros(window, dtype=np.float64)
+        self._ts = np.zeros(window, dtype=np.float64)
+        self._pos = 0
+        self._count = 0
+        self._pending = 0
+        self._rate: float | None = None  # 明示されたサンプリング周波数（Hz）
+        self._dt: float | None = None    # 受信間隔の指数移動平均（秒）
+        self._last_ts: float | None = None
+        self._sum = 0.0                  # 窓内の値の合計・二乗和
+        self._sumsq = 0.0
+        self._level_n = 1                # level を平均する件数（_LEVEL_SECONDS × サンプリング周波数）
+        self._level_sum = 0.0            # 直近 _level_n 件の合計
+        self.cadence: float | None = None
+        self.confidence = 0.0
+        self.activity: str | None = None
+
+    def add(self, value: float, ts: float) -> None:
+        """1サンプルを追加する（O(1)）"""
+        window = len(self._values)
+        if self._count == window:
+            old = self._values[self._pos]
+            self._sum -= old
+            self._sumsq -= old * old
+        if self._count >= self._level_n:
+            self._level_sum -= self._values[(self._pos - self._level_n) % window]
+        self._values[self._pos] = value
+        self._ts[self._pos] = ts
+        self._pos = (self._pos + 1) % window
+        self._count = min(self._count + 1, window)
+        self._pending += 1
+        self._sum += value
+        self._sumsq += value * value
+        self._level_sum += value
+        if self._last_ts is not None and ts > self._last_ts:
+            dt = ts - self._last_ts
+            self._dt = dt if self._dt is None else self._dt + 0.1 * (dt - self._dt)
+        self._last_ts = ts
+
+    def add_batch(self, values, rate: float, end_ts: float) -> None:
+        """一定周波数でサンプリングされた配列をまとめて追加する（合計は窓から求め直す）
+
+        Args:
+            values: 加速度の大きさ（古い順、数値のみ）
+            rate: サンプリング周波数（Hz）
+            end_ts: 最後のサンプルの時刻（UNIX 秒）
+        """
+        x = np.asarray(values, dtype=np.float64)[-len(self._values):]
+        ts = end_ts - np.arange(len(x) - 1, -1, -1) / rate
+        window = len(self._values)
+        idx = (self._pos + np.arange(len(x))) % window
+        self._values[idx] = x
+        self._ts[idx] = ts
+        self._pos = int((self._pos + len(x)) % window)
+        self._count = min(self._count + len(x), window)
+        self._pending += len(x)
+        self._rate = rate
+        self._last_ts = end_ts
+        self._resync()
+
+    def _ordered(self, n: int) -> tuple[np.ndarray, np.ndarray]:
+        """直近 n 件を古い順に返す"""
+        idx = (self._pos - n + np.arange(n)) % len(self._values)
+        return self._ts[idx], self._values[idx]
+
+    def sample_rate(self) -> float | None:
+        if self._rate is not None:
+            return self._rate
+        return 1.0 / self._dt if self._dt else None
+
+    def _resync(self) -> None:
+        """level の件数をサンプリング周波数から決め直し、合計を窓から求め直す（丸め誤差の蓄積も戻す）"""
+        rate = self.sample_rate()
+        self._level_n = min(len(self._values), max(1, round(rate * _LEVEL_SECONDS)) if rate else 1)
+        _, x = self._ordered(self._count)
+        self._sum = float(x.sum())
+        self._sumsq = float((x * x).sum())
+        self._level_sum = float(x[-self._level_n:].sum()) if self._count else 0.0
+
+    def _band_covered(self) -> bool:
+        """サンプリング周波数がケイデンスの帯域を捉えられるか（ナイキスト周波数が帯域の下端以上）"""
+        rate = self.sample_rate()
+        return rate is not None and rate / 2 >= _BAND_HZ[0]
+
+    def _estimate_cadence(self) -> None:
+        """窓付き FFT で帯域内のピーク周波数を求める"""
+        self._pending = 0
+        rate = self.sample_rate()
+        if self._count < _MIN_FFT_SAMPLES or not self._band_covered():
+            self.cadence, self.confidence = None, 0.0
+            return
+        _, x = self._ordered(self._count)
+        x = (x - x.mean()) * np.hanning(len(x))
+        power = np.abs(np.fft.rfft(x)) ** 2
+        freqs = np.fft.rfftfreq(len(x), d=1.0 / rate)
+        band = np.flatnonzero((freqs >= _BAND_HZ[0]) & (freqs <= _BAND_HZ[1]))
+        total = power[band].sum() if len(band) else 0.0
+        if total <= 0:
+            self.cadence, self.confidence = None, 0.0
+            return
+        peak = band[np.argmax(power[band])]
+        # 放物線補間でビン間の周波数を求める
+        offset = 0.0
+        if 0 < peak < len(power) - 1:
+            a, b, c = power[peak - 1], power[peak], power[peak + 1]
+            denom = a - 2 * b + c
+            if denom:
+                offset = 0.5 * (a - c) / denom
+        self.cadence = float((freqs[peak] + offset * (freqs[1] - freqs[0])) * 60.0)
+        self.confidence = float(power[max(peak - 1, 0):peak + 2].sum() / total)
+
+    def _classify(self, level: float) -> str:
+        if self.cadence is not None and self.confidence >= _MIN_CONFIDENCE:
+            if self.cadence >= _RUN_CADENCE:
+                return "Run"
+            if self.cadence >= _WALK_CADENCE:
+                return "Walk"
+        prev = self.activity
+        run_threshold = _RUN_LEVEL - (_HYSTERESIS if prev == "Run" else 0.0)
+        walk_threshold = _WALK_LEVEL - (_HYSTERESIS if prev in ("Run", "Walk") else 0.0)
+        if level > run_threshold:
+            return "Run"
+        if level > walk_threshold:
+            return "Walk"
+        return "None"
+
+    def update(self) -> dict:
+        """追加済みのサンプルから指標を更新して返す（FFT と合計の見直し以外は O(1)）"""
+        if self._pending >= _HOP:
+            self._resync()
+            self._estimate_cadence()
+        elif self.cadence is None and self._pending and self._count >= _MIN_FFT_SAMPLES and self._band_covered():
+            self._estimate_cadence()
+        n = max(1, min(self._count, self._level_n))
+        level = self._level_sum / n
+        mean = self._sum / self._count if self._count else 0.0
+        variability = math.sqrt(max(self._sumsq / self._count - mean * mean, 0.0)) if self._count else 0.0
+        self.activity = self._classify(level)
+        return {
+            "activity": self.activity,
+            "cadence_spm": round(self.cadence, 1) if self.cadence is not None else None,
+            "cadence_confidence": round(self.confidence, 3),
+            "intensity": {"level": round(level, 3), "variability": round(variability, 3)},
+        }
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+class CadenceTracker:
+    """デバイスごとの推定器の集合"""
+
+    def __init__(self, window: int = _WINDOW):
+        self.window = window
+        self._estimators: dict[str, CadenceEstimator] = {}
+
+    def estimator(self, device_id: str) -> CadenceEstimator:
+        est = self._estimators.get(device_id)
+        if est is None:
+            est = CadenceEstimator(self.window)
+            self._estimators[device_id] = est
+        return est
+
+    def ingest(self, message: dict) -> dict | None:
+        """受信メッセージから指標を更新する（加速度が含まれなければ None）
+
+        通常は 1メッセージ 1サンプル（bpm キーの加速度の大きさ）。高頻度のサンプル列を
+        {"samples": [...], "sample_rate": Hz} として送ってくる場合はまとめて取り込む。
+        """
+        ts = parse_timestamp(message.get("timestamp"))
+        if ts is None:
+            ts = time.time()
+        est = self.estimator(str(message.get("device_id", "")))
+
+        samples, rate = message.get("samples"), message.get("sample_rate")
+        if isinstance(samples, list) and _is_number(rate) and rate > 0:
+            samples = [float(v) for v in samples if _is_number(v)]   # 数値でないサンプルは捨てる
+            if samples:
+                est.add_batch(samples, float(rate), ts)
+                return est.update()
+
+        value = message.get("bpm")
+        if isinstance(message.get("acceleration"), dict):
+            value = acceleration_magnitude(message["acceleration"])
+        if not _is_number(value):
+            return None
+        est.add(float(value), ts)
+        return est.update()
+
+    def reset(self) -> None:
+        self._estimators.clear()
+
+
+# プロセス共通のトラッカー（trigger_check から更新される）
+TRACKER = CadenceTracker()
@@ -0,0 +1,189 @@
+"""トライグラム索引によるコード検索（search_code 用）
+
+ワークスペースのテキストファイルごとに、含まれる 3文字の組（小文字化）を索引にしておき、
+検索語から必ず含まれるトライグラムを取り出して候補ファイルを絞り込んでから本文を照合する。
+
+- 対象ファイルは file_index の一覧（.gitignore を考慮済み）のうち、サイズが
+  _MAX_FILE_BYTES 以下で UTF-8 として読めるもの
+- file_index が stat で見つけた変更・削除されたファイルだけを索引し直す（確認は
+  file_index._REFRESH_INTERVAL 秒ごとか write_file の後）
+- 正規表現はトップレベルの連接に含まれるリテラル部分からトライグラムを取り出す
+  （取り出せない場合は全ファイルが候補）
+"""
+
+import os
+import re
+
+from agent import file_index
+from agent.file_cache import CACHE as file_cache
+
+try:
+    import re._parser as _sre_parse  # Python 3.11+
+except ImportError:  # pragma: no cover
+    import sre_parse as _sre_parse
+
+_MAX_FILE_BYTES = 1024 * 1024
+_MAX_LINE_CHARS = 200
+_MAX_OUTPUT_CHARS = 8000
+
+
+def trigrams(text: str) -> set[str]:
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _required_literals(pattern: str, flags: int) -> list[str]:
+    """正規表現に一致する文字列が必ず含むリテラル部分を返す"""
+    try:
+        parsed = _sre_parse.parse(pattern, flags)
+    except re.error:
+        return []
+    literals, current = [], []
+    for op, arg in parsed:
+        if op is _sre_parse.LITERAL:
+            current.append(chr(arg))
+            continue
+        if op is _sre_parse.SUBPATTERN:
+            # グループの中身が単純なリテラル列ならそのまま続ける
+            sub = arg[-1]
+            if all(sub_op is _sre_parse.LITERAL for sub_op, _ in sub):
+                current.extend(chr(c) for _, c in sub)
+                continue
+        if current:
+            literals.append("".join(current))
+            current = []
+    if current:
+        literals.append("".join(current))
+    return literals
+
+
+class CodeSearchIndex(file_index.IncrementalIndex):
+    """1つのワークスペースに対するトライグラム索引"""
+
+    def __init__(self, root: str):
+        super().__init__(root)
+        self._files: dict[str, frozenset[str]] = {}   # 相対パス → trigrams
+        self._postings: dict[str, set[str]] = {}      # トライグラム → 相対パス
+        self.indexed = 0
+
+    def _remove(self, rel: str) -> None:
+        grams = self._files.pop(rel, None)
+        if grams is None:
+            return
+        for gram in grams:
+            paths = self._postings.get(gram)
+            if paths is not None:
+                paths.discard(rel)
+                if not paths:
+                    del self._postings[gram]
+
+    def _add(self, rel: str, size: int) -> None:
+        self._remove(rel)
+        grams: frozenset[str] = frozenset()
+        if size <= _MAX_FILE_BYTES:
+            try:
+                # 索引作成では読み込みキャッシュを汚さないように直接読む
+                with open(os.path.join(self.root, rel), "rb") as f:
+                    grams = frozenset(trigrams(f.read().decode("utf-8")))
+            except (OSError, UnicodeDecodeError):
+                pass  # バイナリ・読めないファイルは空の索引にして次回の stat まで読まない
+        self._files[rel] = grams
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(rel)
+        self.indexed += 1
+
+    def _update(self, changed: dict[str, int], removed: list[str]) -> None:
+        for rel in removed:
+            self._remove(rel)
+        for rel, size in changed.items():
+            self._add(rel, size)
+
+    def candidates(self, literals: list[str]) -> list[str]:
+        """リテラルのトライグラムをすべて含むファイルを返す"""
+        with self._lock:
+            self._refresh()
+            grams = set()
+            for literal in literals:
+                grams |= trigrams(literal)
+            if not grams:
+                return sorted(rel for rel, grams in self._files.items() if grams)
+            postings = sorted((self._postings.get(g, set()) for g in grams), key=len)
+            result = set(postings[0])
+            for paths in postings[1:]:
+                result &= paths
+                if not result:
+                    break
+            return sorted(result)
+
+    def search(
+        self,
+        query: str,
+        regex: bool = False,
+        ignore_case: bool = False,
+        path_pattern: str | None = None,
+        context: int = 1,
+        max_results: int = 30,
+    ) -> dict:
+        """検索して {"hits": [...], "total", "files_scanned", "truncated"} を返す
+
+        hits の要素は {"path", "line", "text", "before": [...], "after": [...]}
+        """
+        flags = re.IGNORECASE if ignore_case else 0
+        pattern = re.compile(query if regex else re.escape(query), flags)
+        literals = _required_literals(query, flags) if regex else [query]
+        files = self.candidates(literals)
+        if path_pattern:
+            path_re = re.compile(file_index.glob_to_regex(path_pattern))
+            use_name = "/" not in path_pattern
+            files = [f for f in files if path_re.fullmatch(f.rsplit("/", 1)[-1] if use_name else f)]
+
+        hits, total = [], 0
+        for rel in files:
+            try:
+                text = file_cache.read_text(os.path.join(self.root, rel))
+            except (OSError, UnicodeDecodeError):
+                continue
+            if not pattern.search(text):
+                continue
+            lines = text.split("\n")
+            for i, line in enumerate(lines):
+                if not pattern.search(line):
+                    continue
+                total += 1
+                if len(hits) < max_results:
+                    hits.append({
+                        "path": rel,
+                        "line": i + 1,
+                        "text": line[:_MAX_LINE_CHARS],
+                        "before": [l[:_MAX_LINE_CHARS] for l in lines[max(0, i - context):i]],
+                        "after": [l[:_MAX_LINE_CHARS] for l in lines[i + 1:i + 1 + context]],
+                    })
+        return {"hits": hits, "total": total, "files_scanned": len(files), "truncated": total > len(hits)}
+
+
+def format_hits(result: dict) -> str:
+    """検索結果を path:line 形式のテキストにする（_MAX_OUTPUT_CHARS で打ち切る）"""
+    if not result["hits"]:
+        return "（一致なし）"
+    blocks, size = [], 0
+    shown = 0
+    for hit in result["hits"]:
+        start = hit["line"] - len(hit["before"])
+        lines = [f"{hit['path']}:{start + j}- {l}" for j, l in enumerate(hit["before"])]
+        lines.append(f"{hit['path']}:{hit['line']}: {hit['text']}")
+        lines += [f"{hit['path']}:{hit['line'] + 1 + j}- {l}" for j, l in enumerate(hit["after"])]
+        block = "\n".join(lines)
+        if size + len(block) > _MAX_OUTPUT_CHARS and blocks:
+            break
+        blocks.append(block)
+        size += len(block) + 5
+        shown += 1
+    footer = f"\n[{result['total']}件中 {shown}件を表示]" if result["total"] > shown else ""
+    return "\n--\n".join(blocks) + footer
+
+
+_indexes = file_index.Registry(CodeSearchIndex)
+
+
+def get_index(root: str) -> CodeSearchIndex:
+    return _indexes.get(root)
@@ -2,15 +2,22 @@ import json
 import os
 import re
 import asyncio
+from contextvars import ContextVar
 from typing import Literal
 
 from langchain_aws import ChatBedrockConverse
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, ToolMessage
 from langgraph.graph import StateGraph, START, END
 from langgraph.prebuilt import ToolNode
 
+from agent import budget, llm_gateway, repo_map, retrieval, review_diff, tier_router, worktrees
+from agent.file_cache import CACHE as file_cache
+from agent.sessions import TRACKER as session_tracker
 from agent.state import DevAgentState
-from agent.tools import FILE_TOOLS, get_is_running, set_workspace_root, get_iot_status
+from agent.tools import (
+    FILE_TOOLS, get_iot_status, get_run_device, invalidate_paths, reset_run_device, reset_workspace_root,
+    set_run_device, set_workspace_root, track_changes,
+)
 from api.events import broadcast
 
 _REGION = os.environ.get("AWS_BEDROCK_REGION", os.environ.get("AWS_REGION", "us-east-1"))
@@ -27,6 +34,13 @@ _MODEL_IDS = {
 }
 _TIER_ORDER = ["haiku", "sonnet", "opus"]
 
+# レイテンシ SLO 超過時のヘッジ先（同ティアの旧世代モデル）
+_FALLBACK_TIERS = {
+    "haiku": "haiku-3",
+    "sonnet": "sonnet-3",
+    "opus": "opus-3",
+}
+
 # 実行計画専用ファイルパス
 # 注: .github/docs/tasks.md は人間向けの設計・方針ドキュメント
 # docs/plan.md はエージェントに渡す「次にやること」を自然言語で記述する実行計画専用
@@ -44,20 +58,115 @@ def _lower_tier(tier: str) -> str:
     return _TIER_ORDER[max(0, idx - 1)]
 
 
-async def _invoke_agent(prompt: str, tier: str, max_iterations: int = 20) -> str:
-    """単一ターンのエージェント呼び出し（ツールループ付き）"""
+def _hedge_tier(tier: str) -> str | None:
+    """ヘッジ先のティアを返す（旧世代モデル、なければ1段階下のティア）"""
+    if tier in _FALLBACK_TIERS:
+        return _FALLBACK_TIERS[tier]
+    lower = _lower_tier(tier)
+    return lower if lower != tier else None
+
+
+_WRAP_UP_SECONDS = 60   # 予算切れ後のまとめの応答を待つ上限（秒）
+
+
+def _text(message) -> str:
+    """応答の本文（ツール呼び出しを含む応答はブロックのリストになる）"""
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+
+
+def _append_note(messages: list, note: str) -> None:
+    """最後のツール結果の末尾にモデルへの注記を添える"""
+    last = messages[-1]
+    if isinstance(last, ToolMessage) and isinstance(last.content, str):
+        last.content = f"{last.content}\n\n{note}"
+
+
+async def _invoke_agent(prompt: str, tier: str, node_budget: budget.Budget | None = None) -> str:
+    """単一ターンのエージェント呼び出し（ツールループ付き）
+
+    ノード × ティアごとの予算（経過時間・入出力トークン・ツール呼び出し回数）の範囲でツールループを回す。
+    予算を使い切った場合は途中までの書き込みを残したまま、ツールなしのまとめの応答を1回だけ求めて返す。
+    """
+    node_budget = node_budget or budget.Budget("coder", tier)
+    model_id = _MODEL_IDS.get(tier, _MODEL_IDS["haiku"])
     llm_with_tools = _get_llm(tier).bind_tools(FILE_TOOLS)
-    messages = [HumanMessage(content=prompt)]
-    for i in range(max_iterations):
-        response = await llm_with_tools.ainvoke(messages)
-        messages.append(response)
-        if not response.tool_calls:
-            return response.content or ""
-        tool_node = ToolNode(FILE_TOOLS)
-        tool_result = await tool_node.ainvoke({"messages": messages})
-        messages = messages + tool_result["messages"]
-    print(f"[agent] 最大イテレーション数({max_iterations})に達しました")
-    return messages[-1].content if messages else ""
+    hedge = None
+    hedge_tier = _hedge_tier(tier)
+    if hedge_tier:
+        hedge = (_get_llm(hedge_tier).bind_tools(FILE_TOOLS), _MODEL_IDS[hedge_tier])
+
+    async def call(timeout: float):
+        return await asyncio.wait_for(
+            llm_gateway.ainvoke_hedged(
+                llm_with_tools, messages,
+                model_id=model_id, latency_key=tier, hedge=hedge,
+                priority=llm_gateway.PRIORITY_INTERACTIVE,
+            ),
+            timeout=timeout,
+        )
+
+    messages = [HumanMessage(content=f"{prompt}\n\n{node_budget.remaining_note()}")]
+    last_text = ""
+    try:
+        while not node_budget.check():
+            try:
+                response = await call(node_budget.remaining_seconds())
+            except asyncio.TimeoutError:
+                node_budget.exhaust("seconds")
+                break
+            node_budget.charge(response)
+            messages.append(response)
+            last_text = _text(response) or last_text
+            if not response.tool_calls:
+                return last_text
+            if len(response.tool_calls) > node_budget.remaining_tool_calls():
+                # 実行しないツール呼び出しにも結果を返さないと次の呼び出しが拒否される
+                node_budget.exhaust("tool_calls")
+                messages.extend(
+                    ToolMessage(content="予算切れのため実行しませんでした。", tool_call_id=tool_call["id"])
+                    for tool_call in response.tool_calls
+                )
+                break
+            tool_node = ToolNode(FILE_TOOLS)
+            tool_result = await tool_node.ainvoke({"messages": messages})
+            messages = messages + tool_result["messages"]
+            node_budget.charge_tools(len(response.tool_calls))
+            _append_note(messages, node_budget.remaining_note())
+
+        print(f"[agent] 予算切れ: {node_budget.snapshot()}")
+        if not isinstance(messages[-1], ToolMessage):
+            return last_text
+        _append_note(messages, node_budget.exhausted_note())
+        try:
+            response = await call(_WRAP_UP_SECONDS)
+        except asyncio.TimeoutError:
+            return last_text
+        node_budget.charge(response)
+        return _text(response) or last_text
+    finally:
+        node_budget.finish()
+
+
+_MAX_PLAN_CHARS = 8000
+_PLANNER_MAP_CHARS = 6000   # プロンプトに入れるシンボル一覧の上限（文字数）
+_CODER_MAP_CHARS = 3000
+_PREFETCH_FILE_CHARS = 12000    # coder のプロンプトに埋め込むファイル1件あたりの上限（文字数）
+_PREFETCH_TOTAL_CHARS = 40000   # 埋め込むファイル全体の上限（文字数）
+
+
+def _plan_context(workspace_root: str) -> tuple[str, str]:
+    """plan.md の内容と、項目ごとの関連ファイル候補（BM25）を返す。plan.md がなければ空文字"""
+    path = os.path.join(workspace_root, _PLAN_PATH)
+    try:
+        plan_text = file_cache.read_text(path)
+    except (OSError, UnicodeDecodeError):
+        return "", ""
+    entries = retrieval.shortlist(workspace_root, plan_text, exclude=(_PLAN_PATH,))
+    print(f"[planner] 関連ファイル候補: {sum(len(e['files']) for e in entries)} 件（{len(entries)} 項目）")
+    return plan_text[:_MAX_PLAN_CHARS], retrieval.format_shortlist(entries)
 
 
 async def planner_node(state: DevAgentState) -> dict:
@@ -65,20 +174,45 @@ async def planner_node(state: DevAgentState) -> dict:
     workspace_root = state.get("workspace_root", "")
     tier = state.get("model_tier", "haiku")
 
+    loop = asyncio.get_running_loop()
+    plan_text, candidates = await loop.run_in_executor(None, _plan_context, workspace_root)
+    outline = await loop.run_in_executor(None, repo_map.render, workspace_root, _PLANNER_MAP_CHARS)
+    if plan_text:
+        plan_step = (
+            f"1. 下記の `{_PLAN_PATH}` の内容（ユーザーが自然言語で書いた要件・やりたいことが記載されている）を確認する\n"
+        )
+    else:
+        plan_step = (
+            f"1. `{_PLAN_PATH}` を read_file で読み込む（ユーザーが自然言語で書いた要件・やりたいことが記載されている）\n"
+        )
+    context = ""
+    if plan_text:
+        context += f"\n【{_PLAN_PATH} の内容】\n{plan_text}\n"
+    if candidates:
+        context += (
+            f"\n【関連ファイル候補（BM25 による自動推定。項目ごとに関連度の高い順）】\n{candidates}\n"
+            f"候補は目安です。read_files / write_files はこれを起点に、必要なものだけを選んでください\n"
+        )
+    if outline:
+        context += f"\n【リポジトリ構成（ファイルごとのクラス・関数）】\n{outline}\n"
+
     prompt = (
         f"あなたは自律開発エージェントのプランナーです。\n"
         f"ワークスペース: {workspace_root}\n\n"
         f"手順:\n"
-        f"1. `{_PLAN_PATH}` を read_file で読み込む（ユーザーが自然言語で書いた要件・やりたいことが記載されている）\n"
+        f"{plan_step}"
         f"   注: このファイルは実行計画専用で、エージェントが実装すべき次のタスクが記述されています\n"
-        f"2. list_files でプロジェクト構造を把握し、必要に応じて既存コードを read_file で確認する\n"
+        f"2. 下記の関連ファイル候補とリポジトリ構成から対象を絞る。足りない場合だけ list_files で構造を確認し、"
+        f"関連するシンボルや文字列は search_code で探す。必要に応じて既存コードを read_file で確認する\n"
         f"3. 要件を実装可能な具体的タスクに分解する。各タスクは独立して実装できる単位にすること\n\n"
         f"最終的な出力は以下のJSON形式のみで返してください（余分な説明不要）:\n"
-        f'[{{"task": "タスク1の具体的な実装内容", "read_files": ["読む必要があるファイルパス"], "write_files": ["編集・作成するファイルパス"]}}, ...]'
+        f'[{{"task": "タスク1の具体的な実装内容", "read_files": ["読む必要があるファイルパス"], "write_files": ["編集・作成するファイルパス"]}}, ...]\n'
+        f"{context}"
     )
 
     print(f"[planner] model_tier={tier} ({_MODEL_IDS.get(tier)})")
-    response = await _invoke_agent(prompt, tier)
+    planner_budget = budget.Budget("planner", tier)
+    response = await _invoke_agent(prompt, tier, planner_budget)
 
     try:
         start = response.find("[")
@@ -108,7 +242,8 @@ async def planner_node(state: DevAgentState) -> dict:
                 for i, t in enumerate(task_list)
             ],
             "total_count": len(task_list),
-            "message": f"タスク分解完了: {len(task_list)} 件のタスクを生成しました"
+            "message": f"タスク分解完了: {len(task_list)} 件のタスクを生成しました",
+            "budget": planner_budget.snapshot(),
         })
     else:
         print("[planner] タスクリストが空です。終了します。")
@@ -116,7 +251,8 @@ async def planner_node(state: DevAgentState) -> dict:
             "type": "task_list",
             "tasks": [],
             "total_count": 0,
-            "message": "タスクが見つかりませんでした"
+            "message": "タスクが見つかりませんでした",
+            "budget": planner_budget.snapshot(),
         })
 
     first = task_list[0] if task_list else {}
@@ -146,27 +282,194 @@ async def planner_node(state: DevAgentState) -> dict:
     }
 
 
+# この実行で割り当てた worktree。ノードの例外・キャンセルで reviewer まで進まなかった分を run_dev_agent で返す
+_run_worktrees_var: ContextVar[list[tuple[worktrees.WorktreePool, worktrees.Worktree]] | None] = ContextVar(
+    "run_worktrees", default=None,
+)
+
+
+async def _enter_task_workspace(state: DevAgentState) -> str:
+    """タスク用の worktree を割り当て（割り当て済みならそれを使い）、ツールの作業先を切り替える
+
+    Returns:
+        worktree 内のワークスペースルート（worktree を使えない場合は ""。元のチェックアウトで作業する）
+    """
+    workspace_root = state.get("workspace_root", "")
+    task_workspace = state.get("task_workspace", "")
+    if not task_workspace:
+        loop = asyncio.get_running_loop()
+        try:
+            pool = await loop.run_in_executor(None, worktrees.get_pool, workspace_root)
+            if pool is not None:
+                worktree = await loop.run_in_executor(None, pool.acquire, workspace_root)
+                task_workspace = worktree.workspace
+                acquired = _run_worktrees_var.get()
+                if acquired is not None:
+                    acquired.append((pool, worktree))
+        except Exception as e:
+            print(f"[worktrees] worktree を割り当てられないため元のチェックアウトで作業します: {e}")
+    set_workspace_root(task_workspace or workspace_root)
+    return task_workspace
+
+
+async def _leave_task_workspace(state: DevAgentState, passed: bool) -> None:
+    """タスクの worktree での変更を、PASS なら元のチェックアウトに反映し、FAIL なら捨てる"""
+    workspace_root = state.get("workspace_root", "")
+    task_index = state.get("task_index", 0)
+    set_workspace_root(workspace_root)
+    found = worktrees.find(state.get("task_workspace", ""))
+    if found is None:
+        return
+    pool, worktree = found
+    loop = asyncio.get_running_loop()
+    action, changed, error = "discarded", [], ""
+    if passed:
+        try:
+            changed = await loop.run_in_executor(None, pool.merge, worktree)
+            invalidate_paths([os.path.join(pool.repo, path) for path in changed])
+            action = "merged"
+        except (worktrees.MergeConflict, RuntimeError) as e:
+            action, error = "conflict", str(e)
+    await loop.run_in_executor(None, pool.release, worktree, action != "merged")
+    print(f"[worktrees] タスク {task_index}: {action}（{len(changed)} ファイル）{error}")
+    await broadcast({"type": "worktree", "task_index": task_index, "action": action, "files": changed, "error": error})
+
+
+def _load_prefetch(root: str, rel: str) -> tuple[str, str | None, bool]:
+    """(相対パス, 内容, バイナリか) を返す。ワークスペース外・存在しない・ディレクトリ・テキストでなければ内容は None"""
+    real_root = os.path.realpath(root)
+    full_path = os.path.realpath(os.path.join(root, rel))
+    if os.path.commonpath([full_path, real_root]) != real_root or not os.path.isfile(full_path):
+        return rel, None, False
+    try:
+        return rel, file_cache.read_text(full_path), False
+    except UnicodeDecodeError:
+        return rel, None, True
+    except OSError:
+        return rel, None, False
+
+
+def _line_total(text: str) -> int:
+    return text.count("\n") + (1 if text and not text.endswith("\n") else 0)
+
+
+def _clip(text: str, limit: int) -> tuple[str, int]:
+    """limit 文字以内に収まる行までに切り詰め、(切り詰めた内容, 含めた行数) を返す"""
+    if len(text) <= limit:
+        return text, _line_total(text)
+    cut = text.rfind("\n", 0, limit) + 1
+    return text[:cut], text.count("\n", 0, cut)
+
+
+async def _prefetch_files(root: str, paths: list[str]) -> str:
+    """planner が挙げたファイルを並行して読み込み、coder のプロンプトに埋め込むブロックを返す
+
+    1件あたり _PREFETCH_FILE_CHARS、全体で _PREFETCH_TOTAL_CHARS を超える分は行単位で切り詰め、
+    続きを read_file_lines で読むよう注記する。存在しないファイル（新規作成予定）は名前だけ挙げる。
+    """
+    rels = list(dict.fromkeys(os.path.normpath(p).replace(os.sep, "/") for p in paths if p))
+    if not root or not rels:
+        return ""
+    loop = asyncio.get_running_loop()
+    loaded = await asyncio.gather(*(loop.run_in_executor(None, _load_prefetch, root, rel) for rel in rels))
+
+    blocks, missing, skipped, binary = [], [], [], []
+    remaining = _PREFETCH_TOTAL_CHARS
+    for rel, text, is_binary in loaded:
+        if is_binary:
+            binary.append(rel)
+            continue
+        if text is None:
+            missing.append(rel)
+            continue
+        total = _line_total(text)
+        if remaining <= 0:
+            skipped.append(rel)
+            continue
+        body, shown = _clip(text, min(_PREFETCH_FILE_CHARS, remaining))
+        if text and not body:   # 先頭行すら残りの上限に収まらない
+            skipped.append(rel)
+            continue
+        remaining -= len(body)
+        if shown < total:
+            body += f"…（{shown + 1} 行目以降の {total - shown} 行は省略。続きは read_file_lines で読んでください）\n"
+        elif body and not body.endswith("\n"):
+            body += "\n"
+        blocks.append(f'<file path="{rel}" lines="{total}">\n{body}</file>')
+
+    parts = []
+    if blocks:
+        parts.append("【planner が挙げたファイルの現在の内容（read_file で読み直す必要はありません）】\n" + "\n".join(blocks))
+    if skipped:
+        parts.append(f"【容量の上限で埋め込まなかったファイル（必要なら read_file_lines で読む）】\n{skipped}")
+    if binary:
+        parts.append(f"【テキストでないため埋め込まなかったファイル】\n{binary}")
+    if missing:
+        parts.append(f"【まだ存在しないファイル（新規作成）】\n{missing}")
+    return "\n\n".join(parts)
+
+
 async def coder_node(state: DevAgentState) -> dict:
     """current_task を実装しファイルに書き込む"""
     task = state.get("current_task", "")
-    workspace_root = state.get("workspace_root", "")
-    tier = state.get("model_tier", "haiku")
+    task_workspace = await _enter_task_workspace(state)
+    workspace_root = task_workspace or state.get("workspace_root", "")
     read_files = state.get("current_read_files", [])
     write_files = state.get("current_write_files", [])
     revision_count = state.get("revision_count", 0)
     review_result = state.get("review_result", "")
     task_index = state.get("task_index", 0)
 
-    await broadcast({"type": "task_status", "task_index": task_index, "status": "coding"})
+    # タスクごとにティアを選ぶ（修正ループ中は同じティアを使い続ける）
+    tier = state.get("task_tier", "")
+    complexity = state.get("task_complexity", "")
+    if revision_count == 0 or not tier:
+        loop = asyncio.get_running_loop()
+        estimate = await loop.run_in_executor(
+            None, tier_router.estimate_complexity, workspace_root, read_files, write_files
+        )
+        complexity = estimate["bucket"]
+        tier = await loop.run_in_executor(None, tier_router.select_tier, complexity, state.get("model_tier", "haiku"))
+        print(f"[coder] タスク規模={estimate} → tier={tier}")
+
+    # reviewer に差分を渡すため、タスク開始時の内容を控える（修正ループ中は同じ控えに追記していく）。
+    # worktree で作業する場合は割り当て時のスナップショットとの git diff を使うので控えない
+    originals = state.get("task_originals")
+    if task_workspace:
+        originals = {}
+    else:
+        if revision_count == 0 or originals is None:
+            originals = await asyncio.get_running_loop().run_in_executor(
+                None, review_diff.snapshot, workspace_root, write_files
+            )
+        track_changes(originals)
+
+    await broadcast({
+        "type": "task_status",
+        "task_index": task_index,
+        "status": "coding",
+        "model_tier": tier,
+    })
 
+    # planner が挙げたファイルは先に並行して読み込み、プロンプトに埋め込む（read_file の往復を省く）
+    prefetched, outline = await asyncio.gather(
+        _prefetch_files(workspace_root, read_files + write_files),
+        asyncio.get_running_loop().run_in_executor(
+            None, repo_map.render, workspace_root, _CODER_MAP_CHARS, read_files + write_files
+        ),
+    )
     file_hint = ""
     if read_files or write_files:
         file_hint = (
             f"\n\n【ファイルヒント（plannerが特定済み）】\n"
             f"読み込むファイル: {read_files}\n"
             f"編集・作成するファイル: {write_files}\n"
-            f"list_files による探索は不要です。上記ファイルを直接 read_file してください。"
+            f"list_files による探索は不要です。"
         )
+    if prefetched:
+        file_hint += f"\n\n{prefetched}"
+
+    outline_hint = f"\n\n【リポジトリ構成（ファイルごとのクラス・関数）】\n{outline}" if outline else ""
 
     revision_hint = ""
     if revision_count > 0 and review_result:
@@ -182,44 +485,82 @@ async def coder_node(state: DevAgentState) -> dict:
         f"ワークスペース: {workspace_root}\n\n"
         f"以下のタスクを実装してください:\n{task}"
         f"{file_hint}"
+        f"{outline_hint}"
         f"{revision_hint}\n\n"
-        f"read_file で対象ファイルを読み込んだ上で、"
-        f"write_file で実装コードをファイルに書き込んでください。\n"
-        f"実装後は run_shell でテストやビルドを実行して動作確認してください。\n"
+        f"埋め込み済みのファイルはそのまま使い、それ以外に必要なファイルだけを読み込んだ上で"
+        f"（関数や呼び出し箇所の場所は search_code で探し、大きなファイルは read_file_lines で必要な範囲だけ読む）、"
+        f"既存ファイルの変更は apply_patch で変更箇所だけを差分として書き込み、"
+        f"新規ファイルや全体を書き直す場合のみ write_file を使ってください。\n"
+        f"実装後は run_affected_tests に変更したファイルを渡して影響を受ける Python のテストだけを実行し、"
+        f"個別のテストは run_tests（常駐ワーカーで即座に起動する）、それ以外のテストやビルドは "
+        f"run_shell で実行して動作確認してください。\n"
         f"一時的なテストファイルは `agent_test_` で始まる名前にしてください。\n"
         f"一時的なドキュメント・レポートファイルは `agent_` で始まる名前にしてください。"
     )
 
-    await _invoke_agent(prompt, tier)
-    return {"messages": []}
+    # 予算を使い切った場合も途中までの書き込みはそのまま reviewer に渡す
+    coder_budget = budget.Budget("coder", tier)
+    await _invoke_agent(prompt, tier, coder_budget)
+    return {
+        "messages": [],
+        "task_tier": tier,
+        "task_complexity": complexity,
+        "task_workspace": task_workspace,
+        "task_originals": originals,
+        "task_budget": {"coder": coder_budget.snapshot()},
+    }
 
 
 async def reviewer_node(state: DevAgentState) -> dict:
     """実装コードをレビューし、PASS/FAIL判定と修正要否をstateに返す"""
     task = state.get("current_task", "")
-    workspace_root = state.get("workspace_root", "")
-    tier = _lower_tier(state.get("model_tier", "haiku"))  # レビューは1段階下
+    workspace_root = state.get("task_workspace") or state.get("workspace_root", "")
+    set_workspace_root(workspace_root)
+    coder_tier = state.get("task_tier") or state.get("model_tier", "haiku")
+    tier = _lower_tier(coder_tier)  # レビューは1段階下
     write_files = state.get("current_write_files", [])
     revision_count = state.get("revision_count", 0)
     task_index = state.get("task_index", 0)
 
+    # coder の変更をファイル全体ではなく差分（前後の文脈付き）で渡す
+    loop = asyncio.get_running_loop()
+    found = worktrees.find(state.get("task_workspace", ""))
+    try:
+        if found is not None:
+            diff = await loop.run_in_executor(None, review_diff.render_worktree, *found)
+        else:
+            diff = await loop.run_in_executor(None, review_diff.render, workspace_root, state.get("task_originals") or {})
+    except RuntimeError as e:
+        print(f"[reviewer] 差分を作れませんでした: {e}")
+        diff = ""
     file_hint = ""
-    if write_files:
+    if diff:
+        file_hint = (
+            f"\n\n【coder の変更差分（タスク開始時からの unified diff、前後の文脈付き）】\n"
+            f"```diff\n{diff}```\n"
+            f"レビューは基本的にこの差分で行ってください。差分の外側（呼び出し元や関連する定義など）を"
+            f"確認する必要がある場合だけ、search_code で場所を探して read_file_lines で必要な範囲を読んでください。"
+        )
+    elif write_files:
         file_hint = (
             f"\n\n【ファイルヒント（plannerが特定済み）】\n"
             f"レビュー対象ファイル: {write_files}\n"
             f"list_files による探索は不要です。上記ファイルを直接 read_file してください。"
         )
 
+    read_hint = "" if diff else "read_file で実装ファイルを読み込んでレビューしてください。\n"
+
     print(f"[reviewer] model_tier={tier} ({_MODEL_IDS.get(tier)}), revision_count={revision_count}")
-    await broadcast({"type": "task_status", "task_index": task_index, "status": "reviewing"})
+    task_budget = dict(state.get("task_budget") or {})
+    await broadcast({"type": "task_status", "task_index": task_index, "status": "reviewing", "budget": dict(task_budget)})
     prompt = (
         f"あなたは自律開発エージェントのレビュアーです。\n"
         f"ワークスペース: {workspace_root}\n\n"
         f"以下のタスクについて実装されたコードをレビューしてください:\n{task}"
         f"{file_hint}\n\n"
-        f"read_file で実装ファイルを読み込んでレビューしてください。\n"
-        f"必要に応じて run_shell でテストを実行し、動作を確認してください。\n\n"
+        f"{read_hint}"
+        f"必要に応じて run_affected_tests（変更したファイルに影響を受ける Python のテストだけを実行）、"
+        f"run_tests（個別の Python のテスト）や run_shell でテストを実行し、動作を確認してください。\n\n"
         f"レビュー基準:\n"
         f"- コードがタスクの要件を満たしているか\n"
         f"- 構文エラーや明らかなバグがないか\n"
@@ -232,7 +573,9 @@ async def reviewer_node(state: DevAgentState) -> dict:
         f"※ <review_result> タグの中身は必ず有効なJSONにしてください。"
     )
 
-    response = await _invoke_agent(prompt, tier)
+    reviewer_budget = budget.Budget("reviewer", tier)
+    response = await _invoke_agent(prompt, tier, reviewer_budget)
+    task_budget["reviewer"] = reviewer_budget.snapshot()
 
     # <review_result>タグ内のJSONを抽出
     tag_match = re.search(r"<review_result>\s*(.*?)\s*</review_result>", response, re.DOTALL)
@@ -266,23 +609,35 @@ async def reviewer_node(state: DevAgentState) -> dict:
         f"- **修正回数**: {revision_count}\n\n"
         f"## コメント\n{comment}\n"
     )
-    review_path = os.path.join(workspace_root, f"docs/review_{task_index:02d}.md")
+    # レビュー結果は worktree ではなく元のチェックアウトに残す（FAIL で worktree を捨てても残るように）
+    review_path = os.path.join(state.get("workspace_root", ""), f"docs/review_{task_index:02d}.md")
     os.makedirs(os.path.dirname(review_path), exist_ok=True)
     with open(review_path, "w", encoding="utf-8") as f:
         f.write(review_summary)
 
     final_needs_revision = needs_revision and revision_count < 2
+    if not final_needs_revision:
+        session_tracker.task_completed(get_run_device())
+        await _leave_task_workspace(state, result == "PASS")
+    if not final_needs_revision and state.get("task_complexity"):
+        # タスク完了時に結果を記録し、次回以降のティア選択に使う
+        await asyncio.get_running_loop().run_in_executor(
+            None, tier_router.record_outcome, state["task_complexity"], coder_tier, result == "PASS", revision_count
+        )
     await broadcast({
         "type": "task_status",
         "task_index": task_index,
         "status": "done" if not final_needs_revision else "revision",
         "result": result,
+        "budget": task_budget,
     })
 
     return {
         "review_result": comment,
         "needs_revision": final_needs_revision,
         "messages": [],
+        "task_workspace": state.get("task_workspace", "") if final_needs_revision else "",
+        "task_budget": task_budget,
     }
 
 
@@ -351,6 +706,8 @@ async def running_check_node(state: DevAgentState) -> dict:
         "revision_count": 0,  # 次のタスクのためにリセット
         "needs_revision": False,
         "review_result": "",
+        "task_originals": {},
+        "task_budget": {},
         "task_index": next_task_index,  # インクリメントされたインデックスを返す
     }
 
@@ -383,22 +740,56 @@ _builder.add_conditional_edges("running_check", should_continue_dev)
 dev_graph = _builder.compile()
 
 
-async def run_dev_agent(workspace_root: str, model_tier: str = "haiku", plan_path: str = _PLAN_PATH) -> str:
-    """走行開始トリガーで呼び出す自律開発エージェントのエントリーポイント"""
-    set_workspace_root(workspace_root)
-    result = await dev_graph.ainvoke({
-        "workspace_root": workspace_root,
-        "model_tier": model_tier,
-        "task_list": [],
-        "current_task": "",
-        "current_read_files": [],
-        "current_write_files": [],
-        "is_running": True,
-        "messages": [],
-        "revision_count": 0,
-        "needs_revision": False,
-        "review_result": "",
-        "task_index": 0,
-    })
+def _release_leftover_worktrees(acquired: list[tuple[worktrees.WorktreePool, worktrees.Worktree]]) -> None:
+    """reviewer の PASS / FAIL を経ずに終わったタスクの worktree を、変更を捨ててプールに返す"""
+    for pool, worktree in acquired:
+        if pool.get(worktree.workspace) is not worktree:
+            continue   # reviewer で返却済み（同じパスを別のタスクが割り当て中の場合も含む）
+        try:
+            pool.release(worktree, discarded=True)
+            print(f"[worktrees] 中断したタスクの worktree を返却しました: {worktree.path}")
+        except Exception as e:
+            print(f"[worktrees] 中断したタスクの worktree を返却できません: {e}")
+
+
+async def run_dev_agent(
+    workspace_root: str, model_tier: str = "haiku", plan_path: str = _PLAN_PATH, device_id: str = "",
+) -> str:
+    """走行開始トリガーで呼び出す自律開発エージェントのエントリーポイント
+
+    ワークスペースとデバイスIDはこの実行のコンテキストにだけ設定するため、
+    別のワークスペース・デバイスの実行を同じプロセスで並行させられる。
+    """
+    workspace_token = set_workspace_root(workspace_root)
+    device_token = set_run_device(device_id)
+    acquired: list[tuple[worktrees.WorktreePool, worktrees.Worktree]] = []
+    worktrees_token = _run_worktrees_var.set(acquired)
+    try:
+        result = await dev_graph.ainvoke({
+            "workspace_root": workspace_root,
+            "model_tier": model_tier,
+            "task_list": [],
+            "current_task": "",
+            "current_read_files": [],
+            "current_write_files": [],
+            "is_running": True,
+            "messages": [],
+            "revision_count": 0,
+            "needs_revision": False,
+            "review_result": "",
+            "task_index": 0,
+            "task_tier": "",
+            "task_complexity": "",
+            "task_workspace": "",
+            "task_originals": {},
+            "task_budget": {},
+        })
+    finally:
+        _run_worktrees_var.reset(worktrees_token)
+        reset_run_device(device_token)
+        reset_workspace_root(workspace_token)
+        if acquired:
+            # キャンセル後もここで返却を待つ（スレッドでの git 操作は途中で止まらないため shield する）
+            await asyncio.shield(asyncio.get_running_loop().run_in_executor(None, _release_leftover_worktrees, acquired))
     remaining = len(result.get("task_list", []))
     return f"✅ 自律開発完了（残タスク: {remaining} 件、使用ティア: {model_tier}）"
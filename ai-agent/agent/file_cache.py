@@ -0,0 +1,171 @@
+"""ワークスペースファイルの読み込みキャッシュ
+
+coder / reviewer ノードや修正ループは同じファイルを read_file で何度も読み直すため、
+デコード済みのテキストをプロセス共通の LRU キャッシュに保持する。
+
+- キーは (パス, mtime_ns, サイズ)。stat が変わっていればミスとして読み直す
+- 合計バイト数が上限を超えたら最も古く使われたエントリから捨てる
+- write_file で書き込んだパスは明示的に無効化する
+- 大きなファイルは mmap 経由でデコードする（中間のバイト列コピーを作らない）
+
+read_file_lines / tail_file 用に、ファイルごとの行頭バイトオフセットの索引も持つ。
+索引は初回に一度だけ作り（mtime_ns / サイズが変わったら作り直す）、
+以降の行範囲の読み込みは seek して必要なバイトだけを読む。
+"""
+
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+_DEFAULT_MAX_BYTES = int(os.environ.get("FILE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+_MMAP_THRESHOLD = 1024 * 1024  # これ以上のファイルは mmap で読む
+_MAX_LINE_INDEXES = 256         # 行オフセット索引を保持するファイル数
+
+
+def _decode(data) -> str:
+    """UTF-8 でデコードし、open(..., encoding="utf-8") と同じく改行を \\n に揃える"""
+    text = str(data, "utf-8")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def _read(path: str, size: int) -> str:
+    with open(path, "rb") as f:
+        if size < _MMAP_THRESHOLD:
+            return _decode(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                return _decode(view)
+
+
+def _line_offsets(path: str, size: int) -> np.ndarray:
+    """各行の先頭のバイトオフセットを返す（末尾の改行の後ろは行として数えない）"""
+    if size == 0:
+        return np.empty(0, dtype=np.int64)
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            newlines = np.flatnonzero(np.frombuffer(mm, dtype=np.uint8) == 0x0A)
+    offsets = np.concatenate(([0], newlines + 1)).astype(np.int64)
+    return offsets[:-1] if offsets[-1] >= size else offsets
+
+
+class FileCache:
+    """(パス, mtime_ns, サイズ) をキーにしたバイト数上限付きの LRU キャッシュ"""
+
+    def __init__(self, max_bytes: int = _DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[int, int, str]] = OrderedDict()
+        self._bytes = 0
+        self._line_indexes: OrderedDict[str, tuple[int, int, np.ndarray]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+
+    def read_text(self, path: str) -> str:
+        """ファイルをテキストとして返す（stat が変わっていなければキャッシュから）
+
+        Raises:
+            OSError: ファイルが読めない場合
+            UnicodeDecodeError: UTF-8 でデコードできない場合
+        """
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                self.bytes_saved += st.st_size
+                return entry[2]
+            self.misses += 1
+
+        text = _read(path, st.st_size)
+        if st.st_size <= self.max_bytes:
+            with self._lock:
+                self._remove(path)
+                self._entries[path] = (st.st_mtime_ns, st.st_size, text)
+                self._bytes += st.st_size
+                while self._bytes > self.max_bytes:
+                    _, (_, size, _) = self._entries.popitem(last=False)
+                    self._bytes -= size
+                    self.evictions += 1
+        return text
+
+    def _offsets(self, path: str, st: os.stat_result) -> np.ndarray:
+        with self._lock:
+            entry = self._line_indexes.get(path)
+            if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+                self._line_indexes.move_to_end(path)
+                return entry[2]
+        offsets = _line_offsets(path, st.st_size)
+        with self._lock:
+            self._line_indexes[path] = (st.st_mtime_ns, st.st_size, offsets)
+            self._line_indexes.move_to_end(path)
+            while len(self._line_indexes) > _MAX_LINE_INDEXES:
+                self._line_indexes.popitem(last=False)
+        return offsets
+
+    def read_lines(self, path: str, start: int, end: int) -> tuple[str, int]:
+        """0始まりの行範囲 [start, end) を seek して読み込む
+
+        Returns:
+            (テキスト, ファイル全体の行数)
+        """
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        offsets = self._offsets(path, st)
+        total = len(offsets)
+        start, end = max(0, start), min(total, end)
+        if start >= end:
+            return "", total
+        first = int(offsets[start])
+        last = int(offsets[end]) if end < total else st.st_size
+        with open(path, "rb") as f:
+            f.seek(first)
+            return _decode(f.read(last - first)), total
+
+    def line_count(self, path: str) -> int:
+        path = os.path.realpath(path)
+        return len(self._offsets(path, os.stat(path)))
+
+    def _remove(self, path: str) -> None:
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def invalidate(self, path: str) -> None:
+        """パスのエントリを破棄する（write_file から呼ばれる）"""
+        path = os.path.realpath(path)
+        with self._lock:
+            self._remove(path)
+            self._line_indexes.pop(path, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._line_indexes.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "evictions": self.evictions,
+            "line_indexes": len(self._line_indexes),
+        }
+
+
+# プロセス共通のキャッシュ（ファイル操作ツールから使う）
+CACHE = FileCache()
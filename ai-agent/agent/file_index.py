@@ -0,0 +1,400 @@
+"""ワークスペースのファイル索引（list_files 用）
+
+list_files のたびに os.walk でワークスペース全体を走査する代わりに、
+ディレクトリごとの一覧をメモリに保持して差分だけを更新する。
+
+- .gitignore（ネストしたものを含む）に一致するファイル・ディレクトリは索引に入れない。
+  隠しファイル・隠しディレクトリ・__pycache__ も従来どおり除外する
+- 問い合わせ時、前回の確認から _REFRESH_INTERVAL 秒以上経っていれば
+  各ディレクトリの mtime を stat し、変わったディレクトリだけを読み直す
+- write_file で書き込んだ場合は次の問い合わせで必ず確認する
+- 問い合わせはソート済みのパス一覧に対する絞り込みだけで済む
+- 各ファイルの stat もここで1回だけ行い、変更・削除されたファイルを changes() で渡す。
+  code_search / retrieval / repo_map / impact の索引は IncrementalIndex を継承して差分だけを取り込む
+"""
+
+import bisect
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+
+_REFRESH_INTERVAL = 2.0   # 秒。これより短い間隔の問い合わせではファイルシステムを確認しない
+_SKIP_DIRS = {"__pycache__"}
+
+
+def glob_to_regex(pattern: str) -> str:
+    """gitignore / glob パターンを正規表現に変換する（* は / をまたがず、** はまたぐ）"""
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**/", i):
+                out.append("(?:.*/)?")
+                i += 3
+                continue
+            if pattern.startswith("**", i):
+                out.append(".*")
+                i += 2
+                continue
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = pattern.find("]", i + 1)
+            if j == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:j]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = j
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+@dataclass(frozen=True)
+class IgnoreRule:
+    """.gitignore の1行"""
+
+    base: str          # .gitignore があるディレクトリ（ルートからの相対パス、ルートは ""）
+    regex: re.Pattern
+    negate: bool
+    dir_only: bool
+    anchored: bool     # パターンに / を含む場合は base からの相対パス全体に一致させる
+
+    @classmethod
+    def parse(cls, line: str, base: str) -> "IgnoreRule | None":
+        line = line.rstrip("\n").rstrip("\r")
+        if not line.strip() or line.startswith("#"):
+            return None
+        if not line.endswith("\\ "):
+            line = line.rstrip()
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        anchored = "/" in line
+        line = line.lstrip("/")
+        if not line:
+            return None
+        return cls(base, re.compile(glob_to_regex(line)), negate, dir_only, anchored)
+
+    def matches(self, rel_path: str, name: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        if self.base:
+            if not rel_path.startswith(self.base + "/"):
+                return False
+            rel_path = rel_path[len(self.base) + 1:]
+        target = rel_path if self.anchored else name
+        return self.regex.fullmatch(target) is not None
+
+
+def is_ignored(rules: list[IgnoreRule], rel_path: str, is_dir: bool) -> bool:
+    """最後に一致したルールで判定する（! で始まるルールは再び含める）"""
+    name = rel_path.rsplit("/", 1)[-1]
+    ignored = False
+    for rule in rules:
+        if rule.matches(rel_path, name, is_dir):
+            ignored = not rule.negate
+    return ignored
+
+
+def _read_rules(dir_path: str, base: str) -> tuple[int, list[IgnoreRule]]:
+    path = os.path.join(dir_path, ".gitignore")
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, encoding="utf-8", errors="replace") as f:
+            lines = f.readlines()
+    except OSError:
+        return 0, []
+    return mtime, [rule for rule in (IgnoreRule.parse(line, base) for line in lines) if rule]
+
+
+@dataclass
+class _Dir:
+    mtime_ns: int
+    gitignore_mtime_ns: int
+    rules: list[IgnoreRule]           # 親から継承したルール + このディレクトリの .gitignore
+    files: list[str] = field(default_factory=list)
+    subdirs: list[str] = field(default_factory=list)
+
+
+class FileIndex:
+    """1つのワークスペースルートに対するファイル索引"""
+
+    def __init__(self, root: str):
+        self.root = os.path.realpath(root)
+        self._dirs: dict[str, _Dir] = {}
+        self._paths: list[str] = []   # ルートからの相対パス（ソート済み）
+        self._lock = threading.Lock()
+        self._checked = 0.0
+        self._dirty = True
+        self.scans = 0
+        self._stats: dict[str, tuple[int, int, int]] = {}   # 相対パス → (mtime_ns, size, 最後に変わった版)
+        self._removed: dict[str, int] = {}                  # 相対パス → 削除された版
+        self._version = 0
+        self._stats_due = True
+        self.stat_passes = 0
+
+    def _abs(self, rel: str) -> str:
+        return os.path.join(self.root, rel) if rel else self.root
+
+    def _scan(self, rel: str, parent_rules: list[IgnoreRule]) -> None:
+        """ディレクトリを読み直し、新しいサブディレクトリも再帰的に読む"""
+        path = self._abs(rel)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            entries = sorted(os.scandir(path), key=lambda e: e.name)
+        except OSError:
+            self._drop(rel)
+            return
+        gi_mtime, own_rules = _read_rules(path, rel)
+        rules = parent_rules + own_rules
+        old = self._dirs.get(rel)
+        node = _Dir(mtime, gi_mtime, rules)
+        for entry in entries:
+            name = entry.name
+            if name.startswith("."):
+                continue
+            child = f"{rel}/{name}" if rel else name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            if is_dir and name in _SKIP_DIRS:
+                continue
+            if is_ignored(rules, child, is_dir):
+                continue
+            (node.subdirs if is_dir else node.files).append(name)
+        self._dirs[rel] = node
+        self.scans += 1
+
+        rules_changed = old is None or old.rules != rules
+        if old is not None:
+            for name in set(old.subdirs) - set(node.subdirs):
+                self._drop(f"{rel}/{name}" if rel else name)
+        for name in node.subdirs:
+            child = f"{rel}/{name}" if rel else name
+            if rules_changed or child not in self._dirs:
+                self._scan(child, rules)
+
+    def _drop(self, rel: str) -> None:
+        node = self._dirs.pop(rel, None)
+        if node is None:
+            return
+        for name in node.subdirs:
+            self._drop(f"{rel}/{name}" if rel else name)
+
+    def _refresh(self) -> None:
+        """mtime が変わったディレクトリだけを読み直す"""
+        scans, dirs = self.scans, len(self._dirs)
+        if not self._dirs:
+            self._scan("", [])
+        else:
+            for rel in sorted(self._dirs, key=lambda r: r.count("/") if r else -1):
+                node = self._dirs.get(rel)
+                if node is None:
+                    continue  # 親の読み直しで削除された
+                path = self._abs(rel)
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                    gi_path = os.path.join(path, ".gitignore")
+                    gi_mtime = os.stat(gi_path).st_mtime_ns if os.path.exists(gi_path) else 0
+                except OSError:
+                    self._drop(rel)
+                    continue
+                if mtime != node.mtime_ns or gi_mtime != node.gitignore_mtime_ns:
+                    parent = self._dirs.get(rel.rsplit("/", 1)[0] if "/" in rel else "")
+                    parent_rules = [] if not rel else (parent.rules if parent else [])
+                    self._scan(rel, parent_rules)
+        if self.scans == scans and len(self._dirs) == dirs:
+            return
+        paths = []
+        for rel, node in self._dirs.items():
+            paths.extend(f"{rel}/{name}" if rel else name for name in node.files)
+        paths.sort()
+        self._paths = paths
+
+    def paths(self) -> list[str]:
+        """索引済みの全ファイル（ルートからの相対パス、ソート済み）"""
+        with self._lock:
+            now = time.monotonic()
+            if self._dirty or now - self._checked >= _REFRESH_INTERVAL:
+                self._refresh()
+                self._checked = now
+                self._dirty = False
+                self._stats_due = True
+            return self._paths
+
+    def _stat_files(self, paths: list[str]) -> None:
+        """全ファイルを stat し、mtime かサイズが変わったもの・消えたものに新しい版を付ける"""
+        version = self._version + 1
+        current = set(paths)
+        changed = False
+        for rel in [rel for rel in self._stats if rel not in current]:
+            del self._stats[rel]
+            self._removed[rel] = version
+            changed = True
+        for rel in paths:
+            try:
+                st = os.stat(os.path.join(self.root, rel))
+            except OSError:
+                if self._stats.pop(rel, None) is not None:
+                    self._removed[rel] = version
+                    changed = True
+                continue
+            entry = self._stats.get(rel)
+            if entry is None or entry[0] != st.st_mtime_ns or entry[1] != st.st_size:
+                self._stats[rel] = (st.st_mtime_ns, st.st_size, version)
+                self._removed.pop(rel, None)
+                changed = True
+        if changed:
+            self._version = version
+        self.stat_passes += 1
+
+    def changes(self, since: int) -> tuple[int, dict[str, int], list[str]]:
+        """版 since 以降に追加・変更されたファイル（相対パス → サイズ）と削除されたファイルを返す
+
+        Returns:
+            (現在の版, 変更されたファイル, 削除されたファイル)。次回は現在の版を since に渡す
+        """
+        paths = self.paths()
+        with self._lock:
+            if self._stats_due:
+                self._stat_files(paths)
+                self._stats_due = False
+            if since >= self._version:
+                return self._version, {}, []
+            changed = {rel: entry[1] for rel, entry in self._stats.items() if entry[2] > since}
+            removed = [rel for rel, removed_at in self._removed.items() if removed_at > since]
+            return self._version, changed, removed
+
+    def has_dir(self, rel: str) -> bool:
+        """ディレクトリが索引に含まれているか（.gitignore で除外されていないか）"""
+        self.paths()
+        return rel.strip("/") in self._dirs or rel in (".", "")
+
+    def invalidate(self) -> None:
+        """次の問い合わせで必ずファイルシステムを確認させる（write_file から呼ばれる）"""
+        self._dirty = True
+
+    def query(
+        self,
+        directory: str = "",
+        pattern: str | None = None,
+        extensions: list[str] | None = None,
+        max_depth: int | None = None,
+    ) -> list[str]:
+        """条件に一致するファイルを directory からの相対パスで返す
+
+        max_depth を超える階層は "sub/dir/ (N files)" の形にまとめる。
+        """
+        paths = self.paths()
+        prefix = directory.strip("/")
+        if prefix in ("", "."):
+            prefix = ""
+            selected = paths
+        else:
+            lo = bisect.bisect_left(paths, prefix + "/")
+            hi = bisect.bisect_left(paths, prefix + "0")  # "/" の次の文字
+            selected = [p[len(prefix) + 1:] for p in paths[lo:hi]]
+
+        if extensions:
+            exts = tuple(e if e.startswith(".") else f".{e}" for e in extensions)
+            selected = [p for p in selected if p.endswith(exts)]
+        if pattern:
+            regex = re.compile(glob_to_regex(pattern))
+            use_name = "/" not in pattern
+            selected = [p for p in selected if regex.fullmatch(p.rsplit("/", 1)[-1] if use_name else p)]
+        if max_depth is None:
+            return selected
+
+        result = []
+        collapsed: dict[str, int] = {}
+        for p in selected:
+            parts = p.split("/")
+            if len(parts) - 1 <= max_depth:
+                result.append(p)
+            else:
+                key = "/".join(parts[:max_depth + 1]) + "/"
+                if key not in collapsed:
+                    result.append(key)
+                    collapsed[key] = 0
+                collapsed[key] += 1
+        return [f"{p} ({collapsed[p]} files)" if p in collapsed else p for p in result]
+
+
+class IncrementalIndex:
+    """ワークスペースのファイルから作る索引の基底クラス（code_search / retrieval / repo_map / impact）
+
+    ファイルの走査と stat は FileIndex が1回だけ行い、サブクラスは _update で変更・削除された
+    ファイルだけを取り込む。問い合わせではロックを取ってから _refresh を呼ぶ。
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.realpath(root)
+        self._lock = threading.Lock()
+        self._version = 0
+
+    def invalidate(self) -> None:
+        """次の問い合わせで必ずファイルシステムを確認させる"""
+        get_index(self.root).invalidate()
+
+    def _refresh(self) -> None:
+        version, changed, removed = get_index(self.root).changes(self._version)
+        if changed or removed:
+            self._update(changed, removed)
+        self._version = version
+
+    def _update(self, changed: dict[str, int], removed: list[str]) -> None:
+        """変更されたファイル（相対パス → サイズ）を読み直し、削除されたファイルを索引から外す"""
+        raise NotImplementedError
+
+
+class Registry:
+    """ワークスペースルートごとの索引（なければ factory で作る）"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._items: dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def get(self, root: str):
+        root = os.path.realpath(root)
+        with self._lock:
+            item = self._items.get(root)
+            if item is None:
+                item = self._factory(root)
+                self._items[root] = item
+            return item
+
+    def values(self) -> list:
+        with self._lock:
+            return list(self._items.values())
+
+
+_indexes = Registry(FileIndex)
+
+
+def get_index(root: str) -> FileIndex:
+    """ワークスペースルートごとの索引を返す（なければ作る）"""
+    return _indexes.get(root)
+
+
+def invalidate(path: str) -> None:
+    """path を含むワークスペースの索引を無効化する（その索引を使う IncrementalIndex も次の問い合わせで確認する）"""
+    path = os.path.realpath(path)
+    for index in _indexes.values():
+        if path == index.root or path.startswith(index.root + os.sep):
+            index.invalidate()
@@ -7,17 +7,23 @@ from langchain_core.messages import HumanMessage
 from langgraph.graph import StateGraph, START, END
 from langgraph.prebuilt import ToolNode
 
+from agent import llm_gateway
+from agent.cadence import TRACKER as cadence_tracker
+from agent.history import parse_timestamp
+from agent.sessions import TRACKER as session_tracker
 from agent.state import AgentState
-from agent.tools import ALL_TOOLS, set_workspace_root, set_is_running, set_iot_status
+from agent.tools import ALL_TOOLS, reset_workspace_root, set_workspace_root, set_is_running, set_iot_status
+from api.events import broadcast
 
+_MODEL_ID = "us.anthropic.claude-haiku-4-5-20251001-v1:0"
 _llm = ChatBedrockConverse(
-    model="us.anthropic.claude-haiku-4-5-20251001-v1:0",
+    model=_MODEL_ID,
     region_name=os.environ.get("AWS_BEDROCK_REGION", os.environ.get("AWS_REGION", "us-east-1")),
 )
 _llm_with_tools = _llm.bind_tools(ALL_TOOLS)
 
-# 走行状態のインメモリ記録（前回の状態を保持）
-_prev_running: bool = False
+# 走行状態のインメモリ記録（デバイスごとに前回の状態を保持）
+_prev_running: dict[str, bool] = {}
 
 _SENSOR_PROMPTS = {
     "heart_rate": (
@@ -55,21 +61,28 @@ def route_after_classify(state: AgentState) -> Literal["trigger_check", "agent"]
 
 
 def trigger_check(state: AgentState) -> dict:
-    """Statusフィールドで走行状態を判定し、状態遷移でtriggerとmodel_tierを決定する"""
-    global _prev_running
+    """走行状態を判定し、状態遷移でtriggerとmodel_tierを決定する
+
+    デバイスの Status に加えて、エージェント側で推定したケイデンス・強度（agent/cadence.py）を使う。
+    推定できない場合はデバイスの Status をそのまま使う。
+    """
     msg = state["iot_message"]
+    device_id = msg.get("device_id", "motion_sensor")
 
-    status = msg.get("status", "None")  # "Run" | "Walk" | "None" (lowercase key)
+    device_status = msg.get("status", "None")  # "Run" | "Walk" | "None" (lowercase key)
+    metrics = cadence_tracker.ingest(msg)
+    status = metrics["activity"] if metrics else device_status
     is_running = status in ("Run", "Walk")
 
-    if is_running and not _prev_running:
+    prev_running = _prev_running.get(device_id, False)
+    if is_running and not prev_running:
         trigger = "running_start"
-    elif not is_running and _prev_running:
+    elif not is_running and prev_running:
         trigger = "running_stop"
     else:
         trigger = "none"
 
-    _prev_running = is_running
+    _prev_running[device_id] = is_running
 
     # Run → sonnet (4.5), Walk → sonnet-3 (3.5), None → haiku
     if status == "Run":
@@ -79,13 +92,22 @@ def trigger_check(state: AgentState) -> dict:
     else:
         model_tier = "haiku"
 
-    device_id = msg.get("device_id", "motion_sensor")
+    ts = parse_timestamp(msg.get("timestamp"))
+    if trigger == "running_start":
+        session_tracker.start(device_id, ts)
+    bpm = msg.get("bpm")
+    session_tracker.observe(device_id, status, bpm if isinstance(bpm, (int, float)) and not isinstance(bpm, bool) else None, ts)
+
     set_iot_status(device_id, {
         "status": status,
+        "device_status": device_status,
         "is_running": is_running,
         "trigger": trigger,
         "model_tier": model_tier,
         "timestamp": msg.get("timestamp"),
+        "cadence_spm": metrics["cadence_spm"] if metrics else None,
+        "cadence_confidence": metrics["cadence_confidence"] if metrics else None,
+        "intensity": metrics["intensity"] if metrics else None,
     })
 
     return {"trigger": trigger, "model_tier": model_tier}
@@ -103,7 +125,8 @@ def route_after_trigger(state: AgentState) -> Literal["notify_start", "notify_st
 async def notify_start(state: AgentState) -> dict:
     """走行開始トリガーを記録し、自律開発エージェントを起動する"""
     import asyncio
-    set_is_running(True)
+    device_id = state["iot_message"].get("device_id", "motion_sensor")
+    set_is_running(True, device_id)
     workspace_root = state.get("workspace_root", "")
     model_tier = state.get("model_tier", "haiku")
 
@@ -111,7 +134,7 @@ async def notify_start(state: AgentState) -> dict:
     if workspace_root:
         try:
             from agent.dev_graph import run_dev_agent
-            asyncio.create_task(run_dev_agent(workspace_root, model_tier=model_tier))
+            asyncio.create_task(run_dev_agent(workspace_root, model_tier=model_tier, device_id=device_id))
             print(f"[notify_start] 自律開発エージェント起動: {workspace_root} (model_tier={model_tier})")
         except Exception as e:
             print(f"[notify_start] エージェント起動エラー: {e}")
@@ -119,9 +142,13 @@ async def notify_start(state: AgentState) -> dict:
     return {"agent_response": "🏃 走行開始を検知しました。AIエージェントを起動します。"}
 
 
-def notify_stop(state: AgentState) -> dict:
-    """走行終了トリガーを記録する（VS Code側への通知口）"""
-    set_is_running(False)
+async def notify_stop(state: AgentState) -> dict:
+    """走行終了トリガーを記録し、走行セッションのサマリーを配信する（VS Code側への通知口）"""
+    msg = state["iot_message"]
+    set_is_running(False, msg.get("device_id", "motion_sensor"))
+    summary = session_tracker.finish(msg.get("device_id", "motion_sensor"), parse_timestamp(msg.get("timestamp")))
+    if summary is not None:
+        await broadcast({"type": "session_summary", "session": summary})
     return {"agent_response": "🛑 走行終了を検知しました。AIエージェントを停止します。"}
 
 
@@ -144,7 +171,11 @@ async def agent_node(state: AgentState) -> dict:
         # ツール実行後の再呼び出し: 既存メッセージをそのまま使用
         messages = existing_messages
 
-    response = await _llm_with_tools.ainvoke(messages)
+    # センサー分析はバックグラウンド優先度（開発エージェントの呼び出しを優先する）
+    response = await llm_gateway.ainvoke(
+        _llm_with_tools, messages,
+        model_id=_MODEL_ID, priority=llm_gateway.PRIORITY_BACKGROUND,
+    )
 
     agent_response = state.get("agent_response", "")
     if not response.tool_calls:
@@ -186,15 +217,19 @@ graph = _builder.compile()
 
 
 async def run_agent(iot_message: dict, workspace_root: str = "") -> str:
-    if workspace_root:
-        set_workspace_root(workspace_root)
-    result = await graph.ainvoke({
-        "iot_message": iot_message,
-        "agent_response": "",
-        "sensor_type": "",
-        "trigger": "none",
-        "model_tier": "haiku",
-        "messages": [],
-        "workspace_root": workspace_root,
-    })
+    # ワークスペースはこの実行（コンテキスト）だけに設定し、並行する他の実行には影響させない
+    token = set_workspace_root(workspace_root) if workspace_root else None
+    try:
+        result = await graph.ainvoke({
+            "iot_message": iot_message,
+            "agent_response": "",
+            "sensor_type": "",
+            "trigger": "none",
+            "model_tier": "haiku",
+            "messages": [],
+            "workspace_root": workspace_root,
+        })
+    finally:
+        if token is not None:
+            reset_workspace_root(token)
     return result["agent_response"]
@@ -0,0 +1,411 @@
+"""センサー履歴のリングバッファ
+
+センサー種別 × デバイスIDごとに固定容量のリングバッファを持ち、
+容量を超えた古いサンプルから上書きする。
+
+各フィールドは列ごとの型付き配列（array モジュール）に格納する。
+- 数値・真偽値 → array('d')（欠損は NaN）
+- 文字列       → array('H') のシンボルコード（0 は欠損）
+- それ以外（ネストした dict など）は上書きまで保持する補助辞書に退避する
+
+タイムスタンプ列は単調非減少に保つため、時刻範囲の検索は二分探索で O(log n)。
+"""
+
+import math
+import os
+import time
+from array import array
+from datetime import datetime, timezone
+from heapq import merge
+
+import numpy as np
+
+_DEFAULT_CAPACITY = int(os.environ.get("SENSOR_HISTORY_CAPACITY", "10000"))
+
+# 列の型
+_KIND_FLOAT = "f"
+_KIND_INT = "i"
+_KIND_BOOL = "b"
+_KIND_STR = "s"
+
+_MISSING_CODE = 0
+_MISSING = object()
+_MAX_SYMBOLS = 0xFFFF
+
+
+def parse_timestamp(value) -> float | None:
+    """ISO 8601 文字列または数値のタイムスタンプを UNIX 秒に変換する"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            dt = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.timestamp()
+    return None
+
+
+def format_timestamp(ts: float) -> str:
+    """UNIX 秒を ISO 8601（UTC, Z 表記）に変換する"""
+    dt = datetime.fromtimestamp(ts, tz=timezone.utc)
+    if dt.microsecond:
+        return dt.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _kind_of(value) -> str | None:
+    if isinstance(value, bool):
+        return _KIND_BOOL
+    if isinstance(value, int):
+        return _KIND_INT if abs(value) < 2 ** 53 else None
+    if isinstance(value, float):
+        return _KIND_FLOAT
+    if isinstance(value, str):
+        return _KIND_STR
+    return None
+
+
+class SampleView:
+    """リングバッファ内の1サンプルへの軽量ビュー（スロットが上書きされるまで有効）"""
+
+    __slots__ = ("_buffer", "_slot")
+
+    def __init__(self, buffer: "SensorRingBuffer", slot: int):
+        self._buffer = buffer
+        self._slot = slot
+
+    @property
+    def timestamp(self) -> float:
+        return self._buffer._ts[self._slot]
+
+    def get(self, field: str, default=None):
+        return self._buffer._value(self._slot, field, default)
+
+    def to_dict(self) -> dict:
+        return self._buffer._to_dict(self._slot)
+
+    def __repr__(self) -> str:
+        return f"SampleView({self.to_dict()!r})"
+
+
+class SensorRingBuffer:
+    """1つのセンサー種別・デバイスの固定容量リングバッファ"""
+
+    __slots__ = (
+        "capacity", "_ts", "_has_ts", "_orig_ts", "_columns", "_kinds", "_symbols", "_symbol_codes",
+        "_extra", "_start", "_size", "total",
+    )
+
+    def __init__(self, capacity: int = _DEFAULT_CAPACITY):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self._ts = array("d", bytes(8 * capacity))
+        self._has_ts = array("b", bytes(capacity))
+        self._orig_ts: dict[int, float] = {}  # 並び順のキーに丸めたサンプルの元のタイムスタンプ
+        self._columns: dict[str, array] = {}
+        self._kinds: dict[str, str] = {}
+        self._symbols: list[str] = [""]  # コード 0 は欠損
+        self._symbol_codes: dict[str, int] = {}
+        self._extra: dict[int, dict] = {}
+        self._start = 0
+        self._size = 0
+        self.total = 0  # これまでに追加したサンプル数（上書き分を含む）
+
+    def __len__(self) -> int:
+        return self._size
+
+    # ---- 書き込み ----
+
+    def _new_column(self, kind: str) -> array:
+        if kind == _KIND_STR:
+            return array("H", bytes(2 * self.capacity))
+        return array("d", [math.nan]) * self.capacity
+
+    def _encode_symbol(self, value: str) -> int | None:
+        code = self._symbol_codes.get(value)
+        if code is None:
+            if len(self._symbols) >= _MAX_SYMBOLS:
+                return None
+            code = len(self._symbols)
+            self._symbols.append(value)
+            self._symbol_codes[value] = code
+        return code
+
+    def _column_for(self, field: str, kind: str) -> array | None:
+        current = self._kinds.get(field)
+        if current is None:
+            self._kinds[field] = kind
+            column = self._new_column(kind)
+            self._columns[field] = column
+            return column
+        if current == kind:
+            return self._columns[field]
+        # int → float の拡幅のみ許可（同じ array('d') をそのまま使う）
+        if {current, kind} == {_KIND_INT, _KIND_FLOAT}:
+            self._kinds[field] = _KIND_FLOAT
+            return self._columns[field]
+        return None
+
+    def append(self, data: dict, timestamp: float | None = None) -> None:
+        """サンプルを追加する（満杯なら最古のサンプルを上書き）"""
+        if self._size < self.capacity:
+            slot = (self._start + self._size) % self.capacity
+            self._size += 1
+        else:
+            slot = self._start
+            self._start = (self._start + 1) % self.capacity
+        self.total += 1
+
+        has_ts = timestamp is not None
+        # _ts は二分探索用の単調非減少なキー。出力には元のタイムスタンプを使う
+        prev_slot = (slot - 1) % self.capacity
+        has_prev = self._size > 1
+        if has_ts:
+            ts = timestamp
+        elif has_prev and self._has_ts[prev_slot]:
+            ts = self._ts[prev_slot]   # デバイスの時刻を壁時計の現在時刻まで進めない
+        else:
+            ts = time.time()
+        self._orig_ts.pop(slot, None)
+        if has_prev and ts < self._ts[prev_slot]:
+            if has_ts:
+                self._orig_ts[slot] = ts
+            ts = self._ts[prev_slot]
+        self._ts[slot] = ts
+        self._has_ts[slot] = 1 if has_ts else 0
+
+        self._extra.pop(slot, None)
+        for field, column in self._columns.items():
+            column[slot] = _MISSING_CODE if self._kinds[field] == _KIND_STR else math.nan
+
+        for field, value in data.items():
+            if field == "timestamp" and has_ts:
+                continue
+            kind = _kind_of(value)
+            column = self._column_for(field, kind) if kind else None
+            if column is None:
+                self._extra.setdefault(slot, {})[field] = value
+                continue
+            if kind == _KIND_STR:
+                code = self._encode_symbol(value)
+                if code is None:
+                    self._extra.setdefault(slot, {})[field] = value
+                else:
+                    column[slot] = code
+            else:
+                column[slot] = float(value)
+
+    # ---- 読み出し ----
+
+    def _value(self, slot: int, field: str, default=None):
+        if field == "timestamp" and self._has_ts[slot]:
+            return format_timestamp(self._orig_ts.get(slot, self._ts[slot]))
+        extra = self._extra.get(slot)
+        if extra and field in extra:
+            return extra[field]
+        kind = self._kinds.get(field)
+        if kind is None:
+            return default
+        raw = self._columns[field][slot]
+        if kind == _KIND_STR:
+            return self._symbols[raw] if raw != _MISSING_CODE else default
+        if math.isnan(raw):
+            return default
+        if kind == _KIND_INT:
+            return int(raw)
+        if kind == _KIND_BOOL:
+            return bool(raw)
+        return raw
+
+    def _to_dict(self, slot: int) -> dict:
+        record = {}
+        for field in self._kinds:
+            value = self._value(slot, field, _MISSING)
+            if value is not _MISSING:
+                record[field] = value
+        extra = self._extra.get(slot)
+        if extra:
+            record.update(extra)
+        if self._has_ts[slot]:
+            record["timestamp"] = format_timestamp(self._orig_ts.get(slot, self._ts[slot]))
+        return record
+
+    def _slot(self, index: int) -> int:
+        """論理インデックス（0 = 最古）を物理スロットに変換する"""
+        return (self._start + index) % self.capacity
+
+    def view(self, index: int) -> SampleView:
+        return SampleView(self, self._slot(index))
+
+    def latest(self, n: int) -> list[SampleView]:
+        """直近 n 件を古い順に返す"""
+        n = max(0, min(n, self._size))
+        return [self.view(i) for i in range(self._size - n, self._size)]
+
+    def _bisect(self, ts: float, right: bool) -> int:
+        """論理インデックス上でタイムスタンプを二分探索する（bisect_left / bisect_right 相当）"""
+        ts_column, start, capacity = self._ts, self._start, self.capacity
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = ts_column[(start + mid) % capacity]
+            if value < ts or (right and value == ts):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def index_range(self, since: float | None = None, until: float | None = None) -> tuple[int, int]:
+        """[since, until] に含まれるサンプルの論理インデックス範囲 [lo, hi) を返す"""
+        lo = 0 if since is None else self._bisect(since, right=False)
+        hi = self._size if until is None else self._bisect(until, right=True)
+        return lo, max(lo, hi)
+
+    def range(self, since: float | None = None, until: float | None = None) -> list[SampleView]:
+        """時刻範囲 [since, until] のサンプルを古い順に返す"""
+        lo, hi = self.index_range(since, until)
+        return [self.view(i) for i in range(lo, hi)]
+
+    def numeric_fields(self) -> list[str]:
+        return [f for f, kind in self._kinds.items() if kind != _KIND_STR]
+
+    def oldest(self) -> float | None:
+        """保持している最古のサンプルのタイムスタンプ"""
+        return self._ts[self._start] if self._size else None
+
+    def columns(self, field: str, lo: int, hi: int) -> tuple[np.ndarray, np.ndarray]:
+        """論理インデックス [lo, hi) の (タイムスタンプ, 値) を NumPy 配列のコピーで返す
+
+        数値以外の列・存在しない列の場合は値がすべて NaN になる。
+        """
+        n = max(0, hi - lo)
+        ts_all = np.frombuffer(self._ts, dtype=np.float64)
+        column = self._columns.get(field) if self._kinds.get(field, _KIND_STR) != _KIND_STR else None
+        values_all = np.frombuffer(column, dtype=np.float64) if column is not None else None
+
+        first = self._slot(lo) if n else 0
+        end = first + n
+        if end <= self.capacity:
+            parts = [slice(first, end)]
+        else:
+            parts = [slice(first, self.capacity), slice(0, end - self.capacity)]
+        ts = np.concatenate([ts_all[p] for p in parts]) if n else np.empty(0)
+        if values_all is None:
+            return ts, np.full(n, np.nan)
+        return ts, np.concatenate([values_all[p] for p in parts]) if n else np.empty(0)
+
+    def nbytes(self) -> int:
+        """列配列が確保しているバイト数"""
+        total = self._ts.itemsize * len(self._ts) + self._has_ts.itemsize * len(self._has_ts)
+        for column in self._columns.values():
+            total += column.itemsize * len(column)
+        return total
+
+
+class SensorHistory:
+    """センサー種別 × デバイスIDごとのリングバッファの集合"""
+
+    def __init__(self, capacity: int = _DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._buffers: dict[str, dict[str, SensorRingBuffer]] = {}
+
+    def set_capacity(self, capacity: int) -> None:
+        """以降に作成するバッファの容量を設定する（既存のバッファは保持したまま）"""
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+
+    def buffer(self, sensor_type: str, device_id: str = "") -> SensorRingBuffer:
+        devices = self._buffers.setdefault(sensor_type, {})
+        buf = devices.get(device_id)
+        if buf is None:
+            buf = SensorRingBuffer(self.capacity)
+            devices[device_id] = buf
+        return buf
+
+    def append(self, sensor_type: str, data: dict) -> SensorRingBuffer:
+        device_id = str(data.get("device_id", ""))
+        buf = self.buffer(sensor_type, device_id)
+        buf.append(data, parse_timestamp(data.get("timestamp")))
+        return buf
+
+    def _selected(self, sensor_type: str, device_id: str | None) -> list[SensorRingBuffer]:
+        devices = self._buffers.get(sensor_type, {})
+        if device_id is not None:
+            buf = devices.get(device_id)
+            return [buf] if buf is not None else []
+        return list(devices.values())
+
+    def total(self, sensor_type: str) -> int:
+        return sum(buf.total for buf in self._buffers.get(sensor_type, {}).values())
+
+    def latest(self, sensor_type: str, n: int, device_id: str | None = None) -> list[dict]:
+        """直近 n 件を古い順に返す（device_id 省略時は全デバイスを時刻順にマージ）"""
+        buffers = self._selected(sensor_type, device_id)
+        if len(buffers) == 1:
+            return [v.to_dict() for v in buffers[0].latest(n)]
+        merged = list(merge(*(b.latest(n) for b in buffers), key=lambda v: v.timestamp))
+        return [v.to_dict() for v in merged[-n:]] if n > 0 else []
+
+    def range(
+        self,
+        sensor_type: str,
+        since: float | None = None,
+        until: float | None = None,
+        device_id: str | None = None,
+    ) -> list[dict]:
+        """時刻範囲 [since, until] のサンプルを古い順に返す"""
+        buffers = self._selected(sensor_type, device_id)
+        merged = merge(*(b.range(since, until) for b in buffers), key=lambda v: v.timestamp)
+        return [v.to_dict() for v in merged]
+
+    def columns(
+        self,
+        sensor_type: str,
+        field: str,
+        since: float | None = None,
+        until: float | None = None,
+        device_id: str | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """時刻範囲の (タイムスタンプ, 値) を時刻順の NumPy 配列で返す（二分探索 + 列のスライス）"""
+        parts = []
+        for buf in self._selected(sensor_type, device_id):
+            lo, hi = buf.index_range(since, until)
+            parts.append(buf.columns(field, lo, hi))
+        if not parts:
+            return np.empty(0), np.empty(0)
+        ts = np.concatenate([p[0] for p in parts])
+        values = np.concatenate([p[1] for p in parts])
+        if len(parts) > 1:
+            order = np.argsort(ts, kind="stable")
+            ts, values = ts[order], values[order]
+        return ts, values
+
+    def numeric_fields(self, sensor_type: str) -> list[str]:
+        fields: dict[str, None] = {}
+        for buf in self._selected(sensor_type, None):
+            fields.update(dict.fromkeys(buf.numeric_fields()))
+        return list(fields)
+
+    def oldest(self, sensor_type: str, device_id: str | None = None) -> float | None:
+        """保持している最古のタイムスタンプ（バッファごとの最古のうち最も新しいもの）
+
+        複数デバイスの場合、この時刻以降であればすべてのデバイスのデータがメモリ上にある。
+        """
+        oldest = [buf.oldest() for buf in self._selected(sensor_type, device_id) if len(buf)]
+        return max(oldest) if oldest else None
+
+    def sensor_types(self) -> list[str]:
+        return list(self._buffers)
+
+    def device_ids(self, sensor_type: str) -> list[str]:
+        return list(self._buffers.get(sensor_type, {}))
+
+    def clear(self) -> None:
+        self._buffers.clear()
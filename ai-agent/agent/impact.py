@@ -0,0 +1,188 @@
+"""変更ファイルから影響を受けるテストを選ぶ（run_affected_tests 用）
+
+ワークスペースの Python ファイルの import 文を ast で読み、ワークスペース内のファイル同士の
+依存グラフを作る。変更されたファイルを（推移的に）import しているテストファイルだけを返す。
+
+- import の解決は、そのファイルのディレクトリから上にたどった各ディレクトリを sys.path の候補として
+  `a/b.py` か `a/b/__init__.py` を探す（`python test_x.py` で実行するスクリプト形式のテストと、
+  パッケージ内の絶対・相対 import の両方を扱う）
+- パッケージ配下のモジュールを import すると親パッケージの __init__.py も実行されるので依存に含める
+- テストファイルは `test_*.py` / `*_test.py` の名前のファイル。conftest.py（とそれが import するファイル）の
+  変更は、conftest.py のあるディレクトリ配下のすべてのテストに影響するとみなす
+- 各ファイルの import は file_index が stat で見つけた変更ファイルだけ読み直す（code_search と同じ更新方式）
+- 静的に解析できない import（importlib / __import__ など）は対象外
+"""
+
+import ast
+import os
+import re
+from collections import deque
+
+from agent import file_index
+
+_MAX_FILE_BYTES = 1024 * 1024
+_TEST_NAME_RE = re.compile(r"(^|/)(test_[^/]*|[^/]*_test)\.py$")
+_MAIN_RE = re.compile(r"^if __name__ == ['\"]__main__['\"]\s*:", re.M)
+
+
+def is_test_file(rel: str) -> bool:
+    return bool(_TEST_NAME_RE.search(rel))
+
+
+def _is_conftest(rel: str) -> bool:
+    return rel == "conftest.py" or rel.endswith("/conftest.py")
+
+
+def _imported_modules(tree: ast.Module) -> list[tuple[int, str]]:
+    """(相対 import のレベル, モジュール名) のリスト。from a import b は "a.b" と "a" の両方を返す"""
+    modules = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules += [(0, alias.name) for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            for alias in node.names:
+                if alias.name != "*":
+                    modules.append((node.level, f"{base}.{alias.name}" if base else alias.name))
+            if base:
+                modules.append((node.level, base))
+    return modules
+
+
+class ImportGraph(file_index.IncrementalIndex):
+    """1つのワークスペースに対する import の依存グラフ"""
+
+    def __init__(self, root: str):
+        super().__init__(root)
+        self._files: dict[str, tuple[list[tuple[int, str]], bool]] = {}   # 相対パス → (import, __main__ の有無)
+        self._deps: dict[str, set[str]] = {}
+        self._importers: dict[str, set[str]] = {}
+        self.parsed = 0
+
+    def _parse(self, rel: str, size: int) -> None:
+        modules, has_main = [], False
+        if size <= _MAX_FILE_BYTES:
+            try:
+                with open(os.path.join(self.root, rel), "rb") as f:
+                    source = f.read()
+                modules = _imported_modules(ast.parse(source))
+                has_main = bool(_MAIN_RE.search(source.decode("utf-8", errors="replace")))
+            except (OSError, SyntaxError, ValueError):
+                pass
+        self._files[rel] = (modules, has_main)
+        self.parsed += 1
+
+    def _module_file(self, base: str, dotted: str) -> str | None:
+        parts = dotted.split(".")
+        candidate = "/".join([base, *parts]) if base else "/".join(parts)
+        for rel in (candidate + ".py", candidate + "/__init__.py"):
+            if rel in self._files:
+                return rel
+        return None
+
+    def _resolve(self, rel: str, level: int, dotted: str) -> list[str]:
+        """import を解決し、対応するワークスペース内のファイル（親パッケージの __init__.py を含む）を返す"""
+        directory = os.path.dirname(rel)
+        if level:
+            base = directory
+            for _ in range(level - 1):
+                base = os.path.dirname(base)
+            bases = [base]
+        else:
+            bases, base = [], directory
+            while True:
+                bases.append(base)
+                if not base:
+                    break
+                base = os.path.dirname(base)
+        for base in bases:
+            target = self._module_file(base, dotted)
+            if target is None:
+                continue
+            found = [target]
+            parts = dotted.split(".")
+            for i in range(1, len(parts)):
+                init = self._module_file(base, ".".join(parts[:i]))
+                if init is not None and init.endswith("__init__.py"):
+                    found.append(init)
+            return found
+        return []
+
+    def _update(self, changed: dict[str, int], removed: list[str]) -> None:
+        updated = False
+        for rel in removed:
+            updated |= self._files.pop(rel, None) is not None
+        for rel, size in changed.items():
+            if rel.endswith(".py"):
+                self._parse(rel, size)
+                updated = True
+        if updated:
+            # ファイルの追加・削除で解決先が変わりうるので、グラフは組み直す（import の解析結果は再利用）
+            self._deps = {}
+            self._importers = {}
+            for rel, entry in self._files.items():
+                deps = set()
+                for level, dotted in entry[0]:
+                    deps.update(self._resolve(rel, level, dotted))
+                deps.discard(rel)
+                self._deps[rel] = deps
+                for dep in deps:
+                    self._importers.setdefault(dep, set()).add(rel)
+
+    def dependencies(self, rel: str) -> set[str]:
+        with self._lock:
+            self._refresh()
+            return set(self._deps.get(rel, ()))
+
+    def dependency_closure(self, rel: str) -> set[str]:
+        """rel 自身と、rel が（推移的に）import するワークスペース内のファイル"""
+        with self._lock:
+            self._refresh()
+            seen = set()
+            queue = deque([rel])
+            while queue:
+                current = queue.popleft()
+                if current in seen:
+                    continue
+                seen.add(current)
+                queue.extend(self._deps.get(current, set()) - seen)
+            return seen
+
+    def affected_tests(self, changed: list[str]) -> list[str]:
+        """changed のいずれかを（推移的に）import しているテストファイル（changed 自身がテストなら含む）"""
+        with self._lock:
+            self._refresh()
+            seen = set()
+            queue = deque(rel for rel in changed if rel in self._files)
+            while queue:
+                rel = queue.popleft()
+                if rel in seen:
+                    continue
+                seen.add(rel)
+                queue.extend(self._importers.get(rel, set()) - seen)
+            tests = {rel for rel in seen if is_test_file(rel)}
+            for conftest in (rel for rel in seen if _is_conftest(rel)):
+                prefix = os.path.dirname(conftest)
+                tests.update(
+                    rel for rel in self._files
+                    if is_test_file(rel) and (not prefix or rel.startswith(prefix + "/"))
+                )
+            return sorted(tests)
+
+    def all_tests(self) -> list[str]:
+        with self._lock:
+            self._refresh()
+            return sorted(rel for rel in self._files if is_test_file(rel))
+
+    def is_script(self, rel: str) -> bool:
+        """`if __name__ == "__main__":` を持つ（スクリプトとして実行する）テストか"""
+        with self._lock:
+            entry = self._files.get(rel)
+            return bool(entry and entry[1])
+
+
+_graphs = file_index.Registry(ImportGraph)
+
+
+def get_graph(root: str) -> ImportGraph:
+    return _graphs.get(root)
@@ -0,0 +1,334 @@
+"""Bedrock 呼び出しの共有ゲートウェイ
+
+IoT 側の agent_node と dev_graph の planner / coder / reviewer は、
+すべてこのモジュールの ainvoke() を経由して LLM を呼び出す。
+
+- モデルIDごとに AIMD 方式の適応的同時実行数制御を行う
+  （成功で加算的に増やし、ThrottlingException で半減させる）
+- スロットリング時はジッター付き指数バックオフで再試行する
+- 優先度クラスにより、待ち行列では対話的な開発エージェントの呼び出しが
+  バックグラウンドのセンサー分析より先に実行される
+- スロットリング率・待ち時間などのメトリクスを get_metrics() で公開する
+- ainvoke_hedged() はティアごとの直近レイテンシの p95 を SLO とし、
+  それを超えた呼び出しにフォールバックモデルでヘッジリクエストを送る
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import random
+import time
+from collections import deque
+
+# 優先度クラス（値が小さいほど優先）
+PRIORITY_INTERACTIVE = 0  # 開発エージェント（planner / coder / reviewer）
+PRIORITY_BACKGROUND = 1   # IoT センサー分析
+
+# AIMD パラメータ
+_INITIAL_LIMIT = 4.0
+_MIN_LIMIT = 1.0
+_MAX_LIMIT = 32.0
+_DECREASE_FACTOR = 0.5
+
+# リトライパラメータ（フルジッター指数バックオフ）
+_MAX_RETRIES = 5
+_BACKOFF_BASE = 0.5   # 秒
+_BACKOFF_CAP = 20.0   # 秒
+
+# ヘッジパラメータ
+_LATENCY_WINDOW = 100      # p95 算出に使う直近の呼び出し数
+_LATENCY_MIN_SAMPLES = 10  # これ未満のサンプル数ではヘッジしない
+_HEDGE_MIN_DELAY = 2.0     # 秒（p95 が極端に小さい場合のヘッジ遅延の下限）
+
+# スロットリングとみなすエラーコード
+_THROTTLE_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+    "ModelNotReadyException",
+}
+
+
+def is_throttling_error(e: BaseException) -> bool:
+    """例外が Bedrock のスロットリング起因かどうかを判定する"""
+    response = getattr(e, "response", None)
+    if isinstance(response, dict):
+        code = response.get("Error", {}).get("Code", "")
+        if code in _THROTTLE_CODES:
+            return True
+    name = type(e).__name__
+    return name in _THROTTLE_CODES or any(code in str(e) for code in _THROTTLE_CODES)
+
+
+class _AdaptiveLimiter:
+    """モデルID単位の AIMD 同時実行数リミッター（優先度付き待ち行列）"""
+
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+        self.limit = _INITIAL_LIMIT
+        self.in_flight = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+        # メトリクス
+        self.requests = 0
+        self.throttles = 0
+        self.retries = 0
+        self.failures = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.acquired = 0
+
+    def _has_capacity(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    async def acquire(self, priority: int) -> None:
+        start = time.monotonic()
+        # 空きがあり、同等以上の優先度の待ちがいなければ即時実行
+        if self._has_capacity() and not any(p <= priority for p, _, _ in self._waiters):
+            self.in_flight += 1
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    # スロットを受け取った直後にキャンセルされた場合は返却する
+                    self.release()
+                else:
+                    self._waiters = [w for w in self._waiters if w[2] is not fut]
+                    heapq.heapify(self._waiters)
+                raise
+        waited = time.monotonic() - start
+        self.acquired += 1
+        self.queue_wait_total += waited
+        self.queue_wait_max = max(self.queue_wait_max, waited)
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self._has_capacity():
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self.in_flight += 1
+            fut.set_result(None)
+
+    def on_success(self) -> None:
+        # 加算的増加: 1ウィンドウ（≒limit 回の成功）で +1
+        self.limit = min(_MAX_LIMIT, self.limit + 1.0 / self.limit)
+        self._wake()
+
+    def on_throttle(self) -> None:
+        # 乗算的減少
+        self.throttles += 1
+        self.limit = max(_MIN_LIMIT, self.limit * _DECREASE_FACTOR)
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "requests": self.requests,
+            "throttles": self.throttles,
+            "throttle_rate": round(self.throttles / self.requests, 4) if self.requests else 0.0,
+            "retries": self.retries,
+            "failures": self.failures,
+            "queue_wait_avg_sec": round(self.queue_wait_total / self.acquired, 4) if self.acquired else 0.0,
+            "queue_wait_max_sec": round(self.queue_wait_max, 4),
+        }
+
+
+_limiters: dict[str, _AdaptiveLimiter] = {}
+
+
+def _get_limiter(model_id: str) -> _AdaptiveLimiter:
+    limiter = _limiters.get(model_id)
+    if limiter is None:
+        limiter = _AdaptiveLimiter(model_id)
+        _limiters[model_id] = limiter
+    return limiter
+
+
+def _backoff_delay(attempt: int) -> float:
+    """フルジッター指数バックオフの待ち時間（秒）"""
+    return random.uniform(0, min(_BACKOFF_CAP, _BACKOFF_BASE * (2 ** attempt)))
+
+
+async def ainvoke(llm, messages, *, model_id: str, priority: int = PRIORITY_BACKGROUND):
+    """ゲートウェイ経由で LLM を呼び出す。
+
+    Args:
+        llm: ainvoke を持つ LangChain の Runnable（bind_tools 済みのモデルなど）
+        messages: LLM に渡すメッセージ列
+        model_id: 同時実行数を管理するキーとなる Bedrock モデルID
+        priority: PRIORITY_INTERACTIVE または PRIORITY_BACKGROUND
+
+    Returns:
+        llm.ainvoke の戻り値（AIMessage）
+    """
+    limiter = _get_limiter(model_id)
+    attempt = 0
+    while True:
+        await limiter.acquire(priority)
+        limiter.requests += 1
+        try:
+            response = await llm.ainvoke(messages)
+        except Exception as e:
+            limiter.release()
+            if not is_throttling_error(e):
+                limiter.failures += 1
+                raise
+            limiter.on_throttle()
+            if attempt >= _MAX_RETRIES:
+                limiter.failures += 1
+                print(f"[llm_gateway] リトライ上限に達しました: model={model_id}")
+                raise
+            delay = _backoff_delay(attempt)
+            attempt += 1
+            limiter.retries += 1
+            print(
+                f"[llm_gateway] スロットリング検知: model={model_id}, "
+                f"limit={limiter.limit:.2f}, {delay:.2f}秒後に再試行 ({attempt}/{_MAX_RETRIES})"
+            )
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            limiter.release()
+            raise
+        limiter.release()
+        limiter.on_success()
+        return response
+
+
+class _LatencyTracker:
+    """ティア単位の直近レイテンシとヘッジ結果の記録"""
+
+    def __init__(self):
+        self.samples: deque[float] = deque(maxlen=_LATENCY_WINDOW)
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def record(self, latency: float) -> None:
+        self.samples.append(latency)
+
+    def p95(self) -> float | None:
+        if len(self.samples) < _LATENCY_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, math.ceil(len(ordered) * 0.95) - 1)]
+
+    def snapshot(self) -> dict:
+        p95 = self.p95()
+        return {
+            "samples": len(self.samples),
+            "p95_sec": round(p95, 3) if p95 is not None else None,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+_latencies: dict[str, _LatencyTracker] = {}
+
+
+def _get_tracker(latency_key: str) -> _LatencyTracker:
+    tracker = _latencies.get(latency_key)
+    if tracker is None:
+        tracker = _LatencyTracker()
+        _latencies[latency_key] = tracker
+    return tracker
+
+
+async def ainvoke_hedged(
+    llm,
+    messages,
+    *,
+    model_id: str,
+    latency_key: str,
+    hedge: tuple | None = None,
+    priority: int = PRIORITY_INTERACTIVE,
+):
+    """レイテンシ SLO 付きでゲートウェイ経由の呼び出しを行う。
+
+    主リクエストの経過時間が latency_key の直近 p95 を超えた時点で、
+    hedge に指定したフォールバックモデルへ同じリクエストを送り、
+    先に返った応答を採用して他方はキャンセルする。
+    Converse API は非ストリーミングで呼び出しているため、
+    レイテンシは最初のトークンではなく応答完了までの時間で計測する。
+
+    Args:
+        llm: 主モデルの Runnable
+        messages: LLM に渡すメッセージ列
+        model_id: 主モデルの Bedrock モデルID
+        latency_key: レイテンシを集計するキー（モデルティア名）
+        hedge: (フォールバック Runnable, フォールバックのモデルID)。None ならヘッジしない
+        priority: PRIORITY_INTERACTIVE または PRIORITY_BACKGROUND
+
+    Returns:
+        先に完了した方の llm.ainvoke の戻り値（AIMessage）
+    """
+    tracker = _get_tracker(latency_key)
+    start = time.monotonic()
+    primary = asyncio.create_task(ainvoke(llm, messages, model_id=model_id, priority=priority))
+    tasks = [primary]
+
+    try:
+        p95 = tracker.p95()
+        if hedge is None or p95 is None:
+            response = await primary
+            tracker.record(time.monotonic() - start)
+            return response
+
+        done, _ = await asyncio.wait({primary}, timeout=max(p95, _HEDGE_MIN_DELAY))
+        if done:
+            response = primary.result()
+            tracker.record(time.monotonic() - start)
+            return response
+
+        hedge_llm, hedge_model_id = hedge
+        tracker.hedged += 1
+        print(f"[llm_gateway] p95超過({p95:.2f}秒)のためヘッジ: {model_id} -> {hedge_model_id}")
+        secondary = asyncio.create_task(
+            ainvoke(hedge_llm, messages, model_id=hedge_model_id, priority=priority)
+        )
+        tasks.append(secondary)
+        pending = {primary, secondary}
+        error: BaseException | None = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = error or task.exception()
+                    continue
+                if task is secondary:
+                    tracker.hedge_wins += 1
+                # 主リクエストが打ち切られた場合も経過時間を記録し、p95 を実態に追従させる
+                tracker.record(time.monotonic() - start)
+                return task.result()
+        raise error
+    finally:
+        # 呼び出し側のキャンセル（予算のタイムアウトなど）でもヘッジ側を含めて残りの呼び出しを止め、
+        # Bedrock へのリクエストとリミッターの枠を解放する
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+def get_metrics() -> dict:
+    """モデルIDごとのゲートウェイメトリクスを返す"""
+    return {model_id: limiter.snapshot() for model_id, limiter in _limiters.items()}
+
+
+def get_latency_metrics() -> dict:
+    """ティアごとのレイテンシ p95 とヘッジ回数を返す"""
+    return {key: tracker.snapshot() for key, tracker in _latencies.items()}
+
+
+def reset() -> None:
+    """リミッターとメトリクスを初期化する（テスト用）"""
+    _limiters.clear()
+    _latencies.clear()
@@ -0,0 +1,184 @@
+"""差分によるファイル編集（apply_patch 用）
+
+1行の修正のためにファイル全体を write_file で書き直すと、出力トークン（coder のターンで最も遅い部分）が
+ファイルの大きさに比例して増える。変更箇所だけを unified diff か SEARCH/REPLACE ブロックで受け取り、
+現在の内容と照合してから書き込む。
+
+- 全ハンクを照合してから書き込む（1つでも合わなければファイルは変更しない）
+- 書き込みは同じディレクトリの一時ファイルに書いてから rename する（途中で中断しても壊れない）
+- 改行コード（CRLF / LF）と末尾の改行の有無は元のファイルに合わせる
+"""
+
+import difflib
+import os
+import re
+import uuid
+
+_HUNK_RE = re.compile(r"^@@ -(\d+)(?:,\d+)? \+\d+(?:,\d+)? @@")
+_SEARCH_RE = re.compile(
+    r"^<{5,9} ?SEARCH[ \t]*\n(.*?)^={5,9}[ \t]*\n(.*?)^>{5,9} ?REPLACE[ \t]*$", re.M | re.S
+)
+_MAX_SUMMARY_LINES = 40
+
+
+def is_unified_diff(patch: str) -> bool:
+    return bool(re.search(r"^@@ -\d+", patch, re.M))
+
+
+def parse_search_replace(patch: str) -> list[tuple[str, str]]:
+    """SEARCH/REPLACE ブロックを (検索文字列, 置換文字列) のリストにする"""
+    blocks = [(m.group(1), m.group(2)) for m in _SEARCH_RE.finditer(patch)]
+    if not blocks:
+        raise ValueError("SEARCH/REPLACE ブロックも unified diff のハンク（@@ -a,b +c,d @@）も見つかりません")
+    return blocks
+
+
+def _trim_blank(hunk: tuple[int, list[str], list[str]], count: int) -> None:
+    if count:
+        del hunk[1][len(hunk[1]) - count:], hunk[2][len(hunk[2]) - count:]
+
+
+def parse_unified_diff(patch: str) -> list[tuple[int, list[str], list[str]]]:
+    """unified diff を (元の開始行, 元の行, 新しい行) のハンクのリストにする
+
+    --- / +++ のファイル見出しは無視する。見出しの行数は書き間違いが多いので使わず、本文の行から数える。
+    """
+    hunks = []
+    current = None
+    raw_blank = 0   # ハンク末尾の " " のない空行。次のハンクやパッチの終わりの直前なら捨てる
+    lines = patch.split("\n")
+    for i, line in enumerate(lines):
+        match = _HUNK_RE.match(line)
+        if match:
+            if current is not None:
+                _trim_blank(current, raw_blank)
+            current = (int(match.group(1)), [], [])
+            hunks.append(current)
+            raw_blank = 0
+            continue
+        if line.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ "):
+            current = None   # 次のファイルの見出し
+            continue
+        if current is None or line.startswith(("\\", "+++ ")):
+            continue
+        if not line:
+            current[1].append("")
+            current[2].append("")
+            raw_blank += 1
+            continue
+        tag, body = line[:1], line[1:]
+        if tag not in " -+":
+            _trim_blank(current, raw_blank)
+            current = None   # diff 以外の行（説明文など）でハンクを終える
+            continue
+        raw_blank = 0
+        if tag != "+":
+            current[1].append(body)
+        if tag != "-":
+            current[2].append(body)
+    if current is not None:
+        _trim_blank(current, raw_blank)
+    return hunks
+
+
+def _find_block(lines: list[str], block: list[str], hint: int) -> int:
+    """lines の中で block と一致する位置を返す。hint の位置を優先し、なければ一意に一致する位置を探す"""
+    n = len(block)
+    if lines[hint:hint + n] == block:
+        return hint
+    matches = [i for i in range(len(lines) - n + 1) if lines[i:i + n] == block]
+    if len(matches) == 1:
+        return matches[0]
+    if not matches:
+        return -1
+    # 複数一致する場合は hint に最も近い位置を使う（patch コマンドと同じ考え方）
+    return min(matches, key=lambda i: abs(i - hint))
+
+
+def _apply_hunks(content: str, hunks: list[tuple[int, list[str], list[str]]]) -> str:
+    lines = content.split("\n") if content else []
+    offset = 0   # 前のハンクまでで行位置がずれた量
+    for start, old, new in hunks:
+        base = start - 1 if old else start   # 追加だけのハンクは start 行の後ろに入れる
+        hint = min(max(0, base + offset), len(lines))
+        pos = _find_block(lines, old, hint) if old else hint
+        if pos < 0:
+            first = next((l for l in old if l.strip()), old[0])
+            raise ValueError(f"@@ -{start} のハンクが現在の内容と一致しません（先頭: {first.strip()[:60]!r}）")
+        lines[pos:pos + len(old)] = new
+        offset = pos - base + len(new) - len(old)
+    return "\n".join(lines)
+
+
+def _apply_blocks(content: str, blocks: list[tuple[str, str]]) -> str:
+    for search, replace in blocks:
+        if not search:
+            if content:
+                raise ValueError("空の SEARCH は新規ファイルの作成にのみ使えます")
+            content = replace
+            continue
+        count = content.count(search)
+        if count == 0:
+            first = next((l for l in search.split("\n") if l.strip()), search)
+            raise ValueError(f"SEARCH の内容が見つかりません（先頭: {first.strip()[:60]!r}）")
+        if count > 1:
+            raise ValueError(f"SEARCH の内容が {count} か所に一致します。前後の行を含めて一意にしてください")
+        content = content.replace(search, replace, 1)
+    return content
+
+
+def apply(content: str, patch: str) -> tuple[str, int]:
+    """patch を content に適用し、(新しい内容, 適用したハンク数) を返す。一致しなければ ValueError"""
+    trailing_newline = content.endswith("\n")
+    if is_unified_diff(patch):
+        hunks = parse_unified_diff(patch)
+        body = content[:-1] if trailing_newline else content
+        result = _apply_hunks(body, hunks)
+        if trailing_newline or (not content and result):
+            result += "\n"
+        return result, len(hunks)
+    blocks = parse_search_replace(patch)
+    return _apply_blocks(content, blocks), len(blocks)
+
+
+def read_text(path: str) -> tuple[str, str]:
+    """ファイルを読み、(LF に揃えた内容, 元の改行コード) を返す。存在しなければ ("", "\\n")"""
+    try:
+        with open(path, encoding="utf-8", newline="") as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return "", "\n"
+    newline = "\r\n" if "\r\n" in raw else "\n"
+    return raw.replace("\r\n", "\n"), newline
+
+
+def write_atomic(path: str, text: str, newline: str = "\n") -> None:
+    """同じディレクトリの一時ファイルに書き込んでから rename で置き換える（既存ファイルの権限は引き継ぐ）"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, f".{os.path.basename(path)}.{uuid.uuid4().hex[:8]}.tmp")
+    # 0o666 で作れば新規ファイルは umask に従う（mkstemp だと 0o600 になる）
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline=newline) as f:
+            f.write(text)
+        try:
+            os.chmod(tmp, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def summarize(path: str, old: str, new: str) -> str:
+    """変更の要約（+/- 行数と前後0行の差分。_MAX_SUMMARY_LINES 行で打ち切る）"""
+    diff = list(difflib.unified_diff(old.split("\n"), new.split("\n"), lineterm="", n=0))[2:]
+    added = sum(1 for l in diff if l.startswith("+"))
+    removed = sum(1 for l in diff if l.startswith("-"))
+    header = f"{path}: +{added} -{removed} 行"
+    if len(diff) > _MAX_SUMMARY_LINES:
+        diff = diff[:_MAX_SUMMARY_LINES] + [f"…（ほか {len(diff) - _MAX_SUMMARY_LINES} 行）"]
+    return "\n".join([header] + diff)
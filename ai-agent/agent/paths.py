@@ -0,0 +1,15 @@
+"""エージェントがローカルに永続化するデータの保存先"""
+
+import os
+
+# 既定では ai-agent/data/ 配下に保存する（AGENT_DATA_DIR で変更可能）
+DATA_DIR = os.environ.get("AGENT_DATA_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"
+)
+
+
+def data_path(*parts: str) -> str:
+    """データディレクトリ配下のパスを返す（ディレクトリは必要に応じて作成）"""
+    path = os.path.join(DATA_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
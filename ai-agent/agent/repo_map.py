@@ -0,0 +1,197 @@
+"""リポジトリのシンボル一覧（planner / coder のプロンプト用）
+
+ワークスペースのソースファイルごとにトップレベルのクラス・関数とシグネチャを取り出し、
+サイズ上限つきのテキストにしてプロンプトへ渡す（list_files + read_file による探索を減らす）。
+
+- Python は ast で解析する（_ で始まる関数は除き、クラスは公開メソッドと __init__ も含める）
+- TypeScript / JavaScript と C / C++（.ino を含む）は行単位の正規表現で取り出す
+- 解析結果はファイル内容のハッシュで保持し、file_index が stat で見つけた変更ファイルだけを読み直す
+  （内容が同じならハッシュが一致して解析を省く）
+"""
+
+import ast
+import hashlib
+import os
+import re
+
+from agent import file_index
+
+_MAX_FILE_BYTES = 512 * 1024
+_MAX_SIGNATURE_CHARS = 120
+_MAX_DIGESTS = 4096
+
+_PY_EXTENSIONS = (".py",)
+_TS_EXTENSIONS = (".ts", ".tsx", ".js", ".jsx", ".mjs")
+_CPP_EXTENSIONS = (".c", ".cc", ".cpp", ".h", ".hpp", ".ino")
+
+_TS_PATTERNS = [
+    (re.compile(r"^(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*(\w+)\s*(?:<[^>]*>)?\s*\(([^)]*)\)"),
+     "function {0}({1})"),
+    (re.compile(r"^(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+(\w+)"), "class {0}"),
+    (re.compile(r"^(?:export\s+)?(?:declare\s+)?(interface|type|enum)\s+(\w+)"), "{0} {1}"),
+    (re.compile(r"^(?:export\s+)?const\s+(\w+)\s*(?::[^=]+)?=\s*(?:async\s+)?\(([^)]*)\)\s*(?::[^=]+)?=>"),
+     "const {0} = ({1}) =>"),
+]
+_CPP_CLASS_RE = re.compile(r"^(?:template\s*<[^>]*>\s*)?(class|struct)\s+(\w+)\b(?!\s*;)")
+_CPP_FUNC_RE = re.compile(
+    r"^(?!(?:if|for|while|switch|return|else|do|case|typedef|using)\b)"
+    r"((?:[\w:<>,]+[\s*&]+)+)([A-Za-z_][\w:]*)\s*\(([^;{)]*)\)\s*(?:const\s*)?(?:\{.*|;)?\s*$"
+)
+_CPP_PARAM_RE = re.compile(r"\w[\s*&]+\w|\.\.\.")
+
+
+def _clip(signature: str) -> str:
+    signature = " ".join(signature.split())
+    if len(signature) > _MAX_SIGNATURE_CHARS:
+        return signature[:_MAX_SIGNATURE_CHARS - 1] + "…"
+    return signature
+
+
+def _py_function(node: ast.FunctionDef | ast.AsyncFunctionDef) -> str:
+    prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+    returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+    return _clip(f"{prefix} {node.name}({ast.unparse(node.args)}){returns}")
+
+
+def outline_python(text: str) -> list[str]:
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return ["（構文エラー）"]
+    symbols = []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            if not node.name.startswith("_"):
+                symbols.append(_py_function(node))
+        elif isinstance(node, ast.ClassDef):
+            bases = ", ".join(ast.unparse(b) for b in node.bases)
+            symbols.append(_clip(f"class {node.name}({bases})" if bases else f"class {node.name}"))
+            for item in node.body:
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)) and (
+                    not item.name.startswith("_") or item.name == "__init__"
+                ):
+                    symbols.append("  " + _py_function(item))
+    return symbols
+
+
+def outline_ts(text: str) -> list[str]:
+    symbols = []
+    for line in text.splitlines():
+        if not line or line[0].isspace():
+            continue
+        for pattern, template in _TS_PATTERNS:
+            match = pattern.match(line)
+            if match:
+                symbols.append(_clip(template.format(*match.groups())))
+                break
+    return symbols
+
+
+def outline_cpp(text: str) -> list[str]:
+    symbols = []
+    for line in text.splitlines():
+        if not line or line[0].isspace() or line.startswith(("#", "//", "/*", "*")):
+            continue
+        match = _CPP_CLASS_RE.match(line)
+        if match:
+            symbols.append(f"{match.group(1)} {match.group(2)}")
+            continue
+        match = _CPP_FUNC_RE.match(line)
+        if match:
+            params = match.group(3).strip()
+            # `Foo foo(bar);` のような引数つきのオブジェクト定義は除く（引数に型がない）
+            if params and params != "void" and not all(_CPP_PARAM_RE.search(p) for p in params.split(",")):
+                continue
+            signature = _clip(f"{match.group(1).strip()} {match.group(2)}({params})")
+            if signature not in symbols:  # #ifdef で分岐した同じ定義は1つにする
+                symbols.append(signature)
+    return symbols
+
+
+def outline(rel: str, text: str) -> list[str]:
+    """拡張子に応じてファイルのシンボル一覧を返す"""
+    if rel.endswith(_PY_EXTENSIONS):
+        return outline_python(text)
+    if rel.endswith(_TS_EXTENSIONS):
+        return outline_ts(text)
+    if rel.endswith(_CPP_EXTENSIONS):
+        return outline_cpp(text)
+    return []
+
+
+class RepoMap(file_index.IncrementalIndex):
+    """1つのワークスペースに対するシンボル一覧"""
+
+    _SOURCE_EXTENSIONS = _PY_EXTENSIONS + _TS_EXTENSIONS + _CPP_EXTENSIONS
+
+    def __init__(self, root: str):
+        super().__init__(root)
+        self._files: dict[str, str] = {}              # 相対パス → ハッシュ
+        self._symbols: dict[str, list[str]] = {}      # ハッシュ → シンボル一覧
+        self.parsed = 0
+
+    def _load(self, rel: str) -> None:
+        try:
+            with open(os.path.join(self.root, rel), "rb") as f:
+                data = f.read()
+        except OSError:
+            self._files.pop(rel, None)
+            return
+        # 同じ内容でも拡張子で解析方法が変わるのでキーに含める
+        digest = os.path.splitext(rel)[1] + ":" + hashlib.sha1(data).hexdigest()
+        if digest not in self._symbols:
+            try:
+                text = data.decode("utf-8")
+            except UnicodeDecodeError:
+                text = ""
+            if len(self._symbols) >= _MAX_DIGESTS:
+                live = set(self._files.values())
+                self._symbols = {d: s for d, s in self._symbols.items() if d in live}
+            self._symbols[digest] = outline(rel, text)
+            self.parsed += 1
+        self._files[rel] = digest
+
+    def _update(self, changed: dict[str, int], removed: list[str]) -> None:
+        for rel in removed:
+            self._files.pop(rel, None)
+        for rel, size in changed.items():
+            if not rel.endswith(self._SOURCE_EXTENSIONS):
+                continue
+            if size > _MAX_FILE_BYTES:
+                self._files.pop(rel, None)
+            else:
+                self._load(rel)
+
+    def symbols(self) -> dict[str, list[str]]:
+        """相対パス → シンボル一覧"""
+        with self._lock:
+            self._refresh()
+            return {rel: self._symbols[digest] for rel, digest in sorted(self._files.items())}
+
+    def render(self, max_chars: int = 6000, focus: list[str] | tuple[str, ...] = ()) -> str:
+        """シンボル一覧をテキストにする。focus のファイルを先頭に置き、max_chars で打ち切る"""
+        files = self.symbols()
+        focus = [
+            os.path.relpath(os.path.join(self.root, f), self.root).replace(os.sep, "/") for f in focus
+        ]
+        order = [f for f in focus if f in files] + [f for f in files if f not in focus]
+        blocks, size = [], 0
+        for i, rel in enumerate(order):
+            block = "\n".join([rel] + [f"  {s}" for s in files[rel]])
+            if size + len(block) + 1 > max_chars:
+                blocks.append(f"…（ほか {len(order) - i} ファイル。list_files / search_code で確認）")
+                break
+            blocks.append(block)
+            size += len(block) + 1
+        return "\n".join(blocks)
+
+
+_maps = file_index.Registry(RepoMap)
+
+
+def get_map(root: str) -> RepoMap:
+    return _maps.get(root)
+
+
+def render(root: str, max_chars: int = 6000, focus: list[str] | tuple[str, ...] = ()) -> str:
+    return get_map(root).render(max_chars, focus)
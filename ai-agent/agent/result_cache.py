@@ -0,0 +1,179 @@
+"""テスト実行結果のキャッシュ（run_shell / run_tests / run_affected_tests 用）
+
+coder が実行したテストを reviewer が同じツリーのまま再実行することが多いため、
+(コマンド, 関連ファイルの内容のハッシュ) をキーに実行結果をローカルの SQLite に保存し、
+同じキーの実行はキャッシュから即座に返す。
+
+- 関連ファイル
+  - run_shell: 実行ディレクトリのプロジェクト（pyproject.toml などのあるディレクトリ）配下の全ファイル
+  - run_tests / run_affected_tests: 上と同じプロジェクト配下の全ファイルに加え、テストファイルが
+    （推移的に）import するプロジェクト外のワークスペース内の Python ファイル。conftest.py や
+    pytest のプラグイン、importlib で読み込むモジュールなど、テストが直接 import しないファイルも
+    結果を左右するため、import の依存関係だけには絞らない
+- ファイルの内容のハッシュは (mtime_ns, size) が変わったときだけ計算し直す。write_file /
+  apply_patch で書き込むと関連ファイルのハッシュが変わるので、以前の結果は使われなくなる
+- run_shell はテストを実行するコマンド（pytest / test_*.py / npm test など）だけを対象にする
+- タイムアウトした結果は保存しない。保存件数は _MAX_ENTRIES 件まで（古いものから削除）
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from agent import file_index, impact
+from agent.paths import data_path
+
+_DB_FILE = "test_results.db"
+_MAX_ENTRIES = 500
+_ENABLED = os.environ.get("TEST_CACHE_ENABLED", "1").lower() not in ("0", "false", "no")
+
+_TEST_COMMAND_RE = re.compile(
+    r"\b(pytest|unittest|tox|nox|(npm|pnpm|yarn)( run)? test|go test|cargo test|make (check|test))\b"
+    r"|(^|[\s/])(test_[\w.-]*|[\w.-]*_test)\.py\b"
+)
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    command TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created REAL NOT NULL
+)"""
+
+_lock = threading.Lock()
+_digests: dict[str, tuple[int, int, str]] = {}   # 絶対パス → (mtime_ns, size, sha1)
+_conn: sqlite3.Connection | None = None
+_conn_path = ""
+stats = {"hits": 0, "misses": 0, "stores": 0}
+
+
+def enabled() -> bool:
+    return _ENABLED
+
+
+def is_test_command(command: str) -> bool:
+    """run_shell のコマンドがテストの実行か"""
+    return bool(_TEST_COMMAND_RE.search(command))
+
+
+def _db_path() -> str:
+    return data_path(_DB_FILE)
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn, _conn_path
+    path = _db_path()
+    if _conn is None or _conn_path != path:
+        if _conn is not None:
+            _conn.close()
+        _conn = sqlite3.connect(path, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(_SCHEMA)
+        _conn_path = path
+    return _conn
+
+
+def file_digest(path: str) -> str | None:
+    """ファイルの内容の sha1（stat が変わっていなければ前回の値を使う）"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    with _lock:
+        entry = _digests.get(path)
+    if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+        return entry[2]
+    h = hashlib.sha1()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    except OSError:
+        return None
+    digest = h.hexdigest()
+    with _lock:
+        _digests[path] = (st.st_mtime_ns, st.st_size, digest)
+    return digest
+
+
+def _project_files(root: str, project: str) -> list[str]:
+    """project 配下のファイル（root からの相対パス、.gitignore を考慮）"""
+    prefix = os.path.relpath(project, root).replace(os.sep, "/")
+    paths = file_index.get_index(root).paths()
+    if prefix == ".":
+        return list(paths)
+    return [p for p in paths if p.startswith(prefix + "/")]
+
+
+def shell_inputs(root: str, project: str) -> list[str]:
+    """run_shell のテストコマンドに関連するファイル"""
+    return _project_files(root, project)
+
+
+def test_inputs(root: str, project: str, tests: list[str]) -> list[str]:
+    """tests（root からの相対パス）の実行結果に関連するファイル"""
+    graph = impact.get_graph(root)
+    files = set(_project_files(root, project))
+    for rel in tests:
+        files |= graph.dependency_closure(rel)
+    return sorted(files)
+
+
+def make_key(root: str, kind: str, command: str, cwd: str, files: list[str]) -> str:
+    """キャッシュのキー（ワークスペース・コマンド・実行ディレクトリ・関連ファイルの内容から計算する）"""
+    h = hashlib.sha1()
+    h.update(json.dumps([root, kind, command, os.path.relpath(cwd, root)], ensure_ascii=False).encode("utf-8"))
+    for rel in sorted(files):
+        h.update(f"\0{rel}\0{file_digest(os.path.join(root, rel))}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def lookup(key: str) -> dict | None:
+    """保存済みの結果（"cached_at" に実行時刻を付ける）。なければ None"""
+    with _lock:
+        row = _connect().execute("SELECT result, created FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            stats["misses"] += 1
+            return None
+        stats["hits"] += 1
+    result = json.loads(row[0])
+    result["cached_at"] = row[1]
+    return result
+
+
+def save(key: str, command: str, result: dict) -> None:
+    """結果を保存する（タイムアウトした結果は保存しない）"""
+    if result.get("timed_out"):
+        return
+    with _lock:
+        conn = _connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, command, result, created) VALUES (?, ?, ?, ?)",
+                (key, command, json.dumps(result, ensure_ascii=False), time.time()),
+            )
+            conn.execute(
+                "DELETE FROM results WHERE key IN "
+                "(SELECT key FROM results ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (_MAX_ENTRIES,),
+            )
+        stats["stores"] += 1
+
+
+def cached_note(result: dict) -> str:
+    """キャッシュから返した結果に付ける説明"""
+    when = time.strftime("%H:%M:%S", time.localtime(result["cached_at"]))
+    return (
+        f"♻️ キャッシュ済みの結果です（{when} の実行結果。関連ファイルに変更がないため再実行していません。"
+        f"再実行するには use_cache=False を指定）"
+    )
+
+
+def invalidate(path: str) -> None:
+    """書き込まれたファイルのハッシュを捨てる（次の参照で計算し直す）"""
+    with _lock:
+        _digests.pop(os.path.realpath(path), None)
+        _digests.pop(path, None)
@@ -0,0 +1,158 @@
+"""プランナー用のファイル検索（BM25）
+
+plan.md の各項目について関連しそうなファイルを BM25 で順位付けし、
+プランナーのプロンプトに候補として渡す（LLM がツールでツリーを探索する回数を減らす）。
+
+- 文書はワークスペースの各ファイル。パス（重み付き）・識別子・コメントや docstring の語を索引する
+- 識別子は snake_case / camelCase で分割し、日本語（かな・漢字）は文字 2-gram にする
+- 索引は code_search と同じく file_index が stat で見つけた変更・削除だけを取り込む
+"""
+
+import math
+import os
+import re
+from collections import Counter
+
+from agent import file_index
+
+_MAX_FILE_BYTES = 256 * 1024   # これより大きいファイルはパスだけを索引する
+_PATH_WEIGHT = 3               # パスの語は本文の語より重く数える
+_K1 = 1.2
+_B = 0.75
+
+_TOKEN_RE = re.compile(r"[A-Za-z][A-Za-z0-9_]*|[\u3040-\u30ff\u3400-\u9fff]+")
+_CAMEL_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u9fff]")
+_STOPWORDS = frozenset(
+    "a an and as at be by def do else for from if import in is it not of on or return self "
+    "the this to true false none null with var let const function class str int dict list".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """識別子を分割した小文字の語と、日本語の文字 2-gram を返す"""
+    tokens = []
+    for match in _TOKEN_RE.finditer(text):
+        word = match.group()
+        if _CJK_RE.match(word):
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+            continue
+        parts = [p.lower() for chunk in word.split("_") for p in _CAMEL_RE.findall(chunk)]
+        if len(parts) > 1:
+            tokens.append(word.lower())
+        tokens.extend(p for p in parts if len(p) > 1 and p not in _STOPWORDS)
+    return tokens
+
+
+def _path_tokens(rel: str) -> list[str]:
+    return tokenize(re.sub(r"[/.\-]", " ", rel)) * _PATH_WEIGHT
+
+
+class BM25Index(file_index.IncrementalIndex):
+    """1つのワークスペースに対する BM25 索引"""
+
+    def __init__(self, root: str):
+        super().__init__(root)
+        self._docs: dict[str, Counter] = {}                      # 相対パス → 語の出現数
+        self._lengths: dict[str, int] = {}
+        self._postings: dict[str, dict[str, int]] = {}           # 語 → {相対パス: 出現数}
+        self._total_length = 0
+
+    def _remove(self, rel: str) -> None:
+        counts = self._docs.pop(rel, None)
+        if counts is None:
+            return
+        for term in counts:
+            docs = self._postings.get(term)
+            if docs is not None:
+                docs.pop(rel, None)
+                if not docs:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(rel, 0)
+
+    def _add(self, rel: str, size: int) -> None:
+        self._remove(rel)
+        tokens = _path_tokens(rel)
+        if size <= _MAX_FILE_BYTES:
+            try:
+                with open(os.path.join(self.root, rel), "rb") as f:
+                    tokens += tokenize(f.read().decode("utf-8"))
+            except (OSError, UnicodeDecodeError):
+                pass
+        counts = Counter(tokens)
+        self._docs[rel] = counts
+        self._lengths[rel] = len(tokens)
+        self._total_length += len(tokens)
+        for term, tf in counts.items():
+            self._postings.setdefault(term, {})[rel] = tf
+
+    def _update(self, changed: dict[str, int], removed: list[str]) -> None:
+        for rel in removed:
+            self._remove(rel)
+        for rel, size in changed.items():
+            self._add(rel, size)
+
+    def search(self, query: str, top_k: int = 5) -> list[tuple[str, float]]:
+        """クエリに関連するファイルを (相対パス, スコア) の降順で返す"""
+        with self._lock:
+            self._refresh()
+            n = len(self._docs)
+            if not n:
+                return []
+            avgdl = self._total_length / n or 1.0
+            scores: Counter = Counter()
+            for term in set(tokenize(query)):
+                docs = self._postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                for rel, tf in docs.items():
+                    norm = tf + _K1 * (1 - _B + _B * self._lengths[rel] / avgdl)
+                    scores[rel] += idf * tf * (_K1 + 1) / norm
+        return [(rel, round(score, 3)) for rel, score in scores.most_common(top_k)]
+
+
+_PLAN_ITEM_RE = re.compile(r"^\s*(?:[-*+]|\d+[.)]|#{1,6})\s+(.*\S)")
+
+
+def plan_items(plan: str) -> list[str]:
+    """plan.md を項目（箇条書き・番号付きリスト・見出し）に分ける。項目がなければ全体を1項目とする"""
+    items = [m.group(1) for m in map(_PLAN_ITEM_RE.match, plan.splitlines()) if m]
+    if not items and plan.strip():
+        items = [plan.strip()]
+    return items
+
+
+def shortlist(
+    root: str, plan: str, top_k: int = 5, max_items: int = 20, exclude: tuple[str, ...] = ()
+) -> list[dict]:
+    """plan の各項目について関連ファイルの候補を返す（exclude の相対パスは除く）
+
+    Returns:
+        [{"item": 項目, "files": [(相対パス, スコア), ...]}, ...]
+    """
+    index = get_index(root)
+    result = []
+    for item in plan_items(plan)[:max_items]:
+        files = [f for f in index.search(item, top_k + len(exclude)) if f[0] not in exclude][:top_k]
+        if files:
+            result.append({"item": item, "files": files})
+    return result
+
+
+def format_shortlist(entries: list[dict]) -> str:
+    lines = []
+    for entry in entries:
+        lines.append(f"- {entry['item'][:80]}")
+        lines.append("  " + ", ".join(path for path, _ in entry["files"]))
+    return "\n".join(lines)
+
+
+_indexes = file_index.Registry(BM25Index)
+
+
+def get_index(root: str) -> BM25Index:
+    return _indexes.get(root)
@@ -0,0 +1,95 @@
+"""reviewer に渡す coder の変更差分
+
+reviewer にはファイル全体ではなく、タスク開始時からの unified diff（前後 _CONTEXT_LINES 行の文脈付き）を渡す。
+
+- タスク用の worktree（worktrees.py）があれば、割り当て時のスナップショットとの `git diff` を使う。
+  run_shell 経由の変更（フォーマッタ・コード生成・sed -i など）も含め、ワークスペースのすべての変更が現れる
+- worktree がない場合は、coder の開始時に planner が挙げた write_files の内容を控え、さらに
+  write_file / apply_patch がタスク中に初めて書き換えたファイルの元の内容を記録して（tools.track_changes）
+  差分を作る。この場合 run_shell 経由の変更は write_files に含まれるファイルの分だけ現れる
+- 差分が _MAX_DIFF_CHARS を超える場合は途中で切り、残りは read_file_lines で読むよう促す
+"""
+
+import difflib
+import os
+
+_CONTEXT_LINES = 6
+_MAX_DIFF_CHARS = 24000
+_MAX_FILE_BYTES = 2 * 1024 * 1024
+
+
+def read_original(path: str) -> str | None:
+    """書き換え前の内容として控えるテキスト（ファイルがなければ None）"""
+    try:
+        if os.path.getsize(path) > _MAX_FILE_BYTES:
+            return f"（{_MAX_FILE_BYTES // (1024 * 1024)}MB を超えるため内容を控えていません）\n"
+        with open(path, encoding="utf-8", errors="replace", newline="") as f:
+            return f.read()
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        return None
+
+
+def snapshot(root: str, paths: list[str]) -> dict[str, str | None]:
+    """paths（root からの相対パス）の現在の内容を控える（相対パス → 内容。存在しなければ None）"""
+    originals = {}
+    for path in paths:
+        rel = os.path.normpath(path).replace(os.sep, "/")
+        if rel.startswith("../") or os.path.isabs(rel):
+            continue
+        originals[rel] = read_original(os.path.join(root, rel))
+    return originals
+
+
+def _file_diff(rel: str, before: str | None, after: str | None, context: int) -> tuple[str, int, int]:
+    lines = list(difflib.unified_diff(
+        (before or "").splitlines(keepends=True),
+        (after or "").splitlines(keepends=True),
+        f"a/{rel}" if before is not None else "/dev/null",
+        f"b/{rel}" if after is not None else "/dev/null",
+        n=context,
+    ))
+    added = sum(1 for line in lines[2:] if line.startswith("+"))
+    removed = sum(1 for line in lines[2:] if line.startswith("-"))
+    text = "".join(line if line.endswith("\n") else line + "\n\\ No newline at end of file\n" for line in lines)
+    return text, added, removed
+
+
+def render(root: str, originals: dict[str, str | None], context: int = _CONTEXT_LINES,
+           max_chars: int = _MAX_DIFF_CHARS) -> str:
+    """控えた内容から現在までの差分（変更がなければ ""）"""
+    parts, files, added, removed = [], 0, 0, 0
+    for rel in sorted(originals):
+        before = originals[rel]
+        after = read_original(os.path.join(root, rel))
+        if before == after:
+            continue
+        text, plus, minus = _file_diff(rel, before, after, context)
+        if not text:
+            continue
+        parts.append(text)
+        files += 1
+        added += plus
+        removed += minus
+    if not files:
+        return ""
+    return _format("".join(parts), files, added, removed, max_chars)
+
+
+def render_worktree(pool, worktree, context: int = _CONTEXT_LINES, max_chars: int = _MAX_DIFF_CHARS) -> str:
+    """タスク用の worktree の割り当て時からの差分（変更がなければ ""）"""
+    body = pool.diff(worktree, context)
+    if not body:
+        return ""
+    lines = body.splitlines()
+    files = sum(1 for line in lines if line.startswith("diff --git "))
+    added = sum(1 for line in lines if line.startswith("+") and not line.startswith("+++ "))
+    removed = sum(1 for line in lines if line.startswith("-") and not line.startswith("--- "))
+    return _format(body, files, added, removed, max_chars)
+
+
+def _format(body: str, files: int, added: int, removed: int, max_chars: int) -> str:
+    if len(body) > max_chars:
+        cut = body.rfind("\n", 0, max_chars) + 1
+        omitted = body.count("\n", cut)
+        body = body[:cut] + f"…（差分が長いため残り {omitted} 行を省略。必要な箇所は read_file_lines で確認）\n"
+    return f"変更ファイル {files} 件（+{added} -{removed} 行）\n{body}"
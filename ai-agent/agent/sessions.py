@@ -0,0 +1,140 @@
+"""走行セッションの集計
+
+running_start から running_stop までを 1セッションとして、サンプル受信のたびに
+集計値を更新する（生の履歴を後から読み直さない）。
+
+- 経過時間、ステータス（Run / Walk / None）ごとの滞在時間
+- bpm の件数・平均・標準偏差・最小・最大
+- セッション中に完了した開発タスク数
+
+終了したセッションは 1行の JSON サマリーとして永続化ストアに保存する。
+"""
+
+import math
+import time
+from collections import deque
+
+from agent import store as sensor_store
+from agent.history import format_timestamp
+
+_MAX_GAP = 30.0          # これより長い受信間隔はステータス滞在時間に数えない（秒）
+_RECENT_SESSIONS = 50    # ストアがない場合にメモリに残す終了済みセッション数
+
+
+class RunSession:
+    """1セッション分の集計値（O(1) で更新）"""
+
+    __slots__ = (
+        "device_id", "started", "last_ts", "last_status", "status_seconds",
+        "samples", "bpm_count", "bpm_sum", "bpm_sumsq", "bpm_min", "bpm_max", "tasks_completed",
+    )
+
+    def __init__(self, device_id: str, started: float):
+        self.device_id = device_id
+        self.started = started
+        self.last_ts = started
+        self.last_status: str | None = None
+        self.status_seconds: dict[str, float] = {}
+        self.samples = 0
+        self.bpm_count = 0
+        self.bpm_sum = 0.0
+        self.bpm_sumsq = 0.0
+        self.bpm_min = math.inf
+        self.bpm_max = -math.inf
+        self.tasks_completed = 0
+
+    def observe(self, status: str, bpm: float | None, ts: float) -> None:
+        """1サンプル分の集計を更新する"""
+        gap = ts - self.last_ts
+        if self.last_status is not None and 0 < gap <= _MAX_GAP:
+            self.status_seconds[self.last_status] = self.status_seconds.get(self.last_status, 0.0) + gap
+        self.last_ts = max(self.last_ts, ts)
+        self.last_status = status
+        self.samples += 1
+        if bpm is not None:
+            self.bpm_count += 1
+            self.bpm_sum += bpm
+            self.bpm_sumsq += bpm * bpm
+            self.bpm_min = min(self.bpm_min, bpm)
+            self.bpm_max = max(self.bpm_max, bpm)
+
+    def summary(self, ended: float | None = None) -> dict:
+        end = max(ended if ended is not None else self.last_ts, self.started)
+        bpm = None
+        if self.bpm_count:
+            mean = self.bpm_sum / self.bpm_count
+            std = math.sqrt(max(self.bpm_sumsq / self.bpm_count - mean * mean, 0.0))
+            bpm = {
+                "count": self.bpm_count,
+                "mean": round(mean, 3),
+                "std": round(std, 3),
+                "min": round(self.bpm_min, 3),
+                "max": round(self.bpm_max, 3),
+            }
+        return {
+            "device_id": self.device_id,
+            "started": format_timestamp(self.started),
+            "ended": format_timestamp(end) if ended is not None else None,
+            "duration_sec": round(end - self.started, 1),
+            "status_seconds": {k: round(v, 1) for k, v in self.status_seconds.items()},
+            "samples": self.samples,
+            "bpm": bpm,
+            "tasks_completed": self.tasks_completed,
+        }
+
+
+class SessionTracker:
+    """デバイスごとの進行中セッションと終了済みセッション"""
+
+    def __init__(self):
+        self._active: dict[str, RunSession] = {}
+        self._finished: deque[dict] = deque(maxlen=_RECENT_SESSIONS)
+
+    def start(self, device_id: str, ts: float | None = None) -> None:
+        """セッションを開始する（進行中のものがあれば何もしない）"""
+        if device_id not in self._active:
+            self._active[device_id] = RunSession(device_id, ts if ts is not None else time.time())
+
+    def observe(self, device_id: str, status: str, bpm: float | None, ts: float | None = None) -> None:
+        """進行中のセッションにサンプルを反映する"""
+        session = self._active.get(device_id)
+        if session is not None:
+            session.observe(status, bpm, ts if ts is not None else time.time())
+
+    def task_completed(self, device_id: str) -> None:
+        """開発タスクの完了を、そのタスクを起動したデバイスの進行中セッションに数える"""
+        session = self._active.get(device_id)
+        if session is not None:
+            session.tasks_completed += 1
+
+    def finish(self, device_id: str, ts: float | None = None) -> dict | None:
+        """セッションを終了してサマリーを返す（永続化ストアがあれば保存する）"""
+        session = self._active.pop(device_id, None)
+        if session is None:
+            return None
+        summary = session.summary(ts if ts is not None else session.last_ts)
+        self._finished.append(summary)
+        store = sensor_store.get_store()
+        if store is not None:
+            store.put_session(summary)
+        return summary
+
+    def active(self) -> list[dict]:
+        return [session.summary() for session in self._active.values()]
+
+    def recent(self, limit: int = 20, device_id: str | None = None) -> list[dict]:
+        """終了済みセッションのサマリーを新しい順に返す"""
+        store = sensor_store.get_store()
+        if store is not None:
+            store.flush()
+            return store.sessions(limit, device_id)
+        finished = [s for s in reversed(self._finished) if device_id is None or s["device_id"] == device_id]
+        return finished[:limit]
+
+    def reset(self) -> None:
+        self._active.clear()
+        self._finished.clear()
+
+
+# プロセス共通のトラッカー（trigger_check / reviewer_node から更新される）
+TRACKER = SessionTracker()
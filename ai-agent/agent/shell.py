@@ -0,0 +1,301 @@
+"""run_shell のコマンド実行（非同期・出力のストリーミングと切り詰め）
+
+- asyncio のサブプロセスで実行し、出力行を SSE（shell_output）へ逐次送る
+- LLM に返すのは先頭 _HEAD_LINES 行と末尾 _TAIL_LINES 行だけ。全出力は data/shell/ の
+  ログファイルに書き、切り詰めた場合はそのパスを返す（read_file_lines / tail_file で参照できる）
+- 改行のない出力（minify した出力・\r の進捗表示など）も _MAX_PARTIAL_BYTES ごとに行として扱い、メモリに溜めない
+- コマンドは新しいプロセスグループで起動し、タイムアウトやキャンセル時はグループごと終了させる
+- 同時に実行するコマンド数を SHELL_MAX_CONCURRENCY（既定 2）に制限する
+"""
+
+import asyncio
+import collections
+import itertools
+import os
+import signal
+import time
+
+from agent.paths import data_path
+
+_MAX_CONCURRENT = max(1, int(os.environ.get("SHELL_MAX_CONCURRENCY", "2")))
+_HEAD_LINES = 60
+_TAIL_LINES = 120
+_MAX_LINE_CHARS = 500
+_READ_CHUNK = 64 * 1024
+_MAX_PARTIAL_BYTES = 64 * 1024   # 改行のない出力はこの長さごとに1行として扱う（\r で上書きする進捗表示など）
+_FLUSH_INTERVAL = 0.2     # SSE へ出力行をまとめて送る間隔（秒）
+_MAX_BATCH_LINES = 200
+_KILL_GRACE = 2.0         # SIGTERM から SIGKILL までの猶予（秒）
+_KEEP_LOGS = 50
+
+_run_ids = itertools.count(1)
+
+
+class _ProcessLimiter:
+    """同時実行数の上限（到着順の待ち行列）"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.running = 0
+        self._waiters: collections.deque[asyncio.Future] = collections.deque()
+        self.started = 0
+        self.timeouts = 0
+
+    async def acquire(self) -> None:
+        if self.running < self.limit and not self._waiters:
+            self.running += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()
+            else:
+                self._waiters.remove(fut)
+            raise
+
+    def release(self) -> None:
+        self.running -= 1
+        while self._waiters and self.running < self.limit:
+            fut = self._waiters.popleft()
+            if fut.done():
+                continue
+            self.running += 1
+            fut.set_result(None)
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": self.limit,
+            "running": self.running,
+            "queued": len(self._waiters),
+            "started": self.started,
+            "timeouts": self.timeouts,
+        }
+
+
+LIMITER = _ProcessLimiter(_MAX_CONCURRENT)
+
+
+class OutputWindow:
+    """先頭と末尾の行だけを保持し、全行はログファイルに書く"""
+
+    def __init__(self, log_path: str, head: int = _HEAD_LINES, tail: int = _TAIL_LINES):
+        self.log_path = log_path
+        self.head: list[str] = []
+        self.tail: collections.deque[str] = collections.deque(maxlen=tail)
+        self._head_limit = head
+        self.lines = 0
+        self._log = open(log_path, "w", encoding="utf-8")
+
+    def add(self, line: str) -> None:
+        self._log.write(line + "\n")
+        self.lines += 1
+        if len(line) > _MAX_LINE_CHARS:
+            line = line[:_MAX_LINE_CHARS] + f"…（{len(line)}文字）"
+        if len(self.head) < self._head_limit:
+            self.head.append(line)
+        else:
+            self.tail.append(line)
+
+    @property
+    def truncated(self) -> bool:
+        return self.lines > len(self.head) + len(self.tail)
+
+    def close(self) -> None:
+        self._log.close()
+
+    def render(self) -> str:
+        if not self.truncated:
+            return "\n".join(self.head + list(self.tail))
+        omitted = self.lines - len(self.head) - len(self.tail)
+        marker = (
+            f"…（中略 {omitted} 行。全 {self.lines} 行の出力: {self.log_path} "
+            f"— read_file_lines / tail_file で参照できます）"
+        )
+        return "\n".join(self.head + [marker] + list(self.tail))
+
+
+def _new_log_path(run_id: int) -> str:
+    path = data_path("shell", f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{run_id}.log")
+    logs = sorted(os.listdir(os.path.dirname(path)))
+    for name in logs[:max(0, len(logs) - _KEEP_LOGS)]:
+        try:
+            os.remove(os.path.join(os.path.dirname(path), name))
+        except OSError:
+            pass
+    return path
+
+
+def _split_partial(buffer: bytes) -> tuple[list[bytes], bytes]:
+    """改行を待っている出力が _MAX_PARTIAL_BYTES を超えたら、その長さごとに切り出す（UTF-8 の文字の途中では切らない）"""
+    lines = []
+    while len(buffer) > _MAX_PARTIAL_BYTES:
+        cut = _MAX_PARTIAL_BYTES
+        while cut > _MAX_PARTIAL_BYTES - 4 and buffer[cut] & 0xC0 == 0x80:
+            cut -= 1
+        lines.append(buffer[:cut])
+        buffer = buffer[cut:]
+    return lines, buffer
+
+
+async def _kill_group(proc: asyncio.subprocess.Process) -> None:
+    """プロセスグループごと SIGTERM → 猶予後に SIGKILL する"""
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            return
+        try:
+            await asyncio.wait_for(proc.wait(), _KILL_GRACE)
+            return
+        except asyncio.TimeoutError:
+            continue
+
+
+class OutputStream:
+    """1回の実行の出力行を OutputWindow に溜めつつ、SSE へまとめて送る
+
+    start() → add() を繰り返す → finish() の順に使う（run と warm_runner で共用）
+    """
+
+    def __init__(self, command: str, cwd: str, emit=None):
+        self.run_id = next(_run_ids)
+        self.command = command
+        self.cwd = cwd
+        self.window = OutputWindow(_new_log_path(self.run_id))
+        self._emit = emit
+        self._pending: list[str] = []
+        self._flusher: asyncio.Task | None = None
+        self._start = time.monotonic()
+
+    async def start(self) -> None:
+        if self._emit is not None:
+            await self._emit({"type": "shell_start", "run_id": self.run_id, "command": self.command, "cwd": self.cwd})
+            self._flusher = asyncio.create_task(self._flush_loop())
+        self._start = time.monotonic()
+
+    def add(self, line: str) -> None:
+        self.window.add(line)
+        if self._emit is not None:
+            self._pending.append(line[:_MAX_LINE_CHARS])
+
+    async def flush(self, force: bool = False) -> None:
+        if self._pending and (force or len(self._pending) >= _MAX_BATCH_LINES):
+            batch, self._pending = self._pending, []
+            await self._emit({"type": "shell_output", "run_id": self.run_id, "lines": batch})
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(_FLUSH_INTERVAL)
+            await self.flush(force=True)
+
+    def discard(self) -> None:
+        """実行できなかった場合にログファイルを消す"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+        self.window.close()
+        os.remove(self.window.log_path)
+
+    async def finish(self, exit_code: int | None, timed_out: bool) -> dict:
+        """結果を返す
+
+        Returns:
+            {"run_id", "exit_code", "timed_out", "duration", "lines", "truncated", "output", "log_path"}
+            （log_path は出力を切り詰めた場合のみ。それ以外はログファイルを削除して None）
+        """
+        if self._flusher is not None:
+            self._flusher.cancel()
+        self.window.close()
+        if self._emit is not None:
+            await self.flush(force=True)
+        window = self.window
+        result = {
+            "run_id": self.run_id,
+            "exit_code": exit_code,
+            "timed_out": timed_out,
+            "duration": round(time.monotonic() - self._start, 3),
+            "lines": window.lines,
+            "truncated": window.truncated,
+            "output": window.render(),
+            "log_path": window.log_path if window.truncated else None,
+        }
+        if not window.truncated:
+            os.remove(window.log_path)
+        if self._emit is not None:
+            await self._emit({
+                "type": "shell_exit",
+                "run_id": self.run_id,
+                "exit_code": exit_code,
+                "timed_out": timed_out,
+                "duration": result["duration"],
+                "lines": result["lines"],
+            })
+        return result
+
+
+async def run(command: str, cwd: str, timeout: float = 60.0, emit=None) -> dict:
+    """コマンドを実行して結果（OutputStream.finish の辞書）を返す
+
+    Args:
+        emit: イベント辞書を受け取る async 関数（SSE への送信用。None なら送らない）
+    """
+    await LIMITER.acquire()
+    try:
+        LIMITER.started += 1
+        stream = OutputStream(command, cwd, emit)
+        await stream.start()
+        try:
+            proc = await asyncio.create_subprocess_shell(
+                command,
+                cwd=cwd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                start_new_session=True,   # 子孫プロセスごと終了できるよう新しいプロセスグループにする
+            )
+        except BaseException:
+            stream.discard()
+            raise
+
+        async def reader() -> None:
+            buffer = b""
+            while True:
+                chunk = await proc.stdout.read(_READ_CHUNK)
+                if not chunk:
+                    break
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                partial, buffer = _split_partial(buffer)
+                for raw in lines + partial:
+                    stream.add(raw.decode("utf-8", errors="replace").rstrip("\r"))
+                await stream.flush()
+            if buffer:
+                stream.add(buffer.decode("utf-8", errors="replace").rstrip("\r"))
+            await proc.wait()
+
+        timed_out = False
+        try:
+            await asyncio.wait_for(reader(), timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            LIMITER.timeouts += 1
+            await _kill_group(proc)
+        except asyncio.CancelledError:
+            await asyncio.shield(_kill_group(proc))
+            stream.discard()
+            raise
+        return await stream.finish(proc.returncode, timed_out)
+    finally:
+        LIMITER.release()
+
+
+def format_result(command: str, result: dict, timeout: float) -> str:
+    body = result["output"] if result["lines"] else "（出力なし）"
+    output = f"=== コマンド ===\n{command}\n\n=== 出力（stdout + stderr） ===\n{body}\n"
+    if result["timed_out"]:
+        output += f"\nエラー: コマンドがタイムアウトしました（{timeout:g}秒）。プロセスグループを終了しました"
+    else:
+        output += f"\n終了コード: {result['exit_code']}"
+    return output
@@ -27,3 +27,8 @@ class DevAgentState(TypedDict):
     needs_revision: bool    # 修正が必要かどうか
     revision_count: int     # 修正回数
     task_index: int         # 現在のタスクのインデックス
+    task_tier: str          # 現在タスクに選ばれたティア（tier_router が決定）
+    task_complexity: str    # 現在タスクの規模 "small" | "medium" | "large"
+    task_workspace: str     # 現在タスク用の worktree 内のワークスペースルート（worktree を使わない場合は ""）
+    task_originals: dict[str, str | None]  # 現在タスクで変更したファイルの開始時の内容（reviewer に差分を渡すため）
+    task_budget: dict[str, dict]  # 現在タスクの coder / reviewer の予算の使用量（task_status イベントで通知）
@@ -0,0 +1,439 @@
+"""センサーデータの永続化ストア（SQLite / WAL）
+
+save_record で受け取ったサンプルと IoT デバイスのステータスを
+ローカルの SQLite に追記し、再起動後も履歴を参照できるようにする。
+
+- 書き込みは専用スレッドがキューからまとめて取り出し、1トランザクションで書く
+  （イベントループ・ツール実行スレッドをブロックしない）
+- 生データは UTC 日単位のセグメントテーブル raw_YYYYMMDD に分割して保存する
+  （古いセグメントは drop_segments_before でテーブルごと削除できる）
+- 数値フィールドは書き込み時に 1分 / 1時間 のロールアップ
+  （count / sum / sumsq / min / max）へ集約する。生データが 1秒粒度の層にあたる
+- 終了した走行セッションは 1行の JSON サマリーとして sessions テーブルに保存する
+"""
+
+import json
+import math
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from agent.paths import data_path
+
+_DB_FILE = "sensors.db"
+
+_BATCH_MAX = 1000        # 1トランザクションで書き込む最大件数
+_FLUSH_TIMEOUT = 5.0     # 秒
+_MAX_TS = 253402300799.0  # 9999-12-31T23:59:59Z（datetime で扱える上限）
+_MS_THRESHOLD = 1e11      # これより大きい時刻はミリ秒の UNIX 時刻とみなす（秒なら西暦 5138 年）
+
+# ロールアップの解像度（テーブル名 → バケット幅秒）
+ROLLUPS = {
+    "1m": 60,
+    "1h": 3600,
+}
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS iot_status (
+        device_id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        updated REAL NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS sessions (
+        id INTEGER PRIMARY KEY,
+        device_id TEXT NOT NULL,
+        started TEXT NOT NULL,
+        summary TEXT NOT NULL
+    )""",
+] + [
+    f"""CREATE TABLE IF NOT EXISTS rollup_{name} (
+        sensor_type TEXT NOT NULL,
+        device_id TEXT NOT NULL,
+        field TEXT NOT NULL,
+        bucket REAL NOT NULL,
+        count INTEGER NOT NULL,
+        sum REAL NOT NULL,
+        sumsq REAL NOT NULL,
+        min REAL NOT NULL,
+        max REAL NOT NULL,
+        PRIMARY KEY (sensor_type, field, device_id, bucket)
+    ) WITHOUT ROWID"""
+    for name in ROLLUPS
+]
+
+
+def _segment_name(ts: float) -> str:
+    return "raw_" + datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y%m%d")
+
+
+def normalize_ts(ts) -> float | None:
+    """保存できる UNIX 秒に直す（ミリ秒の UNIX 時刻は秒に換算。範囲外・数値でなければ None）"""
+    try:
+        ts = float(ts)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if math.isfinite(ts) and ts > _MS_THRESHOLD:
+        ts /= 1000.0
+    if not math.isfinite(ts) or not 0.0 <= ts <= _MAX_TS:
+        return None
+    return ts
+
+
+def _segment_start(name: str) -> float:
+    return datetime.strptime(name[4:], "%Y%m%d").replace(tzinfo=timezone.utc).timestamp()
+
+
+def _numeric_fields(data: dict):
+    for field, value in data.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        if isinstance(value, float) and not math.isfinite(value):
+            continue
+        yield field, float(value)
+
+
+class SensorStore:
+    """日単位セグメント + ロールアップの追記専用ストア"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._queue: queue.Queue = queue.Queue()
+        self._segments_lock = threading.Lock()
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in _SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+        rows = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'raw_%'"
+        ).fetchall()
+        self._segments: set[str] = {name for (name,) in rows}
+        self._new_segments: set[str] = set()  # 書き込み中のトランザクションで作成したセグメント
+
+        self.written = 0
+        self.batches = 0
+        self._writer = threading.Thread(target=self._run_writer, name="sensor-store-writer", daemon=True)
+        self._writer.start()
+
+    # ---- 接続 ----
+
+    def _connection(self) -> sqlite3.Connection:
+        """スレッドごとの接続を返す（WAL なので読み取りは書き込みと並行できる）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---- 書き込み（キュー経由） ----
+
+    def append(self, sensor_type: str, data: dict, timestamp: float | None = None) -> None:
+        """サンプルを書き込みキューに積む（即座に戻る）
+
+        保存できない時刻（範囲外・非数）のサンプルは現在時刻で保存する。ミリ秒の UNIX 時刻は秒に換算する。
+        """
+        ts = time.time()
+        if timestamp is not None:
+            normalized = normalize_ts(timestamp)
+            if normalized is None:
+                print(f"[store] 範囲外の時刻のため現在時刻で保存します: {timestamp!r}")
+            else:
+                ts = normalized
+        self._queue.put(("sample", sensor_type, dict(data), ts))
+
+    def put_status(self, device_id: str, status: dict) -> None:
+        """デバイスステータスを書き込みキューに積む"""
+        self._queue.put(("status", device_id, dict(status), time.time()))
+
+    def put_session(self, summary: dict) -> None:
+        """終了した走行セッションのサマリーを書き込みキューに積む"""
+        self._queue.put(("session", summary))
+
+    def flush(self, timeout: float = _FLUSH_TIMEOUT) -> bool:
+        """キューに積まれた書き込みがコミットされるまで待つ"""
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        return done.wait(timeout)
+
+    def close(self) -> None:
+        """未書き込みのデータを書き切ってから書き込みスレッドを止める"""
+        self._queue.put(None)
+        self._writer.join(timeout=_FLUSH_TIMEOUT)
+
+    def _run_writer(self) -> None:
+        conn = self._connection()
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while len(batch) < _BATCH_MAX:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            events = []
+            items = []
+            for item in batch:
+                if item is None:
+                    stop = True
+                elif item[0] == "flush":
+                    events.append(item[1])
+                else:
+                    items.append(item)
+            try:
+                if items:
+                    self._write_batch(conn, items)
+            except Exception as e:   # 書き込みスレッドは止めない（止まると以降の永続化と flush がすべて止まる）
+                print(f"[store] 書き込みエラー: {e}")
+            finally:
+                self._new_segments.clear()
+                for event in events:
+                    event.set()
+        conn.close()
+
+    def _write_batch(self, conn: sqlite3.Connection, items: list) -> None:
+        """items を1トランザクションで書く。書けないレコードはそのレコードだけを取り消して残りを書く"""
+        written = 0
+        with conn:
+            conn.execute("BEGIN")
+            for item in items:
+                created = set(self._new_segments)
+                conn.execute("SAVEPOINT record")
+                try:
+                    if item[0] == "sample":
+                        self._write_sample(conn, *item[1:])
+                    elif item[0] == "session":
+                        self._write_session(conn, *item[1:])
+                    else:
+                        self._write_status(conn, *item[1:])
+                except Exception as e:
+                    conn.execute("ROLLBACK TO record")
+                    self._new_segments = created   # 取り消したレコードで作ったセグメントは存在しない
+                    print(f"[store] レコードを書き込めませんでした（{item[0]}）: {e}")
+                else:
+                    written += 1
+                conn.execute("RELEASE record")
+        with self._segments_lock:
+            self._segments |= self._new_segments
+        self.written += written
+        self.batches += 1
+
+    def _ensure_segment(self, conn: sqlite3.Connection, name: str) -> None:
+        if name in self._segments or name in self._new_segments:
+            return
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} ("
+            "sensor_type TEXT NOT NULL, device_id TEXT NOT NULL, ts REAL NOT NULL, data TEXT NOT NULL)"
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_idx ON {name} (sensor_type, device_id, ts)")
+        # 読み取り側に見せるのはコミット後（_run_writer で反映）
+        self._new_segments.add(name)
+
+    def _write_sample(self, conn: sqlite3.Connection, sensor_type: str, data: dict, ts: float) -> None:
+        device_id = str(data.get("device_id", ""))
+        segment = _segment_name(ts)
+        self._ensure_segment(conn, segment)
+        conn.execute(
+            f"INSERT INTO {segment} (sensor_type, device_id, ts, data) VALUES (?, ?, ?, ?)",
+            (sensor_type, device_id, ts, json.dumps(data, ensure_ascii=False, separators=(",", ":"))),
+        )
+        for field, value in _numeric_fields(data):
+            for name, width in ROLLUPS.items():
+                conn.execute(
+                    f"INSERT INTO rollup_{name} "
+                    "(sensor_type, device_id, field, bucket, count, sum, sumsq, min, max) "
+                    "VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?) "
+                    "ON CONFLICT (sensor_type, field, device_id, bucket) DO UPDATE SET "
+                    "count = count + 1, sum = sum + excluded.sum, sumsq = sumsq + excluded.sumsq, "
+                    "min = min(min, excluded.min), max = max(max, excluded.max)",
+                    (sensor_type, device_id, field, ts - ts % width, value, value * value, value, value),
+                )
+
+    def _write_status(self, conn: sqlite3.Connection, device_id: str, status: dict, updated: float) -> None:
+        conn.execute(
+            "INSERT INTO iot_status (device_id, status, updated) VALUES (?, ?, ?) "
+            "ON CONFLICT (device_id) DO UPDATE SET status = excluded.status, updated = excluded.updated",
+            (device_id, json.dumps(status, ensure_ascii=False), updated),
+        )
+
+    def _write_session(self, conn: sqlite3.Connection, summary: dict) -> None:
+        conn.execute(
+            "INSERT INTO sessions (device_id, started, summary) VALUES (?, ?, ?)",
+            (summary["device_id"], summary["started"], json.dumps(summary, ensure_ascii=False, separators=(",", ":"))),
+        )
+
+    # ---- 読み出し ----
+
+    def _segments_between(self, since: float | None, until: float | None, newest_first: bool = False) -> list[str]:
+        with self._segments_lock:
+            names = sorted(self._segments, reverse=newest_first)
+        result = []
+        for name in names:
+            start = _segment_start(name)
+            if until is not None and start > until:
+                continue
+            if since is not None and start + 86400 <= since:
+                continue
+            result.append(name)
+        return result
+
+    @staticmethod
+    def _filters(sensor_type: str, device_id: str | None, since: float | None, until: float | None):
+        clauses = ["sensor_type = ?"]
+        params: list = [sensor_type]
+        if device_id is not None:
+            clauses.append("device_id = ?")
+            params.append(device_id)
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts <= ?")
+            params.append(until)
+        return " AND ".join(clauses), params
+
+    def latest(self, sensor_type: str, n: int, device_id: str | None = None) -> list[dict]:
+        """直近 n 件の生データを古い順に返す"""
+        conn = self._connection()
+        where, params = self._filters(sensor_type, device_id, None, None)
+        rows: list[tuple[float, str]] = []
+        for segment in self._segments_between(None, None, newest_first=True):
+            if len(rows) >= n:
+                break
+            rows += conn.execute(
+                f"SELECT ts, data FROM {segment} WHERE {where} ORDER BY ts DESC LIMIT ?",
+                params + [n - len(rows)],
+            ).fetchall()
+        rows.sort(key=lambda row: row[0])
+        return [json.loads(data) for _, data in rows]
+
+    def range(
+        self,
+        sensor_type: str,
+        since: float | None = None,
+        until: float | None = None,
+        device_id: str | None = None,
+        limit: int | None = None,
+        newest: bool = False,
+    ) -> list[tuple[float, dict]]:
+        """時刻範囲 [since, until] の生データを (UNIX秒, レコード) の古い順リストで返す
+
+        limit を指定すると先頭から limit 件（newest=True なら範囲内の直近 limit 件）だけを読む。
+        """
+        conn = self._connection()
+        where, params = self._filters(sensor_type, device_id, since, until)
+        order = "DESC" if newest else ""
+        rows: list[tuple[float, str]] = []
+        for segment in self._segments_between(since, until, newest_first=newest):
+            sql = f"SELECT ts, data FROM {segment} WHERE {where} ORDER BY ts {order}"
+            if limit is not None:
+                sql += f" LIMIT {max(0, int(limit - len(rows)))}"
+            rows += conn.execute(sql, params).fetchall()
+            if limit is not None and len(rows) >= limit:
+                break
+        if newest:
+            rows.reverse()
+        return [(ts, json.loads(data)) for ts, data in rows]
+
+    def rollups(
+        self,
+        sensor_type: str,
+        field: str,
+        resolution: str = "1m",
+        since: float | None = None,
+        until: float | None = None,
+        device_id: str | None = None,
+    ) -> list[dict]:
+        """ロールアップを時刻順に返す（device_id 省略時は全デバイスを合算）
+
+        Returns:
+            [{"bucket": UNIX秒, "count", "sum", "sumsq", "min", "max"}, ...]
+        """
+        if resolution not in ROLLUPS:
+            raise ValueError(f"unknown resolution: {resolution}")
+        clauses = ["sensor_type = ?", "field = ?"]
+        params: list = [sensor_type, field]
+        if device_id is not None:
+            clauses.append("device_id = ?")
+            params.append(device_id)
+        if since is not None:
+            clauses.append("bucket >= ?")
+            params.append(since - since % ROLLUPS[resolution])
+        if until is not None:
+            clauses.append("bucket <= ?")
+            params.append(until)
+        rows = self._connection().execute(
+            f"SELECT bucket, SUM(count), SUM(sum), SUM(sumsq), MIN(min), MAX(max) FROM rollup_{resolution} "
+            f"WHERE {' AND '.join(clauses)} GROUP BY bucket ORDER BY bucket",
+            params,
+        ).fetchall()
+        return [
+            {"bucket": b, "count": c, "sum": s, "sumsq": sq, "min": mn, "max": mx}
+            for b, c, s, sq, mn, mx in rows
+        ]
+
+    def fields(self, sensor_type: str) -> list[str]:
+        """ロールアップが存在する数値フィールドの一覧を返す"""
+        rows = self._connection().execute(
+            "SELECT DISTINCT field FROM rollup_1h WHERE sensor_type = ?", (sensor_type,)
+        ).fetchall()
+        return [field for (field,) in rows]
+
+    def sessions(self, limit: int = 20, device_id: str | None = None) -> list[dict]:
+        """保存済みの走行セッションのサマリーを新しい順に返す"""
+        where, params = ("WHERE device_id = ?", [device_id]) if device_id is not None else ("", [])
+        rows = self._connection().execute(
+            f"SELECT summary FROM sessions {where} ORDER BY id DESC LIMIT ?", params + [limit]
+        ).fetchall()
+        return [json.loads(summary) for (summary,) in rows]
+
+    def load_status(self) -> dict[str, dict]:
+        """保存済みのデバイスステータスを返す"""
+        rows = self._connection().execute("SELECT device_id, status FROM iot_status").fetchall()
+        return {device_id: json.loads(status) for device_id, status in rows}
+
+    def drop_segments_before(self, ts: float) -> list[str]:
+        """ts より前に終わる生データセグメントを削除する（ロールアップは残す）"""
+        self.flush()
+        conn = self._connection()
+        dropped = []
+        with self._segments_lock:
+            names = sorted(self._segments)
+        for name in names:
+            if _segment_start(name) + 86400 <= ts:
+                conn.execute(f"DROP TABLE IF EXISTS {name}")
+                dropped.append(name)
+        conn.commit()
+        with self._segments_lock:
+            self._segments.difference_update(dropped)
+        return dropped
+
+
+_store: SensorStore | None = None
+
+
+def open_store(path: str | None = None) -> SensorStore:
+    """永続化ストアを開く（サーバー起動時に呼び出す）"""
+    global _store
+    if _store is None:
+        _store = SensorStore(path or data_path(_DB_FILE))
+        print(f"[store] センサーストアを開きました: {_store.path}")
+    return _store
+
+
+def get_store() -> SensorStore | None:
+    """開いている永続化ストアを返す（未オープンなら None）"""
+    return _store
+
+
+def close_store() -> None:
+    """永続化ストアを閉じる（サーバー終了時に呼び出す）"""
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
@@ -0,0 +1,180 @@
+"""タスク単位のモデルティア選択
+
+planner が特定した read_files / write_files の数とファイルサイズから
+タスクの規模を見積もり、過去のレビュー結果（ティア・規模ごとの
+一発PASS率と修正回数）を踏まえてタスクごとにティアを選ぶ。
+
+- 小規模なタスク → haiku
+- 中規模なタスク → 走行状態で決まったティア（trigger_check の model_tier）
+- 大規模なタスク → opus
+
+履歴上、選んだティアの一発PASS率が低ければ1段階上げ、
+1段階下のティアでも十分に一発PASSしていれば1段階下げる。
+上げた（下げなかった）ままだと規模の本来のティア・1段階下のティアに新しい結果が入らず判定が
+固定されるので、_EXPLORE_RATE の確率でそれらのティアを試して履歴を更新し続ける。
+
+履歴の読み書きはファイル I/O を伴うので、非同期のノードからはスレッドプールで呼ぶ。
+"""
+
+import json
+import os
+import random
+import threading
+
+from agent.paths import data_path
+
+_TIER_ORDER = ["haiku", "sonnet", "opus"]
+
+# 規模の判定閾値
+_SMALL_MAX_WRITE_FILES = 1
+_SMALL_MAX_BYTES = 4 * 1024
+_LARGE_MIN_WRITE_FILES = 4
+_LARGE_MIN_BYTES = 64 * 1024
+
+# 履歴に基づく補正の閾値
+_MIN_SAMPLES = 3
+_ESCALATE_BELOW = 0.6   # 一発PASS率がこれ未満なら1段階上げる
+_DOWNGRADE_ABOVE = 0.85  # 1段階下のティアの一発PASS率がこれ以上なら下げる
+_EXPLORE_RATE = 0.1      # 履歴で決まったティアの代わりに、結果が入らなくなるティアを試す確率
+
+_HISTORY_FILE = "tier_history.json"
+_lock = threading.Lock()
+_rng = random.Random()
+
+
+def _history_path() -> str:
+    return data_path(_HISTORY_FILE)
+
+
+def _load_history() -> dict:
+    path = _history_path()
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"[tier_router] 履歴の読み込みに失敗しました: {e}")
+        return {}
+
+
+def estimate_complexity(workspace_root: str, read_files: list[str], write_files: list[str]) -> dict:
+    """planner の見積もりからタスク規模を推定する。
+
+    Args:
+        workspace_root: ワークスペースルート
+        read_files: タスクで読むファイル一覧
+        write_files: タスクで編集・作成するファイル一覧
+
+    Returns:
+        {"bucket": "small" | "medium" | "large", "write_files": int, "read_files": int, "bytes": int}
+    """
+    total_bytes = 0
+    for path in set(read_files) | set(write_files):
+        full_path = path if os.path.isabs(path) else os.path.join(workspace_root, path)
+        try:
+            total_bytes += os.path.getsize(full_path)
+        except OSError:
+            pass  # 新規作成ファイル
+
+    n_write = len(write_files)
+    if n_write >= _LARGE_MIN_WRITE_FILES or total_bytes >= _LARGE_MIN_BYTES:
+        bucket = "large"
+    elif n_write <= _SMALL_MAX_WRITE_FILES and total_bytes <= _SMALL_MAX_BYTES:
+        bucket = "small"
+    else:
+        bucket = "medium"
+
+    return {
+        "bucket": bucket,
+        "write_files": n_write,
+        "read_files": len(read_files),
+        "bytes": total_bytes,
+    }
+
+
+def _first_pass_rate(history: dict, bucket: str, tier: str) -> float | None:
+    stats = history.get(bucket, {}).get(tier)
+    if not stats or stats.get("tasks", 0) < _MIN_SAMPLES:
+        return None
+    return stats["first_pass"] / stats["tasks"]
+
+
+def _step(tier: str, delta: int) -> str:
+    idx = _TIER_ORDER.index(tier) + delta
+    return _TIER_ORDER[max(0, min(len(_TIER_ORDER) - 1, idx))]
+
+
+def select_tier(bucket: str, default_tier: str) -> str:
+    """タスク規模と履歴からティアを選ぶ。
+
+    Args:
+        bucket: estimate_complexity が返した規模
+        default_tier: 中規模タスクに使うティア（走行状態で決まったティア）
+
+    Returns:
+        使用するティア名
+    """
+    if bucket == "small":
+        tier = "haiku"
+    elif bucket == "large":
+        tier = "opus"
+    else:
+        tier = default_tier
+
+    # 旧世代ティア（sonnet-3 など）は履歴補正の対象外
+    if tier not in _TIER_ORDER:
+        return tier
+
+    with _lock:
+        history = _load_history()
+
+    rate = _first_pass_rate(history, bucket, tier)
+    if rate is not None and rate < _ESCALATE_BELOW and tier != _TIER_ORDER[-1]:
+        if _rng.random() < _EXPLORE_RATE:
+            print(f"[tier_router] {bucket}: 履歴の更新のため {tier} を試します")
+            return tier
+        return _step(tier, 1)
+
+    lower = _step(tier, -1)
+    if lower == tier:
+        return tier
+    lower_rate = _first_pass_rate(history, bucket, lower)
+    if lower_rate is not None and lower_rate >= _DOWNGRADE_ABOVE:
+        return lower
+    if _rng.random() < _EXPLORE_RATE:
+        print(f"[tier_router] {bucket}: 履歴の更新のため {lower} を試します")
+        return lower
+    return tier
+
+
+def record_outcome(bucket: str, tier: str, passed: bool, revision_count: int) -> None:
+    """タスクの最終レビュー結果を履歴に記録する。
+
+    Args:
+        bucket: タスク規模
+        tier: coder に使ったティア
+        passed: 最終判定が PASS かどうか
+        revision_count: 修正回数
+    """
+    with _lock:
+        history = _load_history()
+        stats = history.setdefault(bucket, {}).setdefault(
+            tier, {"tasks": 0, "passed": 0, "first_pass": 0, "revisions": 0}
+        )
+        stats["tasks"] += 1
+        stats["passed"] += int(passed)
+        stats["first_pass"] += int(passed and revision_count == 0)
+        stats["revisions"] += revision_count
+
+        path = _history_path()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(history, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+
+def get_stats() -> dict:
+    """規模・ティアごとの履歴を返す"""
+    with _lock:
+        return _load_history()
@@ -1,8 +1,22 @@
 from langchain_core.tools import tool
+import asyncio
 import os
-
-# センサー種別ごとのインメモリ履歴
-_history: dict[str, list[dict]] = {}
+import re
+import shlex
+from contextvars import ContextVar, Token
+
+from agent import store as sensor_store
+from agent.anomaly import ENGINE as anomaly_engine
+from agent import (
+    code_search, file_index, impact, patching, result_cache, review_diff, shell, warm_runner,
+)
+from agent.file_cache import CACHE as file_cache
+from agent.aggregate import aggregate_history, parse_duration, parse_time
+from agent.history import SensorHistory, parse_timestamp
+from api.events import broadcast
+
+# センサー種別 × デバイスIDごとのインメモリ履歴（固定容量のリングバッファ）
+_history = SensorHistory()
 
 # センサー種別ごとの異常検知閾値
 _ANOMALY_THRESHOLDS: dict[str, dict[str, tuple[float, float]]] = {
@@ -16,28 +30,78 @@ _ANOMALY_THRESHOLDS: dict[str, dict[str, tuple[float, float]]] = {
     },
 }
 
-# ファイル操作ツールが参照するワークスペースルート
-_workspace_root: str = ""
+# 実行（run_agent / run_dev_agent）ごとの状態。contextvars で asyncio のタスクごとに引き継ぐため、
+# 同じプロセスで複数の実行を並行させてもファイル操作の基準ディレクトリなどが混ざらない
+_workspace_root_var: ContextVar[str] = ContextVar("workspace_root", default="")   # ファイル操作ツールの基準ディレクトリ
+_run_device_var: ContextVar[str] = ContextVar("run_device", default="")           # 実行のきっかけになったデバイスID
+# タスク中に書き換えたファイルの元の内容（相対パス → 内容。新規作成なら None）。reviewer に差分を渡すために使う
+_changes_var: ContextVar[dict[str, str | None] | None] = ContextVar("task_changes", default=None)
 
-# 走行中フラグ（notify_start/stop から更新、dev_graph から参照）
-_is_running: bool = False
+# 走行中フラグ（デバイスID -> 走行中か。notify_start/stop から更新、dev_graph から参照）
+_running: dict[str, bool] = {}
 
 # IoTデバイスのステータス（デバイスID -> ステータス情報の辞書）
 _iot_status: dict[str, dict] = {}
 
 
-def set_workspace_root(path: str) -> None:
-    global _workspace_root
-    _workspace_root = path
+def set_history_capacity(capacity: int) -> None:
+    """センサー履歴のリングバッファ容量（センサー種別 × デバイスごとの保持件数）を設定する"""
+    _history.set_capacity(capacity)
+
+
+def set_workspace_root(path: str) -> Token:
+    """現在の実行（コンテキスト）のワークスペースルートを設定する。戻り値は reset_workspace_root に渡す"""
+    return _workspace_root_var.set(path)
+
+
+def reset_workspace_root(token: Token) -> None:
+    _workspace_root_var.reset(token)
+
+
+def get_workspace_root() -> str:
+    return _workspace_root_var.get()
+
+
+def set_run_device(device_id: str) -> Token:
+    """現在の実行（コンテキスト）を起動したデバイスIDを設定する"""
+    return _run_device_var.set(device_id)
+
+
+def reset_run_device(token: Token) -> None:
+    _run_device_var.reset(token)
 
 
-def set_is_running(value: bool) -> None:
-    global _is_running
-    _is_running = value
+def get_run_device() -> str:
+    return _run_device_var.get()
 
 
-def get_is_running() -> bool:
-    return _is_running
+def track_changes(originals: dict[str, str | None]) -> Token:
+    """以降の write_file / apply_patch で初めて書き換えるファイルの元の内容を originals に記録する"""
+    return _changes_var.set(originals)
+
+
+def _record_original(full_path: str) -> None:
+    originals = _changes_var.get()
+    root = _workspace_root_var.get()
+    if originals is None or not root:
+        return
+    rel = os.path.relpath(os.path.realpath(full_path), os.path.realpath(root)).replace(os.sep, "/")
+    if rel.startswith("../") or rel in originals:
+        return
+    originals[rel] = review_diff.read_original(full_path)
+
+
+def set_is_running(value: bool, device_id: str | None = None) -> None:
+    """デバイスの走行中フラグを設定する（device_id を省略すると現在の実行のデバイス）"""
+    _running[device_id or _run_device_var.get()] = value
+
+
+def get_is_running(device_id: str | None = None) -> bool:
+    """デバイスが走行中か（device_id を省略すると現在の実行のデバイス。実行にデバイスがなければいずれかのデバイス）"""
+    device_id = device_id or _run_device_var.get()
+    if device_id:
+        return _running.get(device_id, False)
+    return any(_running.values())
 
 
 def set_iot_status(device_id: str, status: dict) -> None:
@@ -49,6 +113,23 @@ def set_iot_status(device_id: str, status: dict) -> None:
     """
     global _iot_status
     _iot_status[device_id] = status
+    store = sensor_store.get_store()
+    if store is not None:
+        store.put_status(device_id, status)
+
+
+def restore_iot_status() -> int:
+    """永続化ストアから前回起動時の IoT デバイスステータスを復元する。
+
+    Returns:
+        復元したデバイス数
+    """
+    store = sensor_store.get_store()
+    if store is None:
+        return 0
+    restored = store.load_status()
+    _iot_status.update(restored)
+    return len(restored)
 
 
 def get_iot_status(device_id: str | None = None) -> dict | None:
@@ -68,11 +149,23 @@ def get_iot_status(device_id: str | None = None) -> dict | None:
 
 def _resolve(path: str) -> str:
     """相対パスをワークスペースルートからの絶対パスに変換する"""
-    if os.path.isabs(path):
+    root = _workspace_root_var.get()
+    if os.path.isabs(path) or not root:
         return path
-    if not _workspace_root:
-        return path
-    return os.path.join(_workspace_root, path)
+    return os.path.join(root, path)
+
+
+def _invalidate(full_path: str) -> None:
+    """ファイルの変更をキャッシュ・索引に知らせる"""
+    file_cache.invalidate(full_path)
+    file_index.invalidate(full_path)   # code_search / retrieval / repo_map / impact も次の問い合わせで確認する
+    result_cache.invalidate(full_path)
+
+
+def invalidate_paths(paths: list[str]) -> None:
+    """ツール以外で変更したファイル（絶対パス）をキャッシュ・索引に知らせる"""
+    for path in paths:
+        _invalidate(path)
 
 
 @tool
@@ -83,27 +176,71 @@ def save_record(sensor_type: str, data: dict) -> str:
         sensor_type: センサー種別（例: heart_rate, motion, unknown）
         data: 保存するセンサーデータ
     """
-    if sensor_type not in _history:
-        _history[sensor_type] = []
-    _history[sensor_type].append(data)
-    return f"{sensor_type} のデータを保存しました（累計: {len(_history[sensor_type])} 件）"
+    _history.append(sensor_type, data)
+    store = sensor_store.get_store()
+    if store is not None:
+        store.append(sensor_type, data, parse_timestamp(data.get("timestamp")))
+    return f"{sensor_type} のデータを保存しました（累計: {_history.total(sensor_type)} 件）"
 
 
 @tool
-def get_history(sensor_type: str, n: int = 5) -> list[dict]:
-    """指定センサーの直近n件の履歴データを取得する。
+def get_history(
+    sensor_type: str,
+    n: int = 5,
+    since: str | None = None,
+    until: str | None = None,
+    device_id: str | None = None,
+    aggregate: bool = False,
+    field: str | None = None,
+    bucket: str | None = None,
+) -> list[dict] | dict | str:
+    """指定センサーの履歴データを取得する。時刻範囲の絞り込みと集計ができる。
+
+    長い期間を調べるときは aggregate=True で集計サマリー（count/mean/min/max/p50/p95）を取得すること。
 
     Args:
         sensor_type: センサー種別（例: heart_rate, motion, unknown）
-        n: 取得件数（デフォルト: 5）
+        n: 取得件数（デフォルト: 5）。範囲指定時は範囲内の直近n件
+        since: 開始時刻（ISO 8601 または "-15m" / "-2h" / "-1d" のような相対指定）
+        until: 終了時刻（同上。省略時は現在まで）
+        device_id: デバイスID（省略時は全デバイス）
+        aggregate: True なら生データの代わりに集計サマリーを返す
+        field: 集計するフィールド（例: bpm。省略時は全数値フィールド）
+        bucket: 集計の時間バケット幅（例: 10s, 1m, 1h。省略時は範囲全体のみ）
     """
-    records = _history.get(sensor_type, [])
-    return records[-n:]
+    try:
+        since_ts = parse_time(since)
+        until_ts = parse_time(until)
+        bucket_sec = parse_duration(bucket) if bucket else None
+    except ValueError as e:
+        return f"エラー: {e}"
+    store = sensor_store.get_store()
+
+    if aggregate:
+        return aggregate_history(_history, store, sensor_type, field, since_ts, until_ts, device_id, bucket_sec)
+
+    if since_ts is None and until_ts is None:
+        records = _history.latest(sensor_type, n, device_id)
+        if len(records) < n and store is not None:
+            # 再起動直後などメモリ上の履歴が足りない場合は永続化ストアから読む
+            store.flush()
+            records = store.latest(sensor_type, n, device_id)
+        return records
+
+    records = _history.range(sensor_type, since_ts, until_ts, device_id)
+    oldest = _history.oldest(sensor_type, device_id)
+    if len(records) < n and store is not None and (oldest is None or since_ts is None or since_ts < oldest):
+        # 範囲の先頭がメモリ上の履歴より古い場合は永続化ストアから読む
+        store.flush()
+        records = [
+            record for _, record in store.range(sensor_type, since_ts, until_ts, device_id, limit=max(n, 0), newest=True)
+        ]
+    return records[-n:] if n > 0 else []
 
 
 @tool
 def detect_anomaly(sensor_type: str, data: dict) -> str:
-    """センサーデータの異常を閾値ベースで検知する。
+    """センサーデータの異常を閾値と直近の統計（ローリング z スコア）で検知する。
 
     Args:
         sensor_type: センサー種別（例: heart_rate, motion）
@@ -117,6 +254,10 @@ def detect_anomaly(sensor_type: str, data: dict) -> str:
         if value is not None and not (low <= float(value) <= high):
             anomalies.append(f"{key}={value} が正常範囲({low}〜{high})を外れています")
 
+    # 受信時に更新しているストリーミング検知器の窓と比較する
+    for key, value, z in anomaly_engine.outliers(data):
+        anomalies.append(f"{key}={value} が直近の傾向から外れています(z={z:.1f})")
+
     if anomalies:
         return "⚠️ 異常検知: " + ", ".join(anomalies)
     return "✅ 正常範囲内です"
@@ -135,8 +276,7 @@ def read_file(path: str) -> str:
     full_path = _resolve(path)
     if not os.path.exists(full_path):
         return f"エラー: ファイルが見つかりません: {path}"
-    with open(full_path, encoding="utf-8") as f:
-        return f.read()
+    return file_cache.read_text(full_path)
 
 
 @tool
@@ -151,14 +291,29 @@ def read_file_lines(path: str, start_line: int, end_line: int) -> str:
     full_path = _resolve(path)
     if not os.path.exists(full_path):
         return f"エラー: ファイルが見つかりません: {path}"
-    with open(full_path, encoding="utf-8") as f:
-        lines = f.readlines()
-    total = len(lines)
     s = max(0, start_line - 1)
+    text, total = file_cache.read_lines(full_path, s, end_line)
     e = min(total, end_line)
-    selected = lines[s:e]
     header = f"[{path} 行 {s+1}〜{e} / 全{total}行]\n"
-    return header + "".join(selected)
+    return header + text
+
+
+@tool
+def tail_file(path: str, lines: int = 50) -> str:
+    """ワークスペース内のファイルの末尾n行を読み込む（ログ確認用。先頭は read_file_lines を使う）。
+
+    Args:
+        path: ワークスペースルートからの相対パス（例: IotDevice/logs/device-monitor.log）
+        lines: 読み込む行数（デフォルト: 50）
+    """
+    full_path = _resolve(path)
+    if not os.path.exists(full_path):
+        return f"エラー: ファイルが見つかりません: {path}"
+    total = file_cache.line_count(full_path)
+    s = max(0, total - max(0, lines))
+    text, total = file_cache.read_lines(full_path, s, total)
+    header = f"[{path} 行 {s+1}〜{total} / 全{total}行]\n"
+    return header + text
 
 
 @tool
@@ -170,48 +325,149 @@ def write_file(path: str, content: str) -> str:
         content: 書き込む内容
     """
     full_path = _resolve(path)
-    os.makedirs(os.path.dirname(full_path), exist_ok=True) if os.path.dirname(full_path) else None
-    with open(full_path, "w", encoding="utf-8") as f:
-        f.write(content)
+    _record_original(full_path)
+    patching.write_atomic(full_path, content)
+    _invalidate(full_path)
     return f"✅ ファイルを書き込みました: {path}"
 
 
 @tool
-def list_files(directory: str = ".") -> str:
-    """ワークスペース内のディレクトリのファイル一覧を取得する。
+def apply_patch(path: str, patch: str) -> str:
+    """既存ファイルの変更箇所だけを差分で書き換える（1行の修正でもファイル全体を write_file し直さないこと）。
+
+    patch は次のどちらかの形式で渡す（複数のハンク・ブロックを続けて書ける）:
+
+    1. unified diff（@@ 見出しの行番号は目安。前後の行（コンテキスト）で位置を照合する）
+       @@ -12,3 +12,3 @@
+        def handler(event):
+       -    return None
+       +    return process(event)
+
+    2. SEARCH/REPLACE ブロック（SEARCH の内容はファイル内で一意に一致する必要がある）
+       <<<<<<< SEARCH
+           return None
+       =======
+           return process(event)
+       >>>>>>> REPLACE
+
+    全ハンクが現在の内容と一致した場合のみ書き込む（一致しなければファイルは変更しない）。
+
+    Args:
+        path: ワークスペースルートからの相対パス（例: src/main.py）
+        patch: unified diff または SEARCH/REPLACE ブロック
+    """
+    full_path = _resolve(path)
+    try:
+        old, newline = patching.read_text(full_path)
+        new, count = patching.apply(old, patch)
+    except (OSError, UnicodeDecodeError, ValueError) as e:
+        return f"エラー: 差分を適用できません（{path}）: {e}"
+    if new == old:
+        return f"変更はありません: {path}"
+    _record_original(full_path)
+    patching.write_atomic(full_path, new, newline)
+    _invalidate(full_path)
+    return f"✅ 差分を適用しました（{count} ハンク）: " + patching.summarize(path, old, new)
+
+
+@tool
+def list_files(
+    directory: str = ".",
+    pattern: str | None = None,
+    extensions: list[str] | None = None,
+    max_depth: int | None = None,
+    offset: int = 0,
+    limit: int = 200,
+) -> str:
+    """ワークスペース内のディレクトリのファイル一覧を取得する（.gitignore で除外されたファイルは含まない）。
 
     Args:
         directory: ワークスペースルートからの相対パス（デフォルト: ワークスペースルート）
+        pattern: glob パターン（例: "*.py", "src/**/test_*.ts"。/ を含まない場合はファイル名に一致）
+        extensions: 拡張子で絞り込む（例: [".py", ".ts"]）
+        max_depth: 何階層下まで列挙するか（0 = 直下のみ）。それより深いものは "dir/ (N files)" にまとめる
+        offset: 何件目から返すか（ページング用）
+        limit: 最大件数（デフォルト: 200）
     """
     full_path = _resolve(directory)
-    if not os.path.exists(full_path):
+    if not os.path.isdir(full_path):
         return f"エラー: ディレクトリが見つかりません: {directory}"
-    entries = []
-    for root, dirs, files in os.walk(full_path):
-        # 隠しディレクトリ・__pycache__ をスキップ
-        dirs[:] = [d for d in dirs if not d.startswith(".") and d != "__pycache__"]
-        rel_root = os.path.relpath(root, full_path)
-        for file in files:
-            if not file.startswith("."):
-                entry = file if rel_root == "." else f"{rel_root}/{file}"
-                entries.append(entry)
-    return "\n".join(entries) if entries else "（ファイルなし）"
+    root = _workspace_root_var.get()
+    root = os.path.realpath(root) if root else ""
+    real = os.path.realpath(full_path)
+    index, rel = None, ""
+    if root and (real == root or real.startswith(root + os.sep)):
+        index = file_index.get_index(root)
+        rel = os.path.relpath(real, root)
+        if not index.has_dir(rel):
+            index = None  # .gitignore で除外されたディレクトリを明示的に指定した場合
+    if index is None:
+        index, rel = file_index.get_index(real), ""
+
+    entries = index.query(rel, pattern, extensions, max_depth)
+    if not entries:
+        return "（ファイルなし）"
+    page = entries[offset:offset + limit]
+    result = "\n".join(page)
+    if offset + len(page) < len(entries) or offset:
+        result += f"\n[全{len(entries)}件中 {offset + 1}〜{offset + len(page)}件"
+        if offset + len(page) < len(entries):
+            result += f"。続きは offset={offset + len(page)}"
+        result += "]"
+    return result
+
+
+@tool
+def search_code(
+    query: str,
+    regex: bool = False,
+    ignore_case: bool = False,
+    path_pattern: str | None = None,
+    context: int = 1,
+    max_results: int = 30,
+) -> str:
+    """ワークスペース内のコードを検索し、一致した行を path:line 形式で返す（ファイル全体を読む前に使う）。
+
+    Args:
+        query: 検索語（regex=True の場合は Python の正規表現）
+        regex: query を正規表現として扱う
+        ignore_case: 大文字・小文字を区別しない
+        path_pattern: 対象ファイルの glob パターン（例: "*.py", "ai-agent/**/*.py"）
+        context: 一致行の前後に表示する行数（デフォルト: 1）
+        max_results: 最大件数（デフォルト: 30）
+    """
+    root = _workspace_root_var.get()
+    if not root:
+        return "エラー: ワークスペースが設定されていません"
+    try:
+        result = code_search.get_index(root).search(
+            query, regex, ignore_case, path_pattern, max(0, context), max(1, max_results),
+        )
+    except re.error as e:
+        return f"エラー: 正規表現が不正です: {e}"
+    return code_search.format_hits(result)
 
 
 @tool
-def run_shell(command: str, cwd: str = ".") -> str:
+async def run_shell(command: str, cwd: str = ".", timeout: int = 60, use_cache: bool = True) -> str:
     """ワークスペース内でシェルコマンドを実行する。
 
+    出力（stdout と stderr を合わせたもの）は先頭と末尾の行だけを返す。長い出力の全体は
+    ログファイルに保存され、そのパスが出力中に示される。
+    テストのコマンド（pytest / test_*.py / npm test など）は、前回からプロジェクトのファイルが
+    変わっていなければキャッシュ済みの結果を返す（出力の先頭に明記される）。
+
     Args:
         command: 実行するコマンド（例: "uv run python test.py", "npm test"）
         cwd: 実行ディレクトリ（ワークスペースルートからの相対パス、デフォルト: ルート）
+        timeout: タイムアウト秒数（デフォルト: 60、最大: 600）
+        use_cache: False ならテストのコマンドでもキャッシュを使わずに実行する
     """
-    import subprocess
-
     full_cwd = _resolve(cwd)
+    root = _workspace_root_var.get()
 
     # セキュリティ: ワークスペース外へのアクセスを防止
-    if _workspace_root and not full_cwd.startswith(_workspace_root):
+    if root and not full_cwd.startswith(root):
         return f"エラー: ワークスペース外のディレクトリ: {cwd}"
 
     # セキュリティ: 危険なコマンドをブロック
@@ -226,29 +482,193 @@ def run_shell(command: str, cwd: str = ".") -> str:
     if any(pattern in command for pattern in dangerous_patterns):
         return f"エラー: 危険なコマンドが検出されました: {command[:50]}"
 
+    timeout = min(max(1, timeout), 600)
+    project = warm_runner.project_dir(full_cwd, root or None)
     try:
-        result = subprocess.run(
-            command,
-            shell=True,
-            cwd=full_cwd,
-            capture_output=True,
-            text=True,
-            timeout=60,  # 60秒タイムアウト
+        result = await _with_cache(
+            "run_shell", command, full_cwd,
+            lambda root: result_cache.shell_inputs(root, project),
+            lambda: shell.run(command, full_cwd, timeout, emit=broadcast),
+            use_cache and result_cache.is_test_command(command),
         )
+    except Exception as e:
+        return f"エラー: コマンド実行失敗: {e}"
+    return _mark_cache(shell.format_result(command, result, timeout), result)
 
-        output = f"=== コマンド ===\n{command}\n\n"
-        output += f"=== stdout ===\n{result.stdout}\n"
-        if result.stderr:
-            output += f"\n=== stderr ===\n{result.stderr}\n"
-        output += f"\n終了コード: {result.returncode}"
 
-        return output
+async def _with_cache(kind: str, command: str, full_cwd: str, files, run, use_cache: bool) -> dict:
+    """run() の結果を result_cache 経由で返す
+
+    files はワークスペースルートを受け取って関連ファイルの一覧を返す関数。結果には
+    "cache"（"hit": キャッシュから返した / "miss": 実行して保存した / None: キャッシュ対象外）を付ける。
+    """
+    root = _workspace_root_var.get()
+    if not (use_cache and result_cache.enabled() and root):
+        result = await run()
+        result["cache"] = None
+        return result
+    root = os.path.realpath(root)
+    loop = asyncio.get_running_loop()
+    key = await loop.run_in_executor(
+        None, lambda: result_cache.make_key(root, kind, command, full_cwd, files(root))
+    )
+    cached = await loop.run_in_executor(None, result_cache.lookup, key)
+    if cached is not None:
+        print(f"[{kind}] キャッシュ済みの結果を返します: {command}")
+        cached["cache"] = "hit"
+        return cached
+    result = await run()
+    await loop.run_in_executor(None, result_cache.save, key, command, result)
+    result["cache"] = "miss"
+    return result
+
+
+def _mark_cache(output: str, result: dict) -> str:
+    """キャッシュから返した結果か、新たに実行した結果かを出力に明記する"""
+    if result.get("cache") == "hit":
+        return result_cache.cached_note(result) + "\n\n" + output
+    if result.get("cache") == "miss":
+        return output + "\n（新たに実行した結果です）"
+    return output
 
-    except subprocess.TimeoutExpired:
-        return f"エラー: コマンドがタイムアウトしました（60秒）: {command}"
-    except Exception as e:
-        return f"エラー: コマンド実行失敗: {e}"
 
+@tool
+async def run_tests(
+    path: str,
+    arguments: list[str] | None = None,
+    pytest: bool = False,
+    cwd: str | None = None,
+    timeout: int = 60,
+    use_cache: bool = True,
+) -> str:
+    """Python のテストファイルを常駐ワーカーで実行する（`uv run python test_x.py` よりはるかに速く起動する）。
+
+    ライブラリは事前にインポート済みで、ワークスペースのモジュールは毎回読み込み直すため、
+    編集した内容はそのまま反映される。Python 以外のテストやビルドには run_shell を使うこと。
 
-FILE_TOOLS = [read_file, read_file_lines, write_file, list_files, run_shell]
+    Args:
+        path: テストファイルのワークスペースルートからの相対パス（例: ai-agent/test_tools.py）
+        arguments: スクリプトに渡す引数（pytest=True の場合は pytest の引数。例: ["-k", "history"]）
+        pytest: True なら pytest で実行する（デフォルト: スクリプトとして `python path` と同じように実行）
+        cwd: 実行ディレクトリ（デフォルト: テストファイルのあるディレクトリ）
+        timeout: タイムアウト秒数（デフォルト: 60、最大: 600）
+        use_cache: False ならキャッシュを使わずに実行する（デフォルトでは、テストファイルと
+            それが import するファイルなどに前回から変更がなければキャッシュ済みの結果を返す）
+    """
+    full_path = _resolve(path)
+    if not os.path.isfile(full_path):
+        return f"エラー: ファイルが見つかりません: {path}"
+    full_cwd = _resolve(cwd) if cwd else os.path.dirname(full_path)
+    root = _workspace_root_var.get()
+    if root and not os.path.realpath(full_cwd).startswith(os.path.realpath(root)):
+        return f"エラー: ワークスペース外のディレクトリ: {cwd}"
+
+    timeout = min(max(1, timeout), 600)
+    label, result = await _run_python_test(full_path, full_cwd, arguments, pytest, timeout, use_cache)
+    output = shell.format_result(label, result, timeout)
+    output += f"（{result['duration']:.2f}秒、ウォームワーカー）" if result.get("warm") else ""
+    return _mark_cache(output, result)
+
+
+async def _run_python_test(
+    full_path: str, full_cwd: str, arguments: list[str] | None, pytest: bool, timeout: float,
+    use_cache: bool = True,
+) -> tuple[str, dict]:
+    """テストを常駐ワーカーで（使えなければ通常のプロセスで）実行し、(表示用のコマンド, 結果) を返す"""
+    label = " ".join(["pytest" if pytest else "python", os.path.relpath(full_path, full_cwd), *(arguments or [])])
+    project = warm_runner.project_dir(full_cwd, _workspace_root_var.get() or None)
+
+    def files(root: str) -> list[str]:
+        rel = os.path.relpath(os.path.realpath(full_path), root).replace(os.sep, "/")
+        return result_cache.test_inputs(root, project, [rel])
+
+    result = await _with_cache(
+        "run_tests", label, full_cwd, files,
+        lambda: _run_python_test_uncached(full_path, full_cwd, arguments, pytest, timeout),
+        use_cache,
+    )
+    return label, result
+
+
+async def _run_python_test_uncached(
+    full_path: str, full_cwd: str, arguments: list[str] | None, pytest: bool, timeout: float
+) -> dict:
+    root = _workspace_root_var.get() or None
+    try:
+        if not hasattr(os, "fork"):
+            raise RuntimeError("fork を使えない環境です")
+        result = await warm_runner.run_test(
+            full_path, full_cwd, root, arguments, pytest, timeout, emit=broadcast
+        )
+    except (RuntimeError, OSError) as e:
+        print(f"[run_tests] ウォームワーカーを使えないため通常実行します: {e}")
+        python = warm_runner.python_for(warm_runner.project_dir(full_cwd, root))
+        command = shlex.join([python, *(["-m", "pytest"] if pytest else []), full_path, *(arguments or [])])
+        result = await shell.run(command, full_cwd, timeout, emit=broadcast)
+    return result
+
+
+_MAX_FAILURE_LINES = 60   # run_affected_tests で失敗したテストごとに返す出力の末尾行数
+
+
+@tool
+async def run_affected_tests(write_files: list[str], timeout: int = 120, use_cache: bool = True) -> str:
+    """変更したファイルを（間接的にでも）import している Python のテストだけを実行する。
+
+    ワークスペースの import の依存関係から対象のテストを選ぶため、変更に関係のない遅いテスト
+    （結合テストなど）は実行しない。変更したファイルがテストファイルならそれ自体も実行する。
+
+    Args:
+        write_files: 変更したファイルのワークスペースルートからの相対パスのリスト（例: ["ai-agent/agent/history.py"]）
+        timeout: テスト1件あたりのタイムアウト秒数（デフォルト: 120、最大: 600）
+        use_cache: False ならキャッシュを使わずに実行する（デフォルトでは、テストが import するファイル
+            などに前回から変更がなければキャッシュ済みの結果を返し、行末に「キャッシュ」と示す）
+    """
+    root = _workspace_root_var.get()
+    if not root:
+        return "エラー: ワークスペースが設定されていません"
+    root = os.path.realpath(root)
+    changed = [os.path.relpath(os.path.realpath(_resolve(p)), root).replace(os.sep, "/") for p in write_files]
+    graph = impact.get_graph(root)
+    tests = await asyncio.get_running_loop().run_in_executor(None, graph.affected_tests, changed)
+    total = len(graph.all_tests())
+    if not tests:
+        return f"影響を受けるテストはありません（変更: {', '.join(changed) or 'なし'}、全 {total} 件のテスト）"
+
+    timeout = min(max(1, timeout), 600)
+
+    async def run_one(rel: str) -> tuple[str, dict]:
+        full_path = os.path.join(root, rel)
+        if graph.is_script(rel):
+            return await _run_python_test(full_path, os.path.dirname(full_path), None, False, timeout, use_cache)
+        # pytest 形式のテストはプロジェクトのディレクトリ（pyproject.toml のある場所）から実行する
+        project = warm_runner.project_dir(os.path.dirname(full_path), root)
+        return await _run_python_test(full_path, project, None, True, timeout, use_cache)
+
+    results = await asyncio.gather(*(run_one(rel) for rel in tests))
+    passed = sum(1 for _, r in results if r["exit_code"] == 0 and not r["timed_out"])
+    hits = sum(1 for _, r in results if r.get("cache") == "hit")
+    lines = [
+        f"影響を受けるテスト: {len(tests)} 件（全 {total} 件中）— 成功 {passed} / 失敗 {len(tests) - passed}"
+        + (f"（うち {hits} 件はファイルに変更がないためキャッシュ済みの結果）" if hits else "")
+    ]
+    failures = []
+    for rel, (label, result) in zip(tests, results):
+        cached = "、キャッシュ" if result.get("cache") == "hit" else ""
+        if result["timed_out"]:
+            lines.append(f"⏱ {rel}（タイムアウト {timeout}秒）")
+        elif result["exit_code"] == 0:
+            lines.append(f"✅ {rel}（{result['duration']:.2f}秒{cached}）")
+        else:
+            lines.append(f"❌ {rel}（終了コード {result['exit_code']}、{result['duration']:.2f}秒{cached}）")
+        if result["timed_out"] or result["exit_code"] != 0:
+            tail = result["output"].splitlines()[-_MAX_FAILURE_LINES:]
+            failures.append(f"\n=== {label}（{rel}）の出力（末尾） ===\n" + "\n".join(tail))
+    return "\n".join(lines + failures)
+
+
+FILE_TOOLS = [
+    read_file, read_file_lines, tail_file, write_file, apply_patch, list_files, search_code,
+    run_shell, run_tests, run_affected_tests,
+]
 ALL_TOOLS = TOOLS + FILE_TOOLS
@@ -0,0 +1,357 @@
+"""インポート済みの常駐 Python プロセスでテストを実行する（run_tests 用）
+
+`uv run python test_x.py` は毎回 uv の解決・インタープリタ起動・langchain / langgraph などの
+インポートに数秒かかる。重いライブラリだけを事前にインポートしたサーバープロセスを常駐させ、
+テストごとに fork した子プロセスで実行する（forkserver 方式）。
+
+- サーバーは Unix ソケットで要求を受け、接続ごとに fork した子（ハンドラ）が新しいセッションで
+  さらにテスト本体を fork し、出力行と終了コードを JSON 行で返す
+- 事前インポートするのはサードパーティのライブラリのみ（WARM_RUNNER_PRELOAD）。ワークスペースの
+  モジュールは子プロセスで毎回読み込むので、編集した内容がそのまま反映される
+- インタープリタはプロジェクトの .venv を優先し、pyproject.toml / uv.lock などが変わった場合や
+  サーバーが終了していた場合は起動し直す
+- このファイルはサーバーとしてスクリプト実行されるため、トップレベルでは標準ライブラリだけを使う
+  （agent パッケージを読み込むとワークスペースのモジュールを事前インポートしてしまう）
+
+サーバーの起動: python warm_runner.py serve <ソケットのパス> <事前インポートするモジュール,...>
+"""
+
+import asyncio
+import atexit
+import importlib
+import json
+import os
+import runpy
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import traceback
+
+_DEFAULT_PRELOAD = "numpy,pydantic,fastapi,boto3,langchain_core,langgraph,langchain_aws,pytest"
+_LOCK_FILES = ("pyproject.toml", "uv.lock", "requirements.txt", "poetry.lock")
+_START_TIMEOUT = 60.0
+
+
+# ---- サーバー（常駐プロセス側） -------------------------------------------------
+
+def _send(conn: socket.socket, message: dict) -> None:
+    conn.sendall((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+
+
+def _run_test(request: dict) -> int:
+    """テスト本体を実行して終了コードを返す（fork した孫プロセスで呼ぶ）"""
+    os.chdir(request["cwd"])
+    path = os.path.abspath(request["path"])
+    args = list(request.get("args") or [])
+    sys.stdout.reconfigure(line_buffering=True)
+    sys.stderr.reconfigure(line_buffering=True)
+    try:
+        if request.get("pytest"):
+            import pytest
+
+            sys.path.insert(0, request["cwd"])   # `python -m pytest` と同じく実行ディレクトリから import できるようにする
+            return int(pytest.main([path, *args]))
+        sys.argv = [path, *args]
+        sys.path.insert(0, os.path.dirname(path))
+        runpy.run_path(path, run_name="__main__")
+        return 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+
+def _handle(conn: socket.socket) -> None:
+    """1件の要求を処理する（接続ごとに fork した子プロセスで呼ぶ）"""
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    os.setsid()   # クライアントがタイムアウト時にテストごと killpg できるようにする
+    with conn.makefile("rb") as f:
+        request = json.loads(f.readline())
+    _send(conn, {"pid": os.getpid()})
+    read_fd, write_fd = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        conn.close()
+        os.dup2(os.open(os.devnull, os.O_RDONLY), 0)   # サーバーの stdin（親との接続）を読ませない
+        os.dup2(write_fd, 1)
+        os.dup2(write_fd, 2)
+        os.close(write_fd)
+        os._exit(_run_test(request))
+    os.close(write_fd)
+    with os.fdopen(read_fd, "rb") as out:
+        for raw in out:
+            _send(conn, {"line": raw.decode("utf-8", errors="replace").rstrip("\n").rstrip("\r")})
+    _, status = os.waitpid(pid, 0)
+    _send(conn, {"exit": os.waitstatus_to_exitcode(status)})
+
+
+def serve(socket_path: str, preload: list[str]) -> None:
+    # スクリプトのディレクトリ（agent/）がワークスペースのモジュールを隠さないように外す
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path[:] = [p for p in sys.path if os.path.abspath(p or ".") != here]
+    loaded = []
+    for name in preload:
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except Exception:
+            pass
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(16)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)   # ハンドラの子プロセスは自動で回収する
+    print(json.dumps({"ready": True, "preloaded": loaded}), flush=True)
+
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ)
+    selector.register(sys.stdin, selectors.EVENT_READ)   # 親プロセスが終了したら stdin が閉じる
+    while True:
+        for key, _ in selector.select():
+            if key.fileobj is sys.stdin:
+                if not sys.stdin.buffer.read1(1024):
+                    server.close()
+                    os.remove(socket_path)
+                    return
+                continue
+            conn, _ = server.accept()
+            if os.fork() == 0:
+                server.close()
+                try:
+                    _handle(conn)
+                finally:
+                    os._exit(0)
+            conn.close()
+
+
+# ---- クライアント（エージェント側） ---------------------------------------------
+
+def project_dir(cwd: str, root: str | None = None) -> str:
+    """cwd から上にたどって .venv か pyproject.toml のあるディレクトリを返す（root より上には行かない）"""
+    path = os.path.realpath(cwd)
+    stop = os.path.realpath(root) if root else None
+    while True:
+        if os.path.isdir(os.path.join(path, ".venv")) or os.path.isfile(os.path.join(path, "pyproject.toml")):
+            return path
+        parent = os.path.dirname(path)
+        if path == stop or parent == path:
+            return os.path.realpath(cwd)
+        path = parent
+
+
+def python_for(project: str) -> str:
+    """プロジェクトの .venv のインタープリタ（なければこのプロセスと同じもの）"""
+    for rel in (".venv/bin/python", ".venv/Scripts/python.exe"):
+        candidate = os.path.join(project, rel)
+        if os.path.exists(candidate):
+            return candidate
+    return sys.executable
+
+
+def _lock_state(project: str) -> tuple:
+    state = []
+    for name in _LOCK_FILES:
+        try:
+            state.append(os.stat(os.path.join(project, name)).st_mtime_ns)
+        except OSError:
+            state.append(None)
+    return tuple(state)
+
+
+class WarmWorker:
+    """1つのプロジェクト（インタープリタ）に対する常駐サーバー"""
+
+    def __init__(self, project: str, python: str, preload: list[str]):
+        self.project = project
+        self.python = python
+        self.preload = preload
+        self.socket_path = ""
+        self.preloaded: list[str] = []
+        self.runs = 0
+        self._proc = None
+        self._lock_state = None
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def stale(self) -> bool:
+        return not self.alive or _lock_state(self.project) != self._lock_state
+
+    def start(self) -> None:
+        """サーバーを起動し、準備完了まで待つ（ブロッキング。スレッドプールで呼ぶ）"""
+        self.close()
+        self.socket_path = os.path.join(tempfile.mkdtemp(prefix="warm-runner-"), "sock")
+        env = dict(os.environ, PYTHONIOENCODING="utf-8", PYTHONUNBUFFERED="1")
+        self._lock_state = _lock_state(self.project)
+        self._proc = subprocess.Popen(
+            [self.python, os.path.abspath(__file__), "serve", self.socket_path, ",".join(self.preload)],
+            cwd=self.project,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env=env,
+        )
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._proc.stdout, selectors.EVENT_READ)
+            if not selector.select(_START_TIMEOUT):
+                self.close()
+                raise RuntimeError(f"ウォームワーカーが {_START_TIMEOUT:g} 秒以内に起動しませんでした")
+        line = self._proc.stdout.readline()
+        if not line:
+            self.close()
+            raise RuntimeError("ウォームワーカーの起動に失敗しました")
+        self.preloaded = json.loads(line).get("preloaded", [])
+        print(f"[warm_runner] ワーカー起動: {self.project}（事前インポート: {', '.join(self.preloaded) or 'なし'}）")
+
+    def close(self) -> None:
+        if self._proc is not None:
+            try:
+                self._proc.stdin.close()
+                self._proc.wait(timeout=2)
+            except Exception:
+                self._proc.kill()
+            self._proc = None
+        if self.socket_path:
+            try:
+                os.remove(self.socket_path)
+                os.rmdir(os.path.dirname(self.socket_path))
+            except OSError:
+                pass
+
+    async def run(self, path: str, args: list[str], cwd: str, use_pytest: bool, on_line) -> int:
+        """テストを実行し、出力行ごとに on_line を呼んで終了コードを返す
+
+        キャンセル（タイムアウト）された場合はテストのプロセスグループを終了させる。
+        """
+        reader, writer = await asyncio.open_unix_connection(self.socket_path, limit=1 << 20)
+        pid = None
+        try:
+            request = {"path": path, "args": args, "cwd": cwd, "pytest": use_pytest}
+            writer.write((json.dumps(request) + "\n").encode("utf-8"))
+            await writer.drain()
+            self.runs += 1
+            while True:
+                raw = await reader.readline()
+                if not raw:
+                    raise RuntimeError("ウォームワーカーとの接続が切れました")
+                message = json.loads(raw)
+                if "pid" in message:
+                    pid = message["pid"]
+                elif "line" in message:
+                    await on_line(message["line"])
+                elif "exit" in message:
+                    pid = None
+                    return message["exit"]
+        finally:
+            if pid is not None:
+                try:
+                    os.killpg(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            writer.close()
+
+
+_workers: dict[str, WarmWorker] = {}
+_start_locks: dict[str, tuple[asyncio.AbstractEventLoop, asyncio.Lock]] = {}
+
+
+def _start_lock(project: str) -> asyncio.Lock:
+    """プロジェクトごとの起動用ロック（イベントループごとに作り直す）"""
+    loop = asyncio.get_running_loop()
+    entry = _start_locks.get(project)
+    if entry is None or entry[0] is not loop:
+        entry = (loop, asyncio.Lock())
+        _start_locks[project] = entry
+    return entry[1]
+
+
+async def get_worker(project: str) -> WarmWorker:
+    """プロジェクトのワーカーを返す（未起動・古い場合は起動し直す）
+
+    並行して呼ばれても起動は1回だけにする（2つ目の start() が1つ目のサーバーを close() しないように、
+    古いかどうかの判定と起動をロックの中で行う）。
+    """
+    async with _start_lock(project):
+        python = python_for(project)
+        worker = _workers.get(project)
+        if worker is None or worker.python != python:
+            preload = [m for m in os.environ.get("WARM_RUNNER_PRELOAD", _DEFAULT_PRELOAD).split(",") if m]
+            worker = WarmWorker(project, python, preload)
+            _workers[project] = worker
+        if worker.stale():
+            await asyncio.get_running_loop().run_in_executor(None, worker.start)
+        return worker
+
+
+async def run_test(path: str, cwd: str, root: str | None = None, args: list[str] | None = None,
+                   use_pytest: bool = False, timeout: float = 60.0, emit=None) -> dict:
+    """ウォームワーカーでテストを実行し、shell.run と同じ形式の結果を返す（"warm": True を付ける）"""
+    from agent import shell   # サーバー側では読み込まないよう関数内でインポートする
+
+    project = project_dir(cwd, root)
+    args = list(args or [])
+    label = " ".join(["pytest" if use_pytest else "python", os.path.relpath(path, cwd), *args])
+    await shell.LIMITER.acquire()
+    try:
+        shell.LIMITER.started += 1
+        worker = await get_worker(project)
+        stream = shell.OutputStream(label, cwd, emit)
+        await stream.start()
+
+        async def on_line(line: str) -> None:
+            stream.add(line)
+            await stream.flush()
+
+        timed_out, exit_code = False, None
+        try:
+            exit_code = await asyncio.wait_for(worker.run(path, args, cwd, use_pytest, on_line), timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            shell.LIMITER.timeouts += 1
+        except OSError:
+            # ソケットに接続できない（サーバーが応答しない・ソケットがない）場合は次回起動し直す
+            stream.discard()
+            worker.close()
+            raise
+        except BaseException:
+            stream.discard()
+            raise
+        result = await stream.finish(exit_code, timed_out)
+        result["warm"] = True
+        return result
+    finally:
+        shell.LIMITER.release()
+
+
+def shutdown() -> None:
+    for worker in _workers.values():
+        worker.close()
+    _workers.clear()
+    _start_locks.clear()
+
+
+atexit.register(shutdown)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "serve":
+        serve(sys.argv[2], [m for m in (sys.argv[3] if len(sys.argv) > 3 else "").split(",") if m])
+    else:
+        print(__doc__)
+        sys.exit(2)
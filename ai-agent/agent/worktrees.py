@@ -0,0 +1,347 @@
+"""タスクごとの git worktree（事前に作成したプールから割り当てる）
+
+coder / reviewer はタスクごとに専用の worktree で作業し、レビューが PASS なら変更を元の
+チェックアウトへ反映、FAIL なら worktree を元に戻して捨てる（途中までの書き込みが残らない）。
+
+- worktree はプール（WORKTREE_POOL_SIZE、既定 2）として事前に作成しておき、再利用する。
+  割り当ては「元のチェックアウトのスナップショットへの reset --hard + clean」だけなので、
+  変更の少ない2回目以降は数十ミリ秒で終わる。パスが変わらないのでファイル索引・検索索引・
+  ウォームワーカーもタスクをまたいで使い回せる
+- スナップショットは一時的な index に `git add -A` して作るコミット（未コミットの変更・
+  .gitignore されていない未追跡ファイルを含む。元のチェックアウトの index は変更しない）
+- 反映はスナップショットからの差分を `git apply` で元のチェックアウトの作業ツリーに当てる。
+  タスク中に元のチェックアウトの同じ箇所が変更されていた場合は反映せずに MergeConflict を送出する
+- worktree はコミットから作るので .gitignore されたものは含まれない。依存関係のディレクトリ（.venv /
+  node_modules など）・.env・ログなど WORKTREE_SHARED（既定は下記 _SHARED_DEFAULT）の名前に一致する
+  .gitignore された項目は、割り当て時に元のチェックアウトの同じパスへのシンボリックリンクを置く
+  （コピーしないので割り当ては速いまま。タスク中の書き込み（pip install など）は元のチェックアウトに及ぶ）。
+  リンクはスナップショット・反映の対象から外す
+- ワークスペースが git リポジトリでない場合や WORKTREE_ISOLATION=0 の場合は使わない
+"""
+
+import fnmatch
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from agent.paths import data_path
+
+_POOL_SIZE = max(1, int(os.environ.get("WORKTREE_POOL_SIZE", "2")))
+_ENABLED = os.environ.get("WORKTREE_ISOLATION", "1").lower() not in ("0", "false", "no")
+_GIT_TIMEOUT = 120
+_SHARED_DEFAULT = ".venv,venv,env,node_modules,.env,.env.*,logs,log"
+_SHARED = [p.strip() for p in os.environ.get("WORKTREE_SHARED", _SHARED_DEFAULT).split(",") if p.strip()]
+
+
+class MergeConflict(RuntimeError):
+    """タスクの変更を元のチェックアウトに反映できなかった"""
+
+
+def _git(cwd: str, *args: str, env: dict | None = None, input: bytes | None = None) -> str:
+    proc = subprocess.run(
+        ["git", *args],
+        cwd=cwd,
+        env=env,
+        input=input,
+        capture_output=True,
+        timeout=_GIT_TIMEOUT,
+    )
+    if proc.returncode != 0:
+        message = proc.stderr.decode("utf-8", errors="replace").strip()
+        raise RuntimeError(f"git {' '.join(args[:2])} に失敗しました: {message}")
+    return proc.stdout.decode("utf-8", errors="replace").strip()
+
+
+def repo_root(path: str) -> str | None:
+    """path を含む git リポジトリの作業ツリーのルート（git 管理外なら None）"""
+    try:
+        return os.path.realpath(_git(path, "rev-parse", "--show-toplevel"))
+    except (OSError, RuntimeError, subprocess.TimeoutExpired):
+        return None
+
+
+def snapshot(checkout: str, exclude: list[str] | None = None) -> str:
+    """作業ツリーの現在の内容（未コミットの変更・未追跡ファイルを含む）をコミットにして返す
+
+    Args:
+        exclude: 含めないパス（checkout からの相対パス。プールの worktree の置き場所や共有のリンクなど）
+    """
+    index = _git(checkout, "rev-parse", "--path-format=absolute", "--git-path", "index")
+    with tempfile.TemporaryDirectory(prefix="worktree-index-") as tmp:
+        tmp_index = os.path.join(tmp, "index")
+        if os.path.exists(index):
+            shutil.copy2(index, tmp_index)   # stat 情報を再利用して add -A を速くする（mtime も保ち racy-git の判定を元の index と揃える）
+        env = dict(os.environ, GIT_INDEX_FILE=tmp_index)
+        _git(checkout, "add", "-A", "--", ".", *[f":(exclude){path}" for path in exclude or []], env=env)
+        tree = _git(checkout, "write-tree", env=env)
+    try:
+        parent = ["-p", _git(checkout, "rev-parse", "--verify", "-q", "HEAD")]
+    except RuntimeError:
+        parent = []
+    env = dict(
+        os.environ,
+        GIT_AUTHOR_NAME="agent", GIT_AUTHOR_EMAIL="agent@localhost",
+        GIT_COMMITTER_NAME="agent", GIT_COMMITTER_EMAIL="agent@localhost",
+    )
+    return _git(checkout, "commit-tree", tree, *parent, "-m", "task snapshot", env=env)
+
+
+def shared_paths(checkout: str) -> list[str]:
+    """worktree にリンクする .gitignore された項目（checkout からの相対パス。WORKTREE_SHARED の名前に一致するもの）"""
+    out = _git(checkout, "ls-files", "-z", "--others", "--ignored", "--exclude-standard", "--directory")
+    paths = []
+    for entry in out.split("\0"):
+        rel = entry.rstrip("/")
+        if rel and any(fnmatch.fnmatch(os.path.basename(rel), pattern) for pattern in _SHARED):
+            paths.append(rel)
+    return paths
+
+
+class Worktree:
+    """タスクに割り当てた worktree"""
+
+    def __init__(self, path: str, base: str, subdir: str, links: list[str] | None = None, exclude: list[str] | None = None):
+        self.path = path
+        self.base = base        # 割り当て時の元のチェックアウトのスナップショット
+        self.subdir = subdir    # リポジトリのルートからワークスペースへの相対パス
+        self.links = links or []   # 元のチェックアウトへのシンボリックリンク（リポジトリのルートからの相対パス）
+        self.exclude = exclude or []   # スナップショットで除外するリンク（.gitignore に一致しないもの）
+
+    @property
+    def workspace(self) -> str:
+        """タスク中のワークスペースルート（元のワークスペースに対応する worktree 内のディレクトリ）"""
+        return os.path.normpath(os.path.join(self.path, self.subdir))
+
+
+class WorktreePool:
+    """1つのリポジトリに対する worktree のプール"""
+
+    def __init__(self, repo: str, size: int = _POOL_SIZE):
+        self.repo = os.path.realpath(repo)
+        self.size = size
+        key = os.path.basename(self.repo) + "-" + hashlib.sha1(self.repo.encode("utf-8")).hexdigest()[:10]
+        self.directory = data_path("worktrees", key)
+        os.makedirs(self.directory, exist_ok=True)
+        inside = os.path.realpath(self.directory).startswith(self.repo + os.sep)
+        self._exclude = [os.path.relpath(os.path.realpath(self.directory), self.repo)] if inside else []
+        self._idle: list[str] = []
+        self._active: dict[str, Worktree] = {}
+        self._lock = threading.Lock()
+        self._filling = False
+        self.created = 0
+        self.merged = 0
+        self.discarded = 0
+        self.last_acquire_ms = 0.0
+        self._adopt_existing()
+
+    def _adopt_existing(self) -> None:
+        """前回の起動で作った worktree を再利用する（登録が外れたディレクトリは削除する）"""
+        _git(self.repo, "worktree", "prune")
+        registered = set()
+        for line in _git(self.repo, "worktree", "list", "--porcelain").splitlines():
+            if line.startswith("worktree "):
+                registered.add(os.path.realpath(line[len("worktree "):]))
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if os.path.realpath(path) in registered:
+                self._idle.append(path)
+            else:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _create(self) -> str:
+        with self._lock:
+            self.created += 1
+            n = self.created
+        path = os.path.join(self.directory, f"wt-{os.getpid()}-{n}")
+        _git(self.repo, "worktree", "add", "--detach", "-q", path, "HEAD")
+        return path
+
+    def _link_shared(self, path: str) -> list[str]:
+        """元のチェックアウトの .gitignore された依存関係・.env などを worktree の同じパスにリンクする"""
+        links = []
+        for rel in shared_paths(self.repo):
+            if any(rel == ex or rel.startswith(ex + "/") for ex in self._exclude):
+                continue
+            dest, target = os.path.join(path, rel), os.path.join(self.repo, rel)
+            if os.path.islink(dest) and os.readlink(dest) == target:
+                links.append(rel)   # clean で消えない（.gitignore に一致する）前回のリンク
+                continue
+            if os.path.lexists(dest) or not os.path.isdir(os.path.dirname(dest)):
+                continue   # worktree 側に同じパスがある（追跡されている）か、親ディレクトリがない
+            os.symlink(target, dest)
+            links.append(rel)
+        return links
+
+    @staticmethod
+    def _unignored(path: str, links: list[str]) -> list[str]:
+        """links のうち worktree で .gitignore に一致しないもの（`node_modules/` のようなディレクトリ用の
+        パターンはシンボリックリンクに一致しない）。スナップショットではこれらを明示的に除外する"""
+        if not links:
+            return []
+        proc = subprocess.run(
+            ["git", "check-ignore", "-z", "--stdin"],
+            cwd=path, input="\0".join(links).encode("utf-8"), capture_output=True, timeout=_GIT_TIMEOUT,
+        )
+        ignored = set(proc.stdout.decode("utf-8", errors="replace").split("\0"))
+        return [rel for rel in links if rel not in ignored]
+
+    def fill(self) -> None:
+        """プールが size 個になるまで worktree を作る（ブロッキング）"""
+        while True:
+            with self._lock:
+                if len(self._idle) >= self.size:
+                    self._filling = False
+                    return
+            path = self._create()
+            with self._lock:
+                surplus = len(self._idle) >= self.size   # 作成中に worktree が返されていれば不要
+                if not surplus:
+                    self._idle.append(path)
+            if surplus:
+                _git(self.repo, "worktree", "remove", "--force", path)
+
+    def _fill_in_background(self) -> None:
+        with self._lock:
+            if self._filling or len(self._idle) >= self.size:
+                return
+            self._filling = True
+        threading.Thread(target=self._fill_safely, daemon=True).start()
+
+    def _fill_safely(self) -> None:
+        try:
+            self.fill()
+        except Exception as e:
+            print(f"[worktrees] worktree の作成に失敗しました: {e}")
+            with self._lock:
+                self._filling = False
+
+    def acquire(self, workspace: str) -> Worktree:
+        """元のチェックアウト（workspace を含むリポジトリ）の現在の内容で worktree を1つ割り当てる"""
+        start = time.monotonic()
+        base = snapshot(self.repo, self._exclude)
+        with self._lock:
+            path = self._idle.pop() if self._idle else None
+        if path is None:
+            path = self._create()
+        try:
+            _git(path, "reset", "-q", "--hard", base)
+            _git(path, "clean", "-fdq")
+            links = self._link_shared(path)
+            exclude = self._unignored(path, links)
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        subdir = os.path.relpath(os.path.realpath(workspace), self.repo)
+        worktree = Worktree(path, base, subdir, links, exclude)
+        with self._lock:
+            self._active[worktree.workspace] = worktree
+        self._fill_in_background()
+        self.last_acquire_ms = (time.monotonic() - start) * 1000
+        print(f"[worktrees] worktree を割り当てました: {path}（{self.last_acquire_ms:.0f}ms）")
+        return worktree
+
+    def get(self, workspace: str) -> Worktree | None:
+        with self._lock:
+            return self._active.get(workspace)
+
+    def merge(self, worktree: Worktree) -> list[str]:
+        """worktree での変更を元のチェックアウトの作業ツリーに反映し、変更したファイル（リポジトリの
+        ルートからの相対パス）を返す。反映できない場合は MergeConflict（元のチェックアウトは変更しない）"""
+        head = snapshot(worktree.path, worktree.exclude)
+        changed = [p for p in _git(self.repo, "diff", "--name-only", "--no-renames", worktree.base, head).splitlines() if p]
+        if changed:
+            patch = subprocess.run(
+                ["git", "diff", "--binary", "--no-renames", worktree.base, head],
+                cwd=self.repo, capture_output=True, timeout=_GIT_TIMEOUT, check=True,
+            ).stdout
+            try:
+                _git(self.repo, "apply", "--check", "--binary", "--whitespace=nowarn", "-", input=patch)
+            except RuntimeError as e:
+                raise MergeConflict(f"元のチェックアウトに変更を反映できません: {e}") from e
+            _git(self.repo, "apply", "--binary", "--whitespace=nowarn", "-", input=patch)
+        self.merged += 1
+        return changed
+
+    def diff(self, worktree: Worktree, context: int = 3) -> str:
+        """割り当て時からの worktree の変更（run_shell での変更も含むすべて）の unified diff
+
+        パスはワークスペース（worktree.subdir）からの相対パスで、ワークスペースの外の変更は含めない。
+        """
+        head = snapshot(worktree.path, worktree.exclude)
+        relative = [] if worktree.subdir in (".", "") else [f"--relative={worktree.subdir}"]
+        patch = _git(worktree.path, "diff", "--no-renames", "--no-color", f"-U{context}", *relative, worktree.base, head)
+        return patch + "\n" if patch else ""
+
+    def release(self, worktree: Worktree, discarded: bool = False) -> None:
+        """worktree を割り当て時の状態に戻してプールに返す"""
+        with self._lock:
+            self._active.pop(worktree.workspace, None)
+        try:
+            _git(worktree.path, "reset", "-q", "--hard", worktree.base)
+            _git(worktree.path, "clean", "-fdq")
+        except Exception as e:
+            print(f"[worktrees] worktree を戻せなかったため削除します: {e}")
+            shutil.rmtree(worktree.path, ignore_errors=True)
+            _git(self.repo, "worktree", "prune")
+            return
+        if discarded:
+            self.discarded += 1
+        with self._lock:
+            surplus = len(self._idle) >= self.size
+            if not surplus:
+                self._idle.append(worktree.path)
+        if surplus:
+            # 割り当て中に補充した分でプールが埋まっていれば、返された worktree は削除する
+            _git(self.repo, "worktree", "remove", "--force", worktree.path)
+
+    def snapshot_stats(self) -> dict:
+        with self._lock:
+            return {
+                "repo": self.repo,
+                "idle": len(self._idle),
+                "active": len(self._active),
+                "created": self.created,
+                "merged": self.merged,
+                "discarded": self.discarded,
+                "last_acquire_ms": round(self.last_acquire_ms, 1),
+            }
+
+
+_pools: dict[str, WorktreePool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(workspace: str) -> WorktreePool | None:
+    """workspace を含むリポジトリのプール（worktree を使わない場合は None）"""
+    if not _ENABLED or not workspace:
+        return None
+    repo = repo_root(workspace)
+    if repo is None:
+        return None
+    with _pools_lock:
+        pool = _pools.get(repo)
+        if pool is None:
+            pool = WorktreePool(repo)
+            _pools[repo] = pool
+        return pool
+
+
+def find(workspace: str) -> tuple[WorktreePool, Worktree] | None:
+    """タスク中のワークスペース（worktree 内のディレクトリ）から割り当て中の worktree を探す"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        worktree = pool.get(workspace)
+        if worktree is not None:
+            return pool, worktree
+    return None
+
+
+def stats() -> list[dict]:
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.snapshot_stats() for pool in pools]
@@ -81,6 +81,80 @@ async def events_health():
     }
 
 
+@router.get("/metrics/llm")
+async def llm_metrics():
+    """
+    LLMゲートウェイのメトリクスエンドポイント
+
+    Returns:
+        dict: モデルIDごとの同時実行上限・スロットリング率・待ち時間と、
+              ティアごとのレイテンシ p95・ヘッジ回数
+    """
+    from agent.llm_gateway import get_latency_metrics, get_metrics
+
+    return {"models": get_metrics(), "tiers": get_latency_metrics()}
+
+
+@router.get("/metrics/files")
+async def file_metrics():
+    """
+    ファイル読み込みキャッシュのメトリクスエンドポイント
+
+    Returns:
+        dict: エントリ数・使用バイト数・ヒット率・節約したバイト数
+    """
+    from agent.file_cache import CACHE
+
+    return {"cache": CACHE.stats()}
+
+
+@router.get("/metrics/shell")
+async def shell_metrics():
+    """
+    run_shell のメトリクスエンドポイント
+
+    Returns:
+        dict: 同時実行数の上限・実行中・待ち・累計実行数・タイムアウト数と、
+            テスト結果キャッシュのヒット・ミス・保存数
+    """
+    from agent import result_cache
+    from agent.shell import LIMITER
+
+    return {"processes": LIMITER.snapshot(), "test_cache": dict(result_cache.stats)}
+
+
+@router.get("/metrics/worktrees")
+async def worktree_metrics():
+    """
+    タスク用 worktree のプールのメトリクスエンドポイント
+
+    Returns:
+        dict: リポジトリごとの待機中・割り当て中の worktree 数、反映・破棄したタスク数、直近の割り当て時間
+    """
+    from agent import worktrees
+
+    return {"pools": worktrees.stats()}
+
+
+@router.get("/sessions")
+async def sessions(limit: int = 20, device_id: str | None = None):
+    """
+    走行セッションのサマリーエンドポイント
+
+    Args:
+        limit: 返す終了済みセッションの最大件数
+        device_id: デバイスID（省略時は全デバイス）
+
+    Returns:
+        dict: 進行中のセッションと、終了済みセッション（新しい順）のサマリー
+    """
+    from agent.sessions import TRACKER
+
+    # ストアの flush を待つためイベントループの外で読む
+    finished = await asyncio.get_event_loop().run_in_executor(None, TRACKER.recent, limit, device_id)
+    return {"active": TRACKER.active(), "sessions": finished}
+
+
 @router.post("/start-agent")
 async def start_agent(request: dict):
     """
@@ -94,8 +168,7 @@ async def start_agent(request: dict):
         dict: 起動結果
     """
     import os
-    from agent.graph import run_dev_agent
-    from agent.tools import set_workspace_root
+    from agent.dev_graph import run_dev_agent
 
     plan_content = request.get("plan_content", "")
     model_tier = request.get("model_tier", "sonnet")
@@ -105,7 +178,6 @@ async def start_agent(request: dict):
 
     # workspace_root はプロジェクトルートを使用
     workspace_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    set_workspace_root(workspace_root)
 
     # plan.md に書き込む
     plan_path = os.path.join(workspace_root, "docs", "plan.md")
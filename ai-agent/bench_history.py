@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+センサー履歴のメモリ使用量ベンチマーク
+
+従来の「dict のリスト」と agent/history.py のリングバッファで、
+ESP32 の motion メッセージを同じ件数保存したときのメモリ使用量を比較します。
+
+使い方:
+    uv run python bench_history.py [件数]
+"""
+
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+from agent.history import SensorHistory, parse_timestamp
+
+
+def _make_payload(i: int) -> bytes:
+    """MQTT で受信するのと同じ形式の JSON ペイロードを生成する"""
+    ts = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(1_772_000_000 + i * 5))
+    return json.dumps({
+        "status": ("Run", "Walk", "None")[i % 3],
+        "bpm": 9.8 + (i % 50) * 0.137,
+        "timestamp": ts,
+        "device_id": "esp32-runner",
+    }).encode("utf-8")
+
+
+def _measure(label: str, n: int, store) -> float:
+    payloads = [_make_payload(i) for i in range(n)]
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    holder = store()
+    for payload in payloads:
+        holder(json.loads(payload))
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    per_sample = (after - before) / n
+    print(f"  {label:<24} {per_sample:8.1f} bytes/件  追加 {elapsed / n * 1e6:6.2f} µs/件")
+    return per_sample
+
+
+def _list_store():
+    history: dict[str, list[dict]] = {}
+    _list_store.keep = history
+
+    def append(data: dict) -> None:
+        history.setdefault("motion", []).append(data)
+    return append
+
+
+def _ring_store(capacity: int):
+    def factory():
+        history = SensorHistory(capacity)
+        _ring_store.keep = history
+        return lambda data: history.append("motion", data)
+    return factory
+
+
+def main() -> int:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    print("\n" + "=" * 60)
+    print(f"📊 センサー履歴メモリベンチマーク（{n:,} 件）")
+    print("=" * 60)
+
+    list_bytes = _measure("dict のリスト（従来）", n, _list_store)
+    ring_bytes = _measure("リングバッファ", n, _ring_store(n))
+    ratio = list_bytes / ring_bytes
+    print(f"\n  削減率: {ratio:.1f} 倍")
+
+    # 時刻範囲検索（O(log n)）の確認
+    history = _ring_store.keep
+    since = parse_timestamp(time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(1_772_000_000 + (n // 2) * 5)))
+    start = time.perf_counter()
+    for _ in range(1000):
+        history.buffer("motion", "esp32-runner").index_range(since, since + 60)
+    print(f"  時刻範囲検索: {(time.perf_counter() - start) / 1000 * 1e6:.2f} µs/回")
+    print("=" * 60 + "\n")
+
+    return 0 if ratio >= 10 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
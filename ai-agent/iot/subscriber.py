@@ -10,6 +10,7 @@ logger = logging.getLogger(__name__)
 from awscrt import auth, mqtt
 from awsiot import mqtt_connection_builder
 
+from agent.anomaly import ENGINE as anomaly_engine
 from api.events import broadcast
 
 _loop: asyncio.AbstractEventLoop | None = None
@@ -39,6 +40,10 @@ async def _handle_message(topic: str, message: dict) -> None:
     # IoT 受信イベントをまず配信
     await broadcast({"type": "iot", "topic": topic, "data": message})
 
+    # ストリーミング異常検知（LLM を介さずに受信時に評価する）
+    for anomaly in anomaly_engine.ingest(message):
+        await broadcast({"type": "anomaly", **anomaly})
+
     # LangGraph エージェントで処理（workspace_rootを渡す）
     try:
         response = await run_agent(message, workspace_root=_workspace_root)
@@ -8,6 +8,8 @@ from fastapi.middleware.cors import CORSMiddleware
 
 load_dotenv()
 
+from agent import store
+from agent.tools import restore_iot_status
 from api.routes import router
 from iot import subscriber
 
@@ -15,10 +17,14 @@ from iot import subscriber
 @contextlib.asynccontextmanager
 async def lifespan(app: FastAPI):
     loop = asyncio.get_event_loop()
+    # センサー履歴・デバイスステータスの永続化ストアを開き、前回の状態を復元
+    store.open_store()
+    print(f"[main] IoTステータスを復元しました: {restore_iot_status()} 件")
     # MQTT 接続はブロッキングなので別スレッドで実行
     await asyncio.get_event_loop().run_in_executor(None, subscriber.setup, loop)
     yield
     await asyncio.get_event_loop().run_in_executor(None, subscriber.teardown)
+    await asyncio.get_event_loop().run_in_executor(None, store.close_store)
 
 
 app = FastAPI(title="ai-agent", lifespan=lifespan)
@@ -0,0 +1,123 @@
+"""aggregate.py と get_history の範囲指定・集計のユニットテスト"""
+import os
+import sys
+import tempfile
+from unittest.mock import patch
+
+import numpy as np
+
+from agent import tools
+from agent.aggregate import aggregate_history, parse_duration, parse_time, summarize
+from agent.history import SensorHistory, format_timestamp
+from agent.store import SensorStore
+
+_BASE = 1_772_000_000.0  # 2026-02-25T06:13:20Z
+
+
+def _fill(history: SensorHistory, count: int, step: float = 1.0, devices: int = 1) -> None:
+    for i in range(count):
+        record = {"bpm": float(i % 100), "device_id": f"d{i % devices}", "status": "Run"}
+        record["timestamp"] = format_timestamp(_BASE + i * step)
+        history.append("motion", record)
+
+
+def test_parse_time_and_duration():
+    """ISO 8601 と相対指定、バケット幅の解釈を確認"""
+    assert parse_duration("10s") == 10
+    assert parse_duration("1h") == 3600
+    assert parse_time("-15m", now=_BASE) == _BASE - 900
+    assert parse_time(format_timestamp(_BASE)) == _BASE
+    assert parse_time(None) is None
+    for bad in ("5x", "abc"):
+        try:
+            parse_time(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"{bad} should be rejected")
+    print("✅ parse_time / parse_duration")
+
+
+def test_summarize_matches_numpy():
+    """バケット集計の値が NumPy で直接計算した値と一致することを確認"""
+    start = _BASE - _BASE % 60
+    ts = start + np.arange(120, dtype=np.float64)
+    values = np.arange(120, dtype=np.float64)
+    values[5] = np.nan
+    result = summarize(ts, values, 60)
+    assert result["total"]["count"] == 119
+    assert result["total"]["max"] == 119
+    first, second = result["buckets"]
+    expected = np.delete(values[:60], 5)
+    assert first["count"] == 59
+    assert first["p95"] == round(float(np.percentile(expected, 95)), 3)
+    assert second["mean"] == round(float(values[60:].mean()), 3)
+    print("✅ summarize")
+
+
+def test_memory_range_and_bucket_cap():
+    """メモリ上の範囲集計とデバイス絞り込み、バケット数の上限を確認"""
+    history = SensorHistory(capacity=10000)
+    _fill(history, 6000, devices=2)
+    result = aggregate_history(history, None, "motion", "bpm", _BASE + 1000, _BASE + 4999, "d0", 1)
+    assert result["source"] == "memory"
+    summary = result["fields"]["bpm"]
+    assert summary["total"]["count"] == 2000
+    assert len(summary["buckets"]) <= 61
+    assert "status" not in aggregate_history(history, None, "motion", None, None, None, None, None)["fields"]
+    print(f"✅ memory aggregate: bucket={result['bucket']}, {len(summary['buckets'])} buckets")
+
+
+def test_falls_back_to_store_rollups():
+    """メモリにない古い範囲はストアのロールアップで集計することを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SensorStore(os.path.join(tmp, "sensors.db"))
+        history = SensorHistory(capacity=100)
+        for i in range(3 * 3600 // 60):  # 1分ごとに3時間分
+            record = {"bpm": float(i % 10), "device_id": "a", "timestamp": format_timestamp(_BASE + i * 60)}
+            history.append("motion", record)
+            store.append("motion", record, _BASE + i * 60)
+        result = aggregate_history(history, store, "motion", "bpm", _BASE, _BASE + 3 * 3600, None, 3600)
+        assert result["source"] == "rollup_1h"
+        summary = result["fields"]["bpm"]
+        assert summary["total"]["count"] == 180
+        assert summary["total"]["mean"] == 4.5
+        assert "p95" not in summary["total"]
+        store.close()
+    print(f"✅ rollup aggregate: {len(summary['buckets'])} buckets")
+
+
+def test_history_range_reads_latest_from_store():
+    """メモリにない範囲の get_history はストアから範囲内の直近 n 件だけを読むことを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SensorStore(os.path.join(tmp, "sensors.db"))
+        for i in range(2000):
+            store.append("motion", {"bpm": i, "device_id": "a"}, _BASE + i * 60)
+        with patch.object(tools, "_history", SensorHistory(capacity=10)), \
+                patch.object(tools.sensor_store, "get_store", lambda: store), \
+                patch.object(store, "range", wraps=store.range) as store_range:
+            records = tools.get_history.invoke({
+                "sensor_type": "motion", "n": 3, "since": format_timestamp(_BASE), "until": format_timestamp(_BASE + 1000 * 60),
+            })
+        assert [r["bpm"] for r in records] == [998, 999, 1000]
+        assert store_range.call_args.kwargs["limit"] == 3 and store_range.call_args.kwargs["newest"] is True
+        store.close()
+    print("✅ history range reads latest from store")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Parse time and duration", test_parse_time_and_duration),
+        ("Summarize matches NumPy", test_summarize_matches_numpy),
+        ("Memory range and bucket cap", test_memory_range_and_bucket_cap),
+        ("Falls back to store rollups", test_falls_back_to_store_rollups),
+        ("History range reads latest from store", test_history_range_reads_latest_from_store),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
@@ -0,0 +1,99 @@
+"""anomaly.py のユニットテスト"""
+import sys
+import time
+
+import numpy as np
+
+from agent.anomaly import AnomalyEngine, StreamingDetector
+
+
+def _series(n: int = 400, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    values = rng.normal(10.0, 1.0, n)
+    values[150] = 30.0      # スパイク
+    values[250:] += 3.0     # 水準シフト
+    return values
+
+
+def test_batch_matches_streaming():
+    """score_batch が update() を順に呼んだ結果と一致することを確認"""
+    values = _series()
+    streaming = StreamingDetector()
+    expected = [streaming.update(float(v)) for v in values]
+
+    batch = StreamingDetector()
+    first = batch.score_batch(values[:97])
+    second = batch.score_batch(values[97:])
+    for key in ("z", "ewma", "cusum_pos", "cusum_neg"):
+        got = np.concatenate([first[key], second[key]])
+        assert np.allclose(got, [e[key] for e in expected]), key
+    spikes = np.concatenate([first["spike"], second["spike"]])
+    assert list(np.nonzero(spikes)[0]) == [i for i, e in enumerate(expected) if "spike" in e["kinds"]]
+    assert batch.samples == streaming.samples
+    assert np.isclose(batch.zscore(12.0), streaming.zscore(12.0))
+    print("✅ batch matches streaming")
+
+
+def test_detects_spike_and_drift():
+    """スパイクと水準シフトを検知することを確認"""
+    engine = AnomalyEngine()
+    found = []
+    for i, value in enumerate(_series()):
+        for anomaly in engine.ingest({"bpm": float(value), "device_id": "esp32"}):
+            found.append((i, anomaly["kind"]))
+    assert (150, "spike") in found
+    assert any(kind == "drift_up" and 250 <= i < 270 for i, kind in found)
+    print(f"✅ detected: {found[:6]}")
+
+
+def test_outliers_and_acceleration():
+    """加速度ベクトルから大きさを求め、外れ値判定が状態を変えないことを確認"""
+    engine = AnomalyEngine()
+    rng = np.random.default_rng(1)
+    for z in rng.normal(9.8, 0.2, 50):
+        engine.ingest({"acceleration": {"x": 0.0, "y": 0.0, "z": float(z)}, "device_id": "w"})
+    detector = engine.detector("w", "acceleration_magnitude")
+    before = detector.samples
+    outliers = engine.outliers({"acceleration": {"x": 0.0, "y": 0.0, "z": 30.0}, "device_id": "w"})
+    assert outliers and outliers[0][0] == "acceleration_magnitude"
+    assert detector.samples == before
+
+    # 取り込み済みのサンプルは窓に加える前の z スコアで判定する（ウォームアップ直後のスパイクも検知する）
+    engine = AnomalyEngine()
+    for bpm in (30.0, 31.0) * 5:
+        engine.ingest({"bpm": bpm, "device_id": "esp32"})
+    assert engine.ingest({"bpm": 60.0, "device_id": "esp32"})[0]["kind"] == "spike"
+    spike = engine.outliers({"bpm": 60.0, "device_id": "esp32"})
+    assert spike and spike[0][0] == "bpm" and spike[0][2] > 4.0
+    print(f"✅ outliers: {outliers}")
+
+
+def test_ingest_throughput():
+    """複数デバイスで毎秒数千サンプル以上を処理できることを確認"""
+    engine = AnomalyEngine()
+    rng = np.random.default_rng(2)
+    messages = [{"bpm": float(v), "device_id": f"d{i % 50}"} for i, v in enumerate(rng.normal(10, 1, 20000))]
+    start = time.perf_counter()
+    for message in messages:
+        engine.ingest(message)
+    rate = len(messages) / (time.perf_counter() - start)
+    assert rate > 5000, f"{rate:.0f} samples/sec"
+    print(f"✅ throughput: {rate:,.0f} samples/sec")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Batch matches streaming", test_batch_matches_streaming),
+        ("Detects spike and drift", test_detects_spike_and_drift),
+        ("Outliers and acceleration", test_outliers_and_acceleration),
+        ("Ingest throughput", test_ingest_throughput),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
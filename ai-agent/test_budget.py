@@ -0,0 +1,169 @@
+"""budget.py（ノードごとの予算）と dev_graph._invoke_agent の予算切れ処理のユニットテスト"""
+import asyncio
+import sys
+import tempfile
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from langchain_core.messages import AIMessage, ToolMessage
+
+from agent import budget, dev_graph
+
+
+def _tool_call(i: int, usage: int = 100) -> AIMessage:
+    return AIMessage(
+        content=f"調査中 {i}",
+        tool_calls=[{"name": "read_file", "args": {"path": "a.txt"}, "id": f"call_{i}"}],
+        usage_metadata={"input_tokens": usage, "output_tokens": 10, "total_tokens": usage + 10},
+    )
+
+
+class _FakeToolNode:
+    """ツール呼び出しごとに "A" を返す ToolNode（グラフ外では ToolNode を直接実行できないため）"""
+
+    def __init__(self, tools):
+        pass
+
+    async def ainvoke(self, state):
+        return {"messages": [
+            ToolMessage(content="A", tool_call_id=call["id"]) for call in state["messages"][-1].tool_calls
+        ]}
+
+
+def _run(responses, limits: budget.Limits):
+    """LLM の応答を responses の順に返しつつ _invoke_agent を実行し、(戻り値, 予算, 各呼び出しのメッセージ) を返す"""
+    calls = []
+
+    async def fake_ainvoke_hedged(llm, messages, **kwargs):
+        calls.append(list(messages))
+        response = responses[len(calls) - 1]
+        if isinstance(response, float):
+            await asyncio.sleep(response)
+            return AIMessage(content="遅すぎた応答")
+        return response
+
+    node_budget = budget.Budget("coder", "haiku", limits)
+    with patch.object(dev_graph, "_get_llm", MagicMock()), \
+            patch.object(dev_graph, "ToolNode", _FakeToolNode), \
+            patch.object(dev_graph.llm_gateway, "ainvoke_hedged", fake_ainvoke_hedged):
+        result = asyncio.run(dev_graph._invoke_agent("タスク", "haiku", node_budget))
+    return result, node_budget, calls
+
+
+def test_budget_accounting():
+    """応答のトークンとツール呼び出し回数を積算し、使い切った項目を判定することを確認"""
+    node_budget = budget.Budget("reviewer", "sonnet", budget.Limits(60, 1000, 100, 10))
+    node_budget.charge(_tool_call(0, usage=400))
+    node_budget.charge(AIMessage(content="usage なし"))
+    node_budget.charge_tools(2)
+    assert (node_budget.input_tokens, node_budget.output_tokens, node_budget.tool_calls) == (400, 10, 2)
+    assert node_budget.check() == "" and "残りわずか" not in node_budget.remaining_note()
+    node_budget.charge_tools(7)
+    assert node_budget.check() == "" and node_budget.remaining_tool_calls() == 1
+    assert "ツール呼び出し 1 回" in node_budget.remaining_note() and "残りわずか" in node_budget.remaining_note()
+    node_budget.charge(_tool_call(1, usage=700))
+    assert node_budget.check() == "input_tokens"
+    node_budget.finish()
+    snapshot = node_budget.snapshot()
+    assert snapshot["node"] == "reviewer" and snapshot["llm_calls"] == 3 and snapshot["exhausted"] == "input_tokens"
+    assert snapshot["limits"]["tool_calls"] == 10 and snapshot["seconds"] == node_budget.snapshot()["seconds"]
+
+    assert budget.limits_for("coder", "opus").tool_calls > budget.limits_for("reviewer", "haiku").tool_calls
+    assert budget.limits_for("coder", "haiku-3") == budget.limits_for("coder", "haiku")
+    print("✅ budget accounting")
+
+
+def test_finishes_without_exhausting():
+    """予算内で応答が返れば、ツールの結果に残り予算を添えつつそのまま返すことを確認"""
+    final = AIMessage(content="完了しました")
+    result, node_budget, calls = _run([_tool_call(0), final], budget.Limits(60, 10_000, 1_000, 5))
+    assert result == "完了しました" and node_budget.exhausted == ""
+    assert "【残り予算】" in calls[0][0].content
+    tool_message = calls[1][-1]
+    assert isinstance(tool_message, ToolMessage) and tool_message.content.startswith("A\n\n【残り予算】")
+    assert "ツール呼び出し 4 回" in tool_message.content
+    print("✅ finishes without exhausting")
+
+
+def test_tool_call_budget_wraps_up():
+    """ツール呼び出しの予算を使い切るとツールなしのまとめの応答を1回求めることを確認"""
+    responses = [_tool_call(0), _tool_call(1), AIMessage(content="<review_result>まとめ</review_result>")]
+    result, node_budget, calls = _run(responses, budget.Limits(60, 10_000, 1_000, 2))
+    assert result == "<review_result>まとめ</review_result>"
+    assert node_budget.exhausted == "tool_calls" and node_budget.tool_calls == 2 and node_budget.llm_calls == 3
+    assert "【予算切れ（ツール呼び出し）】" in calls[2][-1].content
+
+    # 残りを超えるツール呼び出しは実行せず、結果だけ返してまとめに入る
+    over = AIMessage(content="", tool_calls=[
+        {"name": "read_file", "args": {"path": "a.txt"}, "id": f"over_{i}"} for i in range(3)
+    ])
+    result, node_budget, calls = _run([over, AIMessage(content="まとめ")], budget.Limits(60, 10_000, 1_000, 2))
+    assert result == "まとめ" and node_budget.tool_calls == 0 and node_budget.exhausted == "tool_calls"
+    skipped = [m for m in calls[1] if isinstance(m, ToolMessage)]
+    assert len(skipped) == 3 and skipped[0].content.startswith("予算切れのため実行しませんでした。")
+    print("✅ tool call budget wraps up")
+
+
+def test_token_and_time_budget():
+    """トークンを使い切った場合はまとめを求め、時間切れの LLM 呼び出しは打ち切ることを確認"""
+    responses = [_tool_call(0, usage=6000), AIMessage(content="途中までの結果")]
+    result, node_budget, calls = _run(responses, budget.Limits(60, 5000, 1_000, 10))
+    assert result == "途中までの結果" and node_budget.exhausted == "input_tokens"
+    assert "【予算切れ（入力トークン）】" in calls[1][-1].content
+
+    result, node_budget, calls = _run([1.0], budget.Limits(0.2, 10_000, 1_000, 10))
+    assert result == "" and node_budget.exhausted == "seconds" and len(calls) == 1
+    assert node_budget.snapshot()["seconds"] < 1.0
+
+    # ツール実行後に時間切れになった場合はまとめを求め、それも返らなければそれまでの応答の本文を返す
+    responses = [_tool_call(0), 1.0, AIMessage(content="時間切れのまとめ")]
+    result, node_budget, calls = _run(responses, budget.Limits(0.2, 10_000, 1_000, 10))
+    assert result == "時間切れのまとめ" and node_budget.exhausted == "seconds"
+    assert "【予算切れ（時間）】" in calls[2][-1].content
+    with patch.object(dev_graph, "_WRAP_UP_SECONDS", 0.1):
+        result, node_budget, calls = _run([_tool_call(0), 1.0, 1.0], budget.Limits(0.2, 10_000, 1_000, 10))
+    assert result == "調査中 0" and len(calls) == 3
+    print("✅ token and time budget")
+
+
+def test_budget_in_task_status():
+    """reviewer の task_status イベントに coder / reviewer の予算の使用量が入ることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        state = {
+            "current_task": "タスク",
+            "workspace_root": tmp,
+            "current_write_files": [],
+            "task_index": 0,
+            "revision_count": 0,
+            "task_budget": {"coder": {"node": "coder", "tool_calls": 3}},
+        }
+        response = '<review_result>{"result": "PASS", "needs_revision": false, "comment": "ok"}</review_result>'
+        events = AsyncMock()
+        with patch.object(dev_graph, "_invoke_agent", AsyncMock(return_value=response)), \
+                patch.object(dev_graph, "broadcast", events), \
+                patch.object(dev_graph.session_tracker, "task_completed"):
+            result = asyncio.run(dev_graph.reviewer_node(state))
+    statuses = [call.args[0] for call in events.call_args_list if call.args[0].get("type") == "task_status"]
+    assert statuses[0]["status"] == "reviewing" and statuses[0]["budget"] == {"coder": {"node": "coder", "tool_calls": 3}}
+    assert statuses[-1]["status"] == "done" and set(statuses[-1]["budget"]) == {"coder", "reviewer"}
+    assert statuses[-1]["budget"]["reviewer"]["node"] == "reviewer"
+    assert result["task_budget"] == statuses[-1]["budget"]
+    print("✅ budget in task_status")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Budget accounting", test_budget_accounting),
+        ("Finishes without exhausting", test_finishes_without_exhausting),
+        ("Tool call budget wraps up", test_tool_call_budget_wraps_up),
+        ("Token and time budget", test_token_and_time_budget),
+        ("Budget in task_status", test_budget_in_task_status),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
@@ -0,0 +1,118 @@
+"""cadence.py のユニットテスト"""
+import sys
+import time
+
+import numpy as np
+
+from agent.cadence import CadenceTracker
+from agent.history import format_timestamp
+
+_BASE = 1_772_000_000.0
+
+
+def _steps(freq_hz: float, rate: float = 50.0, seconds: float = 2.0, start: float = 0.0, seed: int = 0) -> list[float]:
+    rng = np.random.default_rng(seed)
+    t = start + np.arange(int(rate * seconds)) / rate
+    return list(15.0 + 8.0 * np.sin(2 * np.pi * freq_hz * t) + rng.normal(0, 1.0, len(t)))
+
+
+def test_cadence_from_batched_samples():
+    """高頻度サンプル列から走行・歩行のケイデンスを推定することを確認"""
+    for freq, expected in ((2.8, "Run"), (1.8, "Walk")):
+        tracker = CadenceTracker()
+        metrics = None
+        for i in range(4):
+            message = {
+                "device_id": "esp32",
+                "samples": _steps(freq, start=i * 2.0, seed=i),
+                "sample_rate": 50,
+                "timestamp": format_timestamp(_BASE + (i + 1) * 2.0),
+            }
+            metrics = tracker.ingest(message)
+        assert abs(metrics["cadence_spm"] - freq * 60) < 6, metrics
+        assert metrics["activity"] == expected, metrics
+        print(f"✅ {freq} Hz → {metrics['cadence_spm']} spm ({metrics['activity']})")
+
+
+def test_level_hysteresis_without_cadence():
+    """5秒ごとの平均値のみの場合、閾値付近でステータスがばたつかないことを確認"""
+    tracker = CadenceTracker()
+    levels = [10, 25, 32, 29, 31, 29.5, 28.5, 27, 21, 19, 17]
+    activities = []
+    for i, level in enumerate(levels):
+        message = {"device_id": "esp32", "bpm": level, "status": "x", "timestamp": format_timestamp(_BASE + i * 5)}
+        metrics = tracker.ingest(message)
+        assert metrics["cadence_spm"] is None
+        activities.append(metrics["activity"])
+    assert activities == ["None", "Walk", "Run", "Run", "Run", "Run", "Run", "Walk", "Walk", "Walk", "None"]
+    assert tracker.ingest({"device_id": "esp32", "status": "Run"}) is None
+    print(f"✅ {activities}")
+
+
+def test_many_devices_throughput():
+    """数百デバイスの 5 秒ごとの送信を 1 コアで十分に処理できることを確認"""
+    tracker = CadenceTracker()
+    rng = np.random.default_rng(1)
+    devices = 300
+    messages = [
+        {"device_id": f"d{d}", "bpm": float(v), "timestamp": format_timestamp(_BASE + step * 5)}
+        for step in range(100)
+        for d, v in zip(range(devices), rng.normal(20, 5, devices))
+    ]
+    start = time.perf_counter()
+    for message in messages:
+        tracker.ingest(message)
+    rate = len(messages) / (time.perf_counter() - start)
+    # 300 デバイス × 0.2 Hz = 60 メッセージ/秒
+    assert rate > 600, f"{rate:.0f} messages/sec"
+    print(f"✅ throughput: {rate:,.0f} messages/sec")
+
+
+def test_incremental_statistics():
+    """差分で更新した level・variability が窓から直接求めた値と一致することを確認"""
+    tracker = CadenceTracker(window=64)
+    rng = np.random.default_rng(2)
+    values = rng.normal(20, 5, 300)
+    for i, value in enumerate(values):
+        metrics = tracker.ingest({"device_id": "esp32", "bpm": float(value), "timestamp": format_timestamp(_BASE + i * 0.5)})
+        window = values[max(0, i - 63):i + 1]
+        assert abs(metrics["intensity"]["variability"] - round(float(window.std()), 3)) < 2e-3, i
+        if i >= 64:
+            # 2Hz では直近 10 件（5秒分）の平均
+            assert abs(metrics["intensity"]["level"] - round(float(values[i - 9:i + 1].mean()), 3)) < 2e-3, i
+    print("✅ incremental statistics")
+
+
+def test_batch_skips_non_numeric_samples():
+    """サンプル列に数値でない値が混ざっていても例外にせず、数値だけを取り込むことを確認"""
+    tracker = CadenceTracker()
+    message = {
+        "device_id": "esp32",
+        "samples": [10.0, "x", None, True, float("nan"), 12.0],
+        "sample_rate": 50,
+        "timestamp": format_timestamp(_BASE),
+    }
+    metrics = tracker.ingest(message)
+    assert metrics["intensity"]["level"] == 11.0
+    assert tracker.ingest({"device_id": "esp32", "samples": ["x"], "sample_rate": 50}) is None
+    assert tracker.ingest({"device_id": "esp32", "samples": [1.0], "sample_rate": "fast"}) is None
+    print("✅ batch skips non-numeric samples")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Cadence from batched samples", test_cadence_from_batched_samples),
+        ("Level hysteresis without cadence", test_level_hysteresis_without_cadence),
+        ("Many devices throughput", test_many_devices_throughput),
+        ("Incremental statistics", test_incremental_statistics),
+        ("Batch skips non-numeric samples", test_batch_skips_non_numeric_samples),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
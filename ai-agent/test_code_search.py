@@ -0,0 +1,95 @@
+"""code_search.py と search_code のユニットテスト"""
+import os
+import sys
+import tempfile
+import time
+
+from agent import code_search, tools
+from agent.code_search import CodeSearchIndex, _required_literals
+
+
+def _touch(root: str, rel: str, content: str) -> None:
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def test_required_literals():
+    """正規表現から必須のリテラル部分を取り出すことを確認"""
+    assert _required_literals(r"async def (\w+)_node", 0) == ["async def ", "_node"]
+    assert _required_literals(r"(?:set)_iot\.status", 0) == ["set_iot.status"]
+    assert _required_literals(r"foo|bar", 0) == []
+    print("✅ required literals")
+
+
+def test_literal_and_regex_search():
+    """リテラル・正規表現・大文字小文字無視・パス絞り込み・前後の行を確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _touch(tmp, "src/a.py", "import os\n\ndef set_status(x):\n    return x\n")
+        _touch(tmp, "src/b.ts", "export function setStatus(x) {\n  return x;\n}\n")
+        _touch(tmp, "node_modules/c.js", "function set_status() {}\n")
+        _touch(tmp, ".gitignore", "node_modules/\n")
+        index = CodeSearchIndex(tmp)
+
+        result = index.search("set_status")
+        assert [(h["path"], h["line"]) for h in result["hits"]] == [("src/a.py", 3)]
+        assert result["hits"][0]["before"] == [""] and result["hits"][0]["after"] == ["    return x"]
+
+        result = index.search(r"set_?status\(", regex=True, ignore_case=True)
+        assert [h["path"] for h in result["hits"]] == ["src/a.py", "src/b.ts"]
+
+        result = index.search("return", path_pattern="*.ts", context=0)
+        assert [(h["path"], h["line"]) for h in result["hits"]] == [("src/b.ts", 2)]
+        assert index.search("no_such_symbol")["files_scanned"] == 0
+    print("✅ literal and regex search")
+
+
+def test_tool_output_and_invalidation():
+    """search_code の出力形式と上限、write_file の結果がすぐ検索できることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        lines = "".join(f"value_{i} = {i}\n" for i in range(100))
+        _touch(tmp, "big.py", lines)
+        tools.set_workspace_root(tmp)
+        output = tools.search_code.invoke({"query": "value_", "context": 0, "max_results": 5})
+        assert output.splitlines()[0] == "big.py:1: value_0 = 0"
+        assert output.endswith("[100件中 5件を表示]")
+
+        assert tools.search_code.invoke({"query": "brand_new_symbol"}) == "（一致なし）"
+        tools.write_file.invoke({"path": "new.py", "content": "def brand_new_symbol():\n    pass\n"})
+        assert tools.search_code.invoke({"query": "brand_new_symbol", "context": 0}) == "new.py:1: def brand_new_symbol():"
+        assert tools.search_code.invoke({"query": "(", "regex": True}).startswith("エラー")
+    print("✅ tool output")
+
+
+def test_query_latency():
+    """数千ファイルのワークスペースでも検索がミリ秒オーダーで返ることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(2000):
+            _touch(tmp, f"pkg{i % 20}/mod_{i}.py", f"def handler_{i}(event):\n    return process_{i}(event)\n" * 20)
+        index = CodeSearchIndex(tmp)
+        index.search("warmup")
+        start = time.perf_counter()
+        result = index.search("process_1234(")
+        elapsed = time.perf_counter() - start
+        assert result["files_scanned"] <= 5 and result["total"] == 20
+        assert elapsed < 0.05, f"{elapsed * 1000:.1f} ms"
+    print(f"✅ query latency: {elapsed * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Required literals", test_required_literals),
+        ("Literal and regex search", test_literal_and_regex_search),
+        ("Tool output and invalidation", test_tool_output_and_invalidation),
+        ("Query latency", test_query_latency),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
@@ -0,0 +1,100 @@
+"""coder のプロンプトへのファイル先読み（dev_graph._prefetch_files）のユニットテスト"""
+import asyncio
+import os
+import sys
+import tempfile
+from unittest.mock import AsyncMock, patch
+
+from agent import dev_graph
+
+
+def _touch(root: str, rel: str, content: str) -> None:
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def test_prefetch_files():
+    """planner が挙げたファイルの内容を埋め込み、存在しないファイルは名前だけ挙げることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _touch(tmp, "src/a.py", "A = 1\n")
+        _touch(tmp, "src/b.py", "B = 2")
+        block = asyncio.run(dev_graph._prefetch_files(
+            tmp, ["src/a.py", "./src/a.py", "src/b.py", "src/new.py", "src", "../outside.py"]
+        ))
+        assert '<file path="src/a.py" lines="1">\nA = 1\n</file>' in block
+        assert '<file path="src/b.py" lines="1">\nB = 2\n</file>' in block
+        assert block.count('<file path="src/a.py"') == 1
+        assert "まだ存在しないファイル" in block and "'src/new.py'" in block and "'../outside.py'" in block
+        assert asyncio.run(dev_graph._prefetch_files(tmp, [])) == ""
+
+        # テキストでないファイルは埋め込まずに名前だけ挙げる
+        with open(os.path.join(tmp, "logo.png"), "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n\xff\xfe\x00\x80")
+        block = asyncio.run(dev_graph._prefetch_files(tmp, ["src/a.py", "logo.png"]))
+        assert '<file path="src/a.py"' in block and '<file path="logo.png"' not in block
+        assert "テキストでないため埋め込まなかったファイル】\n['logo.png']" in block
+    print("✅ prefetch files")
+
+
+def test_prefetch_limits():
+    """1件あたり・全体の上限を超える分は行単位で切り詰め、続きの読み方を注記することを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _touch(tmp, "big.py", "".join(f"value_{i:05d} = {i:05d}\n" for i in range(2000)))   # 1 行 20 文字
+        _touch(tmp, "small.py", "S = 1\n")
+        with patch.object(dev_graph, "_PREFETCH_FILE_CHARS", 1000), patch.object(dev_graph, "_PREFETCH_TOTAL_CHARS", 1500):
+            block = asyncio.run(dev_graph._prefetch_files(tmp, ["big.py", "small.py", "big_too.py"]))
+            _touch(tmp, "other.py", "x" * 600)
+            _touch(tmp, "more.py", "y = 1\n")
+            capped = asyncio.run(dev_graph._prefetch_files(tmp, ["big.py", "other.py", "more.py"]))
+        assert "value_00049 = 00049\n…（51 行目以降の 1950 行は省略。続きは read_file_lines で読んでください）" in block
+        assert "value_00050" not in block
+        assert '<file path="small.py" lines="1">\nS = 1\n</file>' in block
+        # big.py で 1000 文字使い、1 行 600 文字の other.py は残り 500 文字に収まらないので名前だけ挙げる
+        assert '<file path="other.py"' not in capped
+        assert "容量の上限で埋め込まなかったファイル（必要なら read_file_lines で読む）】\n['other.py']" in capped
+        assert '<file path="more.py" lines="1">\ny = 1\n</file>' in capped
+    print("✅ prefetch limits")
+
+
+def test_coder_prompt_embeds_files():
+    """coder のプロンプトに planner が挙げたファイルの内容が入ることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _touch(tmp, "app/config.py", "TIMEOUT = 30\n")
+        _touch(tmp, "app/main.py", "from app.config import TIMEOUT\n")
+        state = {
+            "current_task": "TIMEOUT を 60 にする",
+            "workspace_root": tmp,
+            "current_read_files": ["app/main.py"],
+            "current_write_files": ["app/config.py"],
+            "task_index": 0,
+            "revision_count": 0,
+            "model_tier": "haiku",
+        }
+        with patch.object(dev_graph, "_invoke_agent", AsyncMock(return_value="done")) as invoke, \
+                patch.object(dev_graph, "_enter_task_workspace", AsyncMock(return_value="")), \
+                patch.object(dev_graph, "broadcast", AsyncMock()):
+            asyncio.run(dev_graph.coder_node(state))
+        prompt = invoke.call_args[0][0]
+        assert '<file path="app/main.py" lines="1">\nfrom app.config import TIMEOUT\n</file>' in prompt
+        assert '<file path="app/config.py" lines="1">\nTIMEOUT = 30\n</file>' in prompt
+        assert "埋め込み済みのファイルはそのまま使い" in prompt
+    print("✅ coder prompt embeds files")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Prefetch files", test_prefetch_files),
+        ("Prefetch limits", test_prefetch_limits),
+        ("Coder prompt embeds files", test_coder_prompt_embeds_files),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
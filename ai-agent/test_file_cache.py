@@ -0,0 +1,120 @@
+"""file_cache.py とファイル読み込みツールのユニットテスト"""
+import os
+import sys
+import tempfile
+
+from agent import file_cache, tools
+from agent.file_cache import FileCache
+
+
+def _write(path: str, content: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def test_hits_and_stat_invalidation():
+    """2回目以降はキャッシュから返し、内容が変わったら読み直すことを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "a.py")
+        _write(path, "print('a')\n")
+        cache = FileCache()
+        assert cache.read_text(path) == "print('a')\n"
+        assert cache.read_text(path) == "print('a')\n"
+        assert cache.hits == 1 and cache.bytes_saved == 11
+
+        _write(path, "print('changed')\n")
+        assert cache.read_text(path) == "print('changed')\n"
+        assert cache.misses == 2
+        assert cache.stats()["hit_rate"] == round(1 / 3, 3)
+    print(f"✅ stats: {cache.stats()}")
+
+
+def test_byte_budget_eviction():
+    """合計バイト数の上限を超えると古いエントリから捨てることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = FileCache(max_bytes=250)
+        paths = []
+        for i in range(3):
+            paths.append(os.path.join(tmp, f"{i}.txt"))
+            _write(paths[-1], str(i) * 100)
+        cache.read_text(paths[0])
+        cache.read_text(paths[1])
+        cache.read_text(paths[0])  # 0 を最近使ったことにする
+        cache.read_text(paths[2])  # 1 が追い出される
+        assert cache.stats()["bytes"] == 200 and cache.evictions == 1
+        cache.read_text(paths[0])
+        assert cache.hits == 2
+        cache.read_text(paths[1])
+        assert cache.misses == 4
+    print("✅ eviction")
+
+
+def test_large_file_via_mmap_and_newlines():
+    """mmap 経由の読み込みと改行の正規化が open() と同じ結果になることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "big.log")
+        with open(path, "wb") as f:
+            f.write("ログ行\r\n".encode("utf-8") * 200_000)
+        with open(path, encoding="utf-8") as f:
+            expected = f.read()
+        assert os.path.getsize(path) >= file_cache._MMAP_THRESHOLD
+        assert FileCache().read_text(path) == expected
+    print("✅ mmap read")
+
+
+def test_write_file_invalidates():
+    """write_file で書き込んだ内容が read_file / read_file_lines にすぐ反映されることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        tools.set_workspace_root(tmp)
+        tools.write_file.invoke({"path": "src/m.py", "content": "a\nb\nc\n"})
+        assert tools.read_file.invoke({"path": "src/m.py"}) == "a\nb\nc\n"
+        tools.write_file.invoke({"path": "src/m.py", "content": "x\ny\n"})
+        assert tools.read_file.invoke({"path": "src/m.py"}) == "x\ny\n"
+        result = tools.read_file_lines.invoke({"path": "src/m.py", "start_line": 2, "end_line": 5})
+        assert result == "[src/m.py 行 2〜2 / 全2行]\ny\n"
+    print("✅ write_file invalidates")
+
+
+def test_ranged_reads_match_readlines():
+    """行オフセット索引による範囲読み込みが readlines() のスライスと一致することを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "device.log")
+        with open(path, "wb") as f:
+            for i in range(50_000):
+                f.write(f"[{i:05d}] センサー値 {i * 0.1:.1f}\r\n".encode("utf-8"))
+            f.write(b"last line without newline")
+        with open(path, encoding="utf-8") as f:
+            expected = f.readlines()
+
+        cache = FileCache()
+        for start, end in ((0, 3), (25_000, 25_010), (49_998, 60_000), (70_000, 70_010)):
+            text, total = cache.read_lines(path, start, end)
+            assert total == len(expected)
+            assert text == "".join(expected[start:end]), (start, end)
+        assert cache.stats()["line_indexes"] == 1
+
+        tools.set_workspace_root(tmp)
+        result = tools.tail_file.invoke({"path": "device.log", "lines": 2})
+        assert result == "[device.log 行 50000〜50001 / 全50001行]\n" + "".join(expected[-2:])
+        result = tools.read_file_lines.invoke({"path": "device.log", "start_line": 1, "end_line": 1})
+        assert result == "[device.log 行 1〜1 / 全50001行]\n" + expected[0]
+    print("✅ ranged reads")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Hits and stat invalidation", test_hits_and_stat_invalidation),
+        ("Byte budget eviction", test_byte_budget_eviction),
+        ("Large file via mmap", test_large_file_via_mmap_and_newlines),
+        ("write_file invalidates", test_write_file_invalidates),
+        ("Ranged reads match readlines", test_ranged_reads_match_readlines),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
@@ -0,0 +1,137 @@
+"""file_index.py と list_files のユニットテスト"""
+import os
+import sys
+import tempfile
+
+from agent import code_search, file_index, impact, repo_map, retrieval, tools
+from agent.file_index import FileIndex
+
+
+def _touch(root: str, rel: str, content: str = "") -> None:
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def _workspace(root: str) -> None:
+    _touch(root, ".gitignore", "node_modules/\n*.log\n/build\n!keep.log\n")
+    _touch(root, "src/app.py")
+    _touch(root, "src/util/helpers.py")
+    _touch(root, "src/build/gen.py")           # /build はルート直下のみに一致
+    _touch(root, "build/out.bin")
+    _touch(root, "node_modules/pkg/index.js")
+    _touch(root, "logs/run.log")
+    _touch(root, "logs/keep.log")
+    _touch(root, "firmware/.gitignore", ".pio\nsecrets.h\n")
+    _touch(root, "firmware/src/main.cpp")
+    _touch(root, "firmware/src/secrets.h")
+    _touch(root, "src/__pycache__/app.cpython-311.pyc")
+
+
+def test_gitignore_rules():
+    """ネストした .gitignore・否定・ディレクトリ指定・ルート固定のパターンを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _workspace(tmp)
+        paths = FileIndex(tmp).paths()
+        assert paths == [
+            "firmware/src/main.cpp",
+            "logs/keep.log",
+            "src/app.py",
+            "src/build/gen.py",
+            "src/util/helpers.py",
+        ], paths
+    print("✅ gitignore rules")
+
+
+def test_incremental_refresh():
+    """変更のあったディレクトリだけを読み直し、write_file の結果がすぐ反映されることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _workspace(tmp)
+        tools.set_workspace_root(tmp)
+        index = file_index.get_index(tmp)
+        index.paths()
+        scans = index.scans
+
+        # 間隔内の問い合わせではファイルシステムを確認しない
+        index.paths()
+        assert index.scans == scans
+
+        tools.write_file.invoke({"path": "src/util/new_mod.py", "content": "x = 1\n"})
+        assert "util/new_mod.py" in tools.list_files.invoke({"directory": "src"}).splitlines()
+        # 読み直したのは変更のあったディレクトリのみ
+        assert index.scans == scans + 1
+
+        os.remove(os.path.join(tmp, "src/util/helpers.py"))
+        index.invalidate()
+        assert "src/util/helpers.py" not in index.paths()
+    print("✅ incremental refresh")
+
+
+def test_shared_changes():
+    """code_search / retrieval / repo_map / impact が1回の stat で変更・削除されたファイルだけを受け取ることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _workspace(tmp)
+        tools.set_workspace_root(tmp)
+        index = file_index.get_index(tmp)
+        search = code_search.get_index(tmp)
+        search.search("helpers")
+        retrieval.get_index(tmp).search("app")
+        repo_map.get_map(tmp).symbols()
+        impact.get_graph(tmp).all_tests()
+        assert index.stat_passes == 1
+        version, changed, removed = index.changes(0)
+        assert "src/app.py" in changed and removed == []
+        assert index.changes(version) == (version, {}, [])
+
+        indexed = search.indexed
+        tools.write_file.invoke({"path": "src/app.py", "content": "def renamed():\n    pass\n"})
+        os.remove(os.path.join(tmp, "src/util/helpers.py"))
+        index.invalidate()
+        assert search.search("renamed")["total"] == 1
+        assert search.indexed == indexed + 1   # 変更したファイルだけを索引し直す
+        assert retrieval.get_index(tmp).search("renamed")[0][0] == "src/app.py"
+        assert repo_map.get_map(tmp).symbols()["src/app.py"] == ["def renamed()"]
+        assert "src/util/helpers.py" not in repo_map.get_map(tmp).symbols()
+        impact.get_graph(tmp).all_tests()
+        assert index.stat_passes == 2   # 4つの索引で stat は1回だけ
+        assert index.changes(version)[1:] == ({"src/app.py": len("def renamed():\n    pass\n")}, ["src/util/helpers.py"])
+    print("✅ shared changes")
+
+
+def test_list_files_filters_and_paging():
+    """glob / 拡張子 / 階層 / ページングの絞り込みを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _workspace(tmp)
+        tools.set_workspace_root(tmp)
+        assert tools.list_files.invoke({"pattern": "*.py"}).splitlines() == [
+            "src/app.py", "src/build/gen.py", "src/util/helpers.py",
+        ]
+        assert tools.list_files.invoke({"pattern": "src/*.py"}) == "src/app.py"
+        assert tools.list_files.invoke({"extensions": ["cpp"]}) == "firmware/src/main.cpp"
+        assert tools.list_files.invoke({"directory": "src", "max_depth": 0}).splitlines() == [
+            "app.py", "build/ (1 files)", "util/ (1 files)",
+        ]
+        page = tools.list_files.invoke({"limit": 2, "offset": 2}).splitlines()
+        assert page == ["src/app.py", "src/build/gen.py", "[全5件中 3〜4件。続きは offset=4]"]
+        # 除外されたディレクトリも明示的に指定すれば一覧できる
+        assert tools.list_files.invoke({"directory": "node_modules"}) == "pkg/index.js"
+    print("✅ filters and paging")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("gitignore rules", test_gitignore_rules),
+        ("Incremental refresh", test_incremental_refresh),
+        ("Shared changes", test_shared_changes),
+        ("list_files filters and paging", test_list_files_filters_and_paging),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
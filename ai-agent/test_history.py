@@ -0,0 +1,99 @@
+"""history.py のユニットテスト"""
+import sys
+
+from agent.history import SensorHistory, SensorRingBuffer, parse_timestamp
+
+
+def _motion(i: int, device_id: str = "esp32") -> dict:
+    return {
+        "status": "Run" if i % 2 else "Walk",
+        "bpm": 10.0 + i,
+        "timestamp": f"2026-02-28T10:00:{i:02d}Z",
+        "device_id": device_id,
+    }
+
+
+def test_roundtrip_preserves_record():
+    """保存したレコードが型を保ったまま復元されることを確認"""
+    buf = SensorRingBuffer(4)
+    record = {"status": "Run", "bpm": 12, "is_running": True, "device_id": "d",
+              "timestamp": "2026-02-28T10:00:00Z", "extra": {"x": 1}}
+    buf.append(record, parse_timestamp(record["timestamp"]))
+    restored = buf.latest(1)[0].to_dict()
+    assert restored == record
+    assert isinstance(restored["bpm"], int)
+    assert restored["is_running"] is True
+    print(f"✅ roundtrip: {restored}")
+
+
+def test_capacity_is_bounded():
+    """容量を超えると最古のサンプルから上書きされることを確認"""
+    history = SensorHistory(capacity=5)
+    for i in range(12):
+        history.append("motion", _motion(i))
+    buf = history.buffer("motion", "esp32")
+    assert len(buf) == 5
+    assert history.total("motion") == 12
+    assert [r["bpm"] for r in history.latest("motion", 10)] == [17.0, 18.0, 19.0, 20.0, 21.0]
+    print("✅ capacity bounded")
+
+
+def test_time_range_lookup():
+    """時刻範囲検索がラップアラウンド後も正しい範囲を返すことを確認"""
+    history = SensorHistory(capacity=8)
+    for i in range(20):
+        history.append("motion", _motion(i))
+    since = parse_timestamp("2026-02-28T10:00:14Z")
+    until = parse_timestamp("2026-02-28T10:00:17Z")
+    records = history.range("motion", since, until)
+    assert [r["timestamp"][-3:-1] for r in records] == ["14", "15", "16", "17"]
+    assert history.range("motion", until=parse_timestamp("2026-02-28T10:00:05Z")) == []
+    print("✅ time range lookup")
+
+
+def test_multiple_devices_are_merged():
+    """デバイス別に保持し、device_id 省略時は時刻順にマージされることを確認"""
+    history = SensorHistory(capacity=10)
+    for i in range(0, 6, 2):
+        history.append("motion", _motion(i, "a"))
+        history.append("motion", _motion(i + 1, "b"))
+    assert sorted(history.device_ids("motion")) == ["a", "b"]
+    assert [r["device_id"] for r in history.latest("motion", 4)] == ["a", "b", "a", "b"]
+    assert len(history.latest("motion", 10, device_id="a")) == 3
+    print("✅ devices merged")
+
+
+def test_out_of_order_keeps_timestamp():
+    """順序の乱れたサンプル・タイムスタンプのないサンプルがあっても、元のタイムスタンプで返ることを確認"""
+    history = SensorHistory(capacity=8)
+    history.append("motion", _motion(5))
+    history.append("motion", _motion(0))   # 5秒前のサンプルが遅れて届く
+    history.append("motion", {"status": "Run", "bpm": 1.0, "device_id": "esp32"})
+    history.append("motion", _motion(6))
+    records = history.latest("motion", 10)
+    assert [r.get("timestamp") for r in records] == [
+        "2026-02-28T10:00:05Z", "2026-02-28T10:00:00Z", None, "2026-02-28T10:00:06Z",
+    ]
+    # タイムスタンプのないサンプルでデバイスの時刻が現在時刻まで進まない
+    since = parse_timestamp("2026-02-28T10:00:06Z")
+    assert [r["bpm"] for r in history.range("motion", since, since)] == [16.0]
+    print("✅ out of order keeps timestamp")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Roundtrip", test_roundtrip_preserves_record),
+        ("Capacity bounded", test_capacity_is_bounded),
+        ("Time range lookup", test_time_range_lookup),
+        ("Multiple devices", test_multiple_devices_are_merged),
+        ("Out of order keeps timestamp", test_out_of_order_keeps_timestamp),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
@@ -0,0 +1,120 @@
+"""impact.py（変更の影響を受けるテストの選択）のユニットテスト"""
+import asyncio
+import os
+import sys
+import tempfile
+from unittest.mock import patch
+
+from agent import impact, tools, warm_runner
+
+
+def _touch(root: str, rel: str, content: str) -> None:
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def _project(root: str) -> None:
+    _touch(root, "app/pyproject.toml", "[project]\nname = 'sample'\n")
+    _touch(root, "app/pkg/__init__.py", "")
+    _touch(root, "app/pkg/core.py", "VALUE = 1\n")
+    _touch(root, "app/pkg/util.py", "from .core import VALUE\n\ndef double():\n    return VALUE * 2\n")
+    _touch(root, "app/pkg/other.py", "NAME = 'other'\n")
+    _touch(root, "app/test_util.py", (
+        "import sys\n"
+        "from pkg.util import double\n\n"
+        "if __name__ == \"__main__\":\n"
+        "    print('double', double())\n"
+        "    sys.exit(0 if double() == 2 else 1)\n"
+    ))
+    _touch(root, "app/tests/test_other.py", "from pkg import other\n\ndef test_name():\n    assert other.NAME == 'other'\n")
+    _touch(root, "app/tests/conftest.py", "import helpers\n")
+    _touch(root, "app/tests/helpers.py", "HELPER = 1\n")
+    _touch(root, "app/test_slow.py", "import json\nimport time\n\ntime.sleep(30)\n")
+
+
+def test_affected_tests():
+    """推移的な import・相対 import・親パッケージの __init__.py から影響を受けるテストを選ぶことを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _project(tmp)
+        graph = impact.ImportGraph(tmp)
+        assert graph.all_tests() == ["app/test_slow.py", "app/test_util.py", "app/tests/test_other.py"]
+        assert graph.dependencies("app/pkg/util.py") == {"app/pkg/core.py"}
+        assert graph.dependencies("app/test_util.py") == {"app/pkg/util.py", "app/pkg/__init__.py"}
+        assert graph.affected_tests(["app/pkg/core.py"]) == ["app/test_util.py"]
+        assert graph.affected_tests(["app/pkg/other.py"]) == ["app/tests/test_other.py"]
+        assert graph.affected_tests(["app/pkg/__init__.py"]) == ["app/test_util.py", "app/tests/test_other.py"]
+        assert graph.affected_tests(["app/test_slow.py"]) == ["app/test_slow.py"]
+        assert graph.affected_tests(["app/pyproject.toml", "missing.py"]) == []
+        # conftest.py・ヘルパーはテストとして数えず、conftest.py の変更は同じディレクトリ配下のテストに影響する
+        assert graph.affected_tests(["app/tests/conftest.py"]) == ["app/tests/test_other.py"]
+        assert graph.affected_tests(["app/tests/helpers.py"]) == ["app/tests/test_other.py"]
+        assert graph.is_script("app/test_util.py") and not graph.is_script("app/tests/test_other.py")
+    print("✅ affected tests")
+
+
+def test_incremental_update():
+    """変更したファイルだけを読み直し、新しい import がグラフに反映されることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _project(tmp)
+        tools.set_workspace_root(tmp)
+        graph = impact.get_graph(tmp)
+        assert graph.affected_tests(["app/pkg/other.py"]) == ["app/tests/test_other.py"]
+        parsed = graph.parsed
+
+        tools.write_file.invoke({
+            "path": "app/pkg/core.py",
+            "content": "from pkg.other import NAME\nVALUE = 1\n",
+        })
+        assert graph.affected_tests(["app/pkg/other.py"]) == ["app/test_util.py", "app/tests/test_other.py"]
+        assert graph.parsed == parsed + 1
+    print("✅ incremental update")
+
+
+def test_run_affected_tests_tool():
+    """run_affected_tests ツールが影響を受けるテストだけを実行し、失敗したテストの出力を返すことを確認"""
+    os.environ["WARM_RUNNER_PRELOAD"] = "pytest"
+    # テスト結果のキャッシュは一時ディレクトリに書く（開発環境の data/test_results.db を汚さない）
+    with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory() as data, \
+            patch("agent.result_cache.data_path", lambda name: os.path.join(data, name)):
+        _project(tmp)
+        tools.set_workspace_root(tmp)
+        output = asyncio.run(tools.run_affected_tests.ainvoke({"write_files": ["app/pkg/core.py"]}))
+        assert output.startswith("影響を受けるテスト: 1 件（全 3 件中）— 成功 1 / 失敗 0")
+        assert "✅ app/test_util.py（" in output and "test_slow" not in output
+
+        tools.write_file.invoke({"path": "app/pkg/core.py", "content": "VALUE = 3\n"})
+        _touch(tmp, "app/pkg/other.py", "NAME = 'changed'\n")
+        output = asyncio.run(tools.run_affected_tests.ainvoke({
+            "write_files": ["app/pkg/core.py", "app/pkg/other.py"],
+        }))
+        assert "成功 0 / 失敗 2" in output
+        assert "❌ app/test_util.py（終了コード 1" in output and "double 6" in output
+        assert "❌ app/tests/test_other.py（終了コード 1" in output and "1 failed" in output
+
+        output = asyncio.run(tools.run_affected_tests.ainvoke({"write_files": ["app/pyproject.toml"]}))
+        assert output.startswith("影響を受けるテストはありません")
+
+        output = asyncio.run(tools.run_affected_tests.ainvoke({"write_files": ["app/tests/conftest.py"]}))
+        assert output.startswith("影響を受けるテスト: 1 件（全 3 件中）") and "app/tests/test_other.py" in output
+        assert "conftest" not in output.split("\n", 1)[1]
+    warm_runner.shutdown()
+    print("✅ run_affected_tests tool")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Affected tests", test_affected_tests),
+        ("Incremental update", test_incremental_update),
+        ("run_affected_tests tool", test_run_affected_tests_tool),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
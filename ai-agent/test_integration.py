@@ -56,9 +56,9 @@ async def integration_test():
                         assert workspace_set_called[0] == subscriber._workspace_root
                         print(f"  ✅ set_workspace_root が呼ばれました: {workspace_set_called[0]}")
             
-            # 3. tools._workspace_rootが設定されていることを確認
-            print("\n[Step 3] tools._workspace_root の確認")
-            print(f"  ✅ tools._workspace_root: {tools._workspace_root}")
+            # 3. tools のワークスペースルートを確認
+            print("\n[Step 3] tools.get_workspace_root() の確認")
+            print(f"  ✅ tools.get_workspace_root(): {tools.get_workspace_root()}")
             
             # cleanup
             subscriber._mqtt_connection = None
@@ -0,0 +1,190 @@
+"""llm_gateway.py のユニットテスト"""
+import asyncio
+import sys
+from unittest.mock import patch
+
+from agent import llm_gateway
+
+
+class _ThrottlingError(Exception):
+    def __init__(self):
+        super().__init__("An error occurred (ThrottlingException) when calling the Converse operation")
+        self.response = {"Error": {"Code": "ThrottlingException"}}
+
+
+class _FakeLLM:
+    """指定回数だけスロットリングしてから応答するモック LLM"""
+
+    def __init__(self, throttle_times: int = 0, delay: float = 0.0):
+        self.throttle_times = throttle_times
+        self.delay = delay
+        self.calls = 0
+        self.concurrent = 0
+        self.max_concurrent = 0
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        self.concurrent += 1
+        self.max_concurrent = max(self.max_concurrent, self.concurrent)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.throttle_times > 0:
+                self.throttle_times -= 1
+                raise _ThrottlingError()
+            return f"ok:{messages}"
+        finally:
+            self.concurrent -= 1
+
+
+def test_throttling_retry_and_aimd():
+    """スロットリング時に再試行し、同時実行上限が半減することを確認"""
+    llm_gateway.reset()
+    llm = _FakeLLM(throttle_times=2)
+    with patch("agent.llm_gateway._backoff_delay", return_value=0.0):
+        result = asyncio.run(llm_gateway.ainvoke(llm, "hi", model_id="m1"))
+    assert result == "ok:hi"
+    assert llm.calls == 3
+
+    metrics = llm_gateway.get_metrics()["m1"]
+    assert metrics["throttles"] == 2
+    assert metrics["retries"] == 2
+    assert metrics["limit"] < llm_gateway._INITIAL_LIMIT
+    print(f"✅ throttling handled: {metrics}")
+
+
+def test_non_throttling_error_is_raised():
+    """スロットリング以外の例外は再試行せずに送出されることを確認"""
+    llm_gateway.reset()
+
+    class _Broken:
+        async def ainvoke(self, messages):
+            raise ValueError("boom")
+
+    try:
+        asyncio.run(llm_gateway.ainvoke(_Broken(), "hi", model_id="m2"))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("ValueError が送出されていません")
+    assert llm_gateway.get_metrics()["m2"]["failures"] == 1
+    print("✅ non-throttling error raised")
+
+
+def test_concurrency_limit_and_priority():
+    """同時実行数が上限を超えず、対話的な呼び出しが先に処理されることを確認"""
+    llm_gateway.reset()
+    order = []
+
+    class _OrderedLLM(_FakeLLM):
+        async def ainvoke(self, messages):
+            result = await super().ainvoke(messages)
+            order.append(messages)
+            return result
+
+    async def scenario():
+        llm = _OrderedLLM(delay=0.05)
+        limiter = llm_gateway._get_limiter("m3")
+        limiter.limit = 1.0
+        first = asyncio.create_task(llm_gateway.ainvoke(llm, "first", model_id="m3"))
+        await asyncio.sleep(0.01)
+        background = asyncio.create_task(llm_gateway.ainvoke(
+            llm, "background", model_id="m3", priority=llm_gateway.PRIORITY_BACKGROUND))
+        await asyncio.sleep(0.01)
+        interactive = asyncio.create_task(llm_gateway.ainvoke(
+            llm, "interactive", model_id="m3", priority=llm_gateway.PRIORITY_INTERACTIVE))
+        await asyncio.gather(first, background, interactive)
+        return llm
+
+    # 成功による上限の加算を止めて、上限1のまま順序を確認する
+    with patch("agent.llm_gateway._MAX_LIMIT", 1.0):
+        llm = asyncio.run(scenario())
+    assert llm.max_concurrent == 1
+    assert order == ["first", "interactive", "background"]
+    assert llm_gateway.get_metrics()["m3"]["queue_wait_max_sec"] > 0
+    print(f"✅ priority order: {order}")
+
+
+def test_hedged_request_wins_when_primary_is_slow():
+    """主リクエストが p95 を超えたらヘッジし、先に返った応答を採用することを確認"""
+    llm_gateway.reset()
+    tracker = llm_gateway._get_tracker("sonnet")
+    for _ in range(llm_gateway._LATENCY_MIN_SAMPLES):
+        tracker.record(0.01)
+
+    slow = _FakeLLM(delay=5.0)
+    fast = _FakeLLM(delay=0.01)
+
+    async def scenario():
+        with patch("agent.llm_gateway._HEDGE_MIN_DELAY", 0.0):
+            return await llm_gateway.ainvoke_hedged(
+                slow, "hi", model_id="primary", latency_key="sonnet", hedge=(fast, "fallback"),
+            )
+
+    result = asyncio.run(scenario())
+    assert result == "ok:hi"
+    assert fast.calls == 1
+    metrics = llm_gateway.get_latency_metrics()["sonnet"]
+    assert metrics["hedged"] == 1
+    assert metrics["hedge_wins"] == 1
+    print(f"✅ hedged request won: {metrics}")
+
+
+def test_cancel_stops_hedge_request():
+    """ヘッジ後に呼び出し側がキャンセルすると、主リクエストとヘッジの両方が止まることを確認"""
+    llm_gateway.reset()
+    tracker = llm_gateway._get_tracker("opus")
+    for _ in range(llm_gateway._LATENCY_MIN_SAMPLES):
+        tracker.record(0.01)
+
+    slow = _FakeLLM(delay=5.0)
+    slow_hedge = _FakeLLM(delay=5.0)
+
+    async def scenario():
+        with patch("agent.llm_gateway._HEDGE_MIN_DELAY", 0.0):
+            try:
+                await asyncio.wait_for(llm_gateway.ainvoke_hedged(
+                    slow, "hi", model_id="m1", latency_key="opus", hedge=(slow_hedge, "m2"),
+                ), timeout=0.2)
+            except asyncio.TimeoutError:
+                pass
+        await asyncio.sleep(0.05)
+        return llm_gateway.get_metrics()
+
+    metrics = asyncio.run(scenario())
+    assert slow_hedge.calls == 1
+    assert slow.concurrent == 0 and slow_hedge.concurrent == 0
+    assert metrics["m1"]["in_flight"] == 0 and metrics["m2"]["in_flight"] == 0
+    print("✅ cancel stops hedge request")
+
+
+def test_no_hedge_without_latency_history():
+    """レイテンシ履歴が不足している間はヘッジしないことを確認"""
+    llm_gateway.reset()
+    primary = _FakeLLM(delay=0.01)
+    fallback = _FakeLLM()
+    asyncio.run(llm_gateway.ainvoke_hedged(
+        primary, "hi", model_id="primary", latency_key="haiku", hedge=(fallback, "fallback"),
+    ))
+    assert fallback.calls == 0
+    assert llm_gateway.get_latency_metrics()["haiku"]["samples"] == 1
+    print("✅ no hedge without history")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Throttling retry and AIMD", test_throttling_retry_and_aimd),
+        ("Non-throttling error", test_non_throttling_error_is_raised),
+        ("Concurrency limit and priority", test_concurrency_limit_and_priority),
+        ("Hedged request", test_hedged_request_wins_when_primary_is_slow),
+        ("Cancel stops hedge request", test_cancel_stops_hedge_request),
+        ("No hedge without history", test_no_hedge_without_latency_history),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
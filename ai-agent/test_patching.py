@@ -0,0 +1,121 @@
+"""patching.py と apply_patch のユニットテスト"""
+import os
+import stat
+import sys
+import tempfile
+
+from agent import tools
+from agent.patching import apply, parse_unified_diff, write_atomic
+
+_SOURCE = "".join(f"line {i}\n" for i in range(1, 21))
+
+
+def test_unified_diff():
+    """複数ハンク・行番号のずれ・見出しの行数の誤りがあっても適用できることを確認"""
+    patch = (
+        "--- a/x.txt\n+++ b/x.txt\n"
+        "@@ -2,3 +2,3 @@\n line 2\n-line 3\n+LINE 3\n line 4\n"
+        "@@ -15,2 +15,3 @@\n line 15\n+inserted\n line 16\n"
+    )
+    new, count = apply(_SOURCE, patch)
+    assert count == 2
+    assert new.splitlines()[2] == "LINE 3" and new.splitlines()[15] == "inserted"
+    assert new.endswith("line 20\n")
+
+    # 行番号がずれていても、前後の行で位置を特定する
+    new, _ = apply(_SOURCE, "@@ -1,3 +1,3 @@\n line 9\n-line 10\n+line ten\n line 11\n")
+    assert new.splitlines()[9] == "line ten"
+
+    # 見出しの行数が誤っていても本文から数える
+    assert parse_unified_diff("@@ -5,9 +5,9 @@\n-line 5\n+five\n") == [(5, ["line 5"], ["five"])]
+
+    # 新規ファイル
+    assert apply("", "--- /dev/null\n+++ b/new.py\n@@ -0,0 +1,2 @@\n+a = 1\n+b = 2\n") == ("a = 1\nb = 2\n", 1)
+    print("✅ unified diff")
+
+
+def test_search_replace():
+    """SEARCH/REPLACE ブロックの適用と、一致しない・一意でない場合のエラーを確認"""
+    patch = (
+        "<<<<<<< SEARCH\nline 3\nline 4\n=======\nline 3-4\n>>>>>>> REPLACE\n"
+        "<<<<<<< SEARCH\nline 20\n=======\nline 20\nline 21\n>>>>>>> REPLACE\n"
+    )
+    new, count = apply(_SOURCE, patch)
+    assert count == 2
+    assert "line 3-4\nline 5\n" in new and new.endswith("line 20\nline 21\n")
+
+    for bad, message in [
+        ("<<<<<<< SEARCH\nno such line\n=======\nx\n>>>>>>> REPLACE", "見つかりません"),
+        ("<<<<<<< SEARCH\n0\n=======\nx\n>>>>>>> REPLACE", "2 か所"),   # line 10 と line 20
+        ("@@ -3,1 +3,1 @@\n-line 99\n+x\n", "一致しません"),
+        ("free text", "見つかりません"),
+    ]:
+        try:
+            apply(_SOURCE, bad)
+        except ValueError as e:
+            assert message in str(e), str(e)
+        else:
+            raise AssertionError(f"ValueError が発生しませんでした: {bad!r}")
+    print("✅ search/replace")
+
+
+def test_apply_patch_tool():
+    """ツールがアトミックに書き込み、失敗時はファイルを変更せず、索引を更新することを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "src", "app.py")
+        os.makedirs(os.path.dirname(path))
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write("def handler(event):\r\n    return None\r\n")
+        os.chmod(path, 0o755)
+        tools.set_workspace_root(tmp)
+
+        result = tools.apply_patch.invoke({
+            "path": "src/app.py",
+            "patch": "<<<<<<< SEARCH\n    return None\n=======\n    return process(event)\n>>>>>>> REPLACE",
+        })
+        assert result.splitlines()[:4] == [
+            "✅ 差分を適用しました（1 ハンク）: src/app.py: +1 -1 行",
+            "@@ -2 +2 @@",
+            "-    return None",
+            "+    return process(event)",
+        ], result
+        with open(path, "rb") as f:
+            assert f.read() == b"def handler(event):\r\n    return process(event)\r\n"   # CRLF を保つ
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o755
+        assert os.listdir(os.path.dirname(path)) == ["app.py"]   # 一時ファイルが残らない
+        assert "src/app.py" in tools.search_code.invoke({"query": "process(event)"})
+
+        result = tools.apply_patch.invoke({"path": "src/app.py", "patch": "@@ -1 +1 @@\n-def other():\n+def x():\n"})
+        assert result.startswith("エラー: 差分を適用できません")
+        with open(path, "rb") as f:
+            assert b"process(event)" in f.read()
+    print("✅ apply_patch tool")
+
+
+def test_write_atomic_new_file_mode():
+    """新規ファイルは umask に従った権限で作られることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "a", "b.txt")
+        write_atomic(path, "x\n")
+        umask = os.umask(0)
+        os.umask(umask)
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o666 & ~umask
+    print("✅ write_atomic new file mode")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Unified diff", test_unified_diff),
+        ("Search/replace", test_search_replace),
+        ("apply_patch tool", test_apply_patch_tool),
+        ("write_atomic new file mode", test_write_atomic_new_file_mode),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
@@ -0,0 +1,153 @@
+"""repo_map.py（シンボル一覧）のユニットテスト"""
+import os
+import sys
+import tempfile
+
+from agent import repo_map, tools
+from agent.repo_map import RepoMap, outline_cpp, outline_python, outline_ts
+
+
+def _touch(root: str, rel: str, content: str) -> None:
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+_PY = '''
+import os
+
+LIMIT = 10
+
+
+def _helper():
+    pass
+
+
+async def fetch(url: str, *, timeout: float = 5.0) -> bytes:
+    def inner():
+        pass
+
+
+class Store(Base):
+    def __init__(self, path):
+        pass
+
+    def get(self, key: str) -> dict | None:
+        pass
+
+    def _private(self):
+        pass
+'''
+
+_TS = '''import * as vscode from "vscode";
+
+export function activate(context: vscode.ExtensionContext) {
+  function nested() {}
+}
+export default class AgentPanel {
+  static show() {}
+}
+export interface TaskEvent { type: string }
+type Status = "idle" | "running";
+export const applyEvent = async (ev: TaskEvent): Promise<void> => {};
+const LIMIT = 10;
+'''
+
+_CPP = '''#include <Arduino.h>
+static const char *TAG = "main";
+PubSubClient client(secure_client);
+class Callbacks;
+class Callbacks : public BLEServerCallbacks {
+  void onConnect(BLEServer *server) {}
+};
+bool aws_iot_publish_sensor(float accel, const char *status, bool changed) {
+  if (x) {
+  }
+}
+void setup() {
+}
+const char *status_from_magnitude(float magnitude);
+'''
+
+
+def test_outlines():
+    """Python / TypeScript / C++ のトップレベルのシンボルとシグネチャを確認"""
+    assert outline_python(_PY) == [
+        "async def fetch(url: str, *, timeout: float=5.0) -> bytes",
+        "class Store(Base)",
+        "  def __init__(self, path)",
+        "  def get(self, key: str) -> dict | None",
+    ]
+    assert outline_python("def broken(:\n") == ["（構文エラー）"]
+    assert outline_ts(_TS) == [
+        "function activate(context: vscode.ExtensionContext)",
+        "class AgentPanel",
+        "interface TaskEvent",
+        "type Status",
+        "const applyEvent = (ev: TaskEvent) =>",
+    ]
+    assert outline_cpp(_CPP) == [
+        "class Callbacks",
+        "bool aws_iot_publish_sensor(float accel, const char *status, bool changed)",
+        "void setup()",
+        "const char * status_from_magnitude(float magnitude)",
+    ]
+    print("✅ outlines")
+
+
+def test_cache_by_hash():
+    """変更のないファイルは解析し直さず、内容が戻ればハッシュで再利用することを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _touch(tmp, "a.py", "def one():\n    pass\n")
+        _touch(tmp, "b.py", "def two():\n    pass\n")
+        _touch(tmp, "README.md", "# doc\n")
+        tools.set_workspace_root(tmp)
+        repo = repo_map.get_map(tmp)
+        assert repo.symbols() == {"a.py": ["def one()"], "b.py": ["def two()"]}
+        assert repo.parsed == 2
+
+        tools.write_file.invoke({"path": "a.py", "content": "def one_renamed():\n    pass\n"})
+        assert repo.symbols()["a.py"] == ["def one_renamed()"]
+        assert repo.parsed == 3
+
+        tools.write_file.invoke({"path": "a.py", "content": "def one():\n    pass\n"})
+        assert repo.symbols()["a.py"] == ["def one()"]
+        assert repo.parsed == 3   # 以前と同じ内容なので解析しない
+
+        os.remove(os.path.join(tmp, "b.py"))
+        repo.invalidate()
+        assert list(repo.symbols()) == ["a.py"]
+    print("✅ cache by hash")
+
+
+def test_render_budget_and_focus():
+    """focus のファイルが先頭に来て、上限を超える分は省略されることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(50):
+            _touch(tmp, f"pkg/mod_{i:02d}.py", f"def handler_{i}(event: dict) -> None:\n    pass\n")
+        repo = RepoMap(tmp)
+        text = repo.render(max_chars=500, focus=["pkg/mod_42.py"])
+        assert len(text) <= 500 + 80
+        assert text.splitlines()[:2] == ["pkg/mod_42.py", "  def handler_42(event: dict) -> None"]
+        assert text.splitlines()[2] == "pkg/mod_00.py"
+        assert text.endswith("list_files / search_code で確認）")
+        assert "ほか 41 ファイル" in text
+    print("✅ render budget and focus")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Outlines", test_outlines),
+        ("Cache by hash", test_cache_by_hash),
+        ("Render budget and focus", test_render_budget_and_focus),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
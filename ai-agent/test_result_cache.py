@@ -0,0 +1,143 @@
+"""result_cache.py（テスト実行結果のキャッシュ）のユニットテスト"""
+import asyncio
+import os
+import sys
+import tempfile
+from unittest.mock import patch
+
+from agent import result_cache, tools, warm_runner
+
+
+def _touch(root: str, rel: str, content: str) -> None:
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def _project(root: str) -> None:
+    _touch(root, "app/pyproject.toml", "[project]\nname = 'sample'\n")
+    _touch(root, "app/mod.py", "VALUE = 1\n")
+    _touch(root, "app/unrelated.py", "NAME = 'x'\n")
+    _touch(root, "app/test_mod.py", (
+        "import sys\n"
+        "import mod\n\n"
+        "if __name__ == \"__main__\":\n"
+        "    print('value', mod.VALUE)\n"
+        "    sys.exit(0 if mod.VALUE == 1 else 1)\n"
+    ))
+
+
+def _run(tool, **kwargs) -> str:
+    return asyncio.run(tool.ainvoke(kwargs))
+
+
+def test_is_test_command():
+    """テストを実行するコマンドだけをキャッシュ対象とすることを確認"""
+    for command in ["pytest -q", "uv run python test_tools.py", "python -m unittest", "npm test",
+                    "npm run test", "go test ./...", "cd ai-agent && python agent/foo_test.py"]:
+        assert result_cache.is_test_command(command), command
+    for command in ["ls -la", "npm install", "python main.py", "cat latest.py", "git status"]:
+        assert not result_cache.is_test_command(command), command
+    print("✅ is test command")
+
+
+def test_run_tests_cache():
+    """同じツリーでの再実行はキャッシュから返し、import しているファイルの変更で実行し直すことを確認"""
+    os.environ["WARM_RUNNER_PRELOAD"] = "json"
+    with tempfile.TemporaryDirectory() as tmp, \
+            patch("agent.result_cache.data_path", lambda name: os.path.join(tmp, name)):
+        _project(tmp)
+        tools.set_workspace_root(tmp)
+        first = _run(tools.run_tests, path="app/test_mod.py")
+        assert first.endswith("（新たに実行した結果です）") and "value 1" in first
+
+        second = _run(tools.run_tests, path="app/test_mod.py")
+        assert second.startswith("♻️ キャッシュ済みの結果です") and "value 1" in second
+        assert second.split("\n\n", 1)[1] == first.rsplit("\n", 1)[0]
+
+        # import していないファイルでも、プロジェクト内の変更では実行し直す（conftest.py などがあるため）
+        tools.write_file.invoke({"path": "app/unrelated.py", "content": "NAME = 'y'\n"})
+        assert not _run(tools.run_tests, path="app/test_mod.py").startswith("♻️")
+        assert _run(tools.run_tests, path="app/test_mod.py").startswith("♻️")
+
+        tools.write_file.invoke({"path": "app/mod.py", "content": "VALUE = 2\n"})
+        third = _run(tools.run_tests, path="app/test_mod.py")
+        assert "value 2" in third and "終了コード: 1" in third and not third.startswith("♻️")
+
+        # 失敗した結果もキャッシュし、use_cache=False なら実行し直す
+        assert _run(tools.run_tests, path="app/test_mod.py").startswith("♻️")
+        assert not _run(tools.run_tests, path="app/test_mod.py", use_cache=False).startswith("♻️")
+
+        output = _run(tools.run_affected_tests, write_files=["app/mod.py"])
+        assert "うち 1 件はファイルに変更がないためキャッシュ済みの結果" in output
+        assert "❌ app/test_mod.py（終了コード 1、" in output and "、キャッシュ）" in output
+    warm_runner.shutdown()
+    print("✅ run_tests cache")
+
+
+def test_conftest_change_invalidates():
+    """テストが import しない conftest.py の変更で pytest の結果を実行し直すことを確認"""
+    with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory() as data, \
+            patch("agent.result_cache.data_path", lambda name: os.path.join(data, name)):
+        _touch(tmp, "pyproject.toml", "[project]\nname = 'sample'\n")
+        _touch(tmp, "tests/conftest.py", "import pytest\n\n@pytest.fixture\ndef value():\n    return 1\n")
+        _touch(tmp, "tests/test_fixture.py", "def test_value(value):\n    assert value == 1\n")
+        token = tools.set_workspace_root(tmp)
+        try:
+            first = _run(tools.run_tests, path="tests/test_fixture.py", pytest=True)
+            assert "1 passed" in first and not first.startswith("♻️")
+            assert _run(tools.run_tests, path="tests/test_fixture.py", pytest=True).startswith("♻️")
+
+            tools.write_file.invoke({
+                "path": "tests/conftest.py",
+                "content": "import pytest\n\n@pytest.fixture\ndef value():\n    return 2\n",
+            })
+            second = _run(tools.run_tests, path="tests/test_fixture.py", pytest=True)
+            assert "1 failed" in second and not second.startswith("♻️")
+        finally:
+            tools.reset_workspace_root(token)
+    warm_runner.shutdown()
+    print("✅ conftest change invalidates")
+
+
+def test_run_shell_cache():
+    """run_shell はテストのコマンドだけをキャッシュし、タイムアウトした結果は保存しないことを確認"""
+    with tempfile.TemporaryDirectory() as tmp, \
+            patch("agent.result_cache.data_path", lambda name: os.path.join(tmp, name)):
+        _project(tmp)
+        tools.set_workspace_root(tmp)
+        command = f"{sys.executable} test_mod.py"
+        first = _run(tools.run_shell, command=command, cwd="app")
+        assert "value 1" in first and first.endswith("（新たに実行した結果です）")
+        assert _run(tools.run_shell, command=command, cwd="app").startswith("♻️ キャッシュ済みの結果です")
+
+        tools.write_file.invoke({"path": "app/data.json", "content": "{}\n"})
+        assert not _run(tools.run_shell, command=command, cwd="app").startswith("♻️")
+
+        output = _run(tools.run_shell, command="echo hi", cwd="app")
+        assert output.endswith("終了コード: 0") and not output.startswith("♻️")
+
+        slow = "sleep 5 # test_slow.py"
+        assert "タイムアウト" in _run(tools.run_shell, command=slow, timeout=1)
+        assert "タイムアウト" in _run(tools.run_shell, command=slow, timeout=1)
+        assert result_cache.stats["hits"] >= 1
+    print("✅ run_shell cache")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Is test command", test_is_test_command),
+        ("run_tests cache", test_run_tests_cache),
+        ("conftest change invalidates", test_conftest_change_invalidates),
+        ("run_shell cache", test_run_shell_cache),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
@@ -0,0 +1,104 @@
+"""retrieval.py（プランナー用の BM25 検索）のユニットテスト"""
+import os
+import sys
+import tempfile
+
+from agent import dev_graph, retrieval, tools
+from agent.retrieval import BM25Index, plan_items, tokenize
+
+
+def _touch(root: str, rel: str, content: str) -> None:
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def _workspace(root: str) -> None:
+    _touch(root, "ai-agent/agent/tools.py",
+           'def set_iot_status(status):\n    """IoTデバイスのステータスを設定する"""\n    return status\n')
+    _touch(root, "ai-agent/agent/history.py",
+           'class SensorHistory:\n    """心拍数センサーの履歴をリングバッファで保持する"""\n')
+    _touch(root, "web-ui/src/HeartRateChart.tsx",
+           "export function HeartRateChart({ bpm }) {\n  return <Line data={bpm} />;\n}\n")
+    _touch(root, "firmware/src/main.cpp",
+           "void publishHeartRate(int bpm) {\n  mqtt.publish(topic, bpm);\n}\n")
+
+
+def test_tokenize():
+    """snake_case / camelCase の分割と日本語の 2-gram を確認"""
+    assert tokenize("set_iot_status") == ["set_iot_status", "set", "iot", "status"]
+    assert tokenize("HeartRateChart") == ["heartratechart", "heart", "rate", "chart"]
+    assert tokenize("HTTPServer") == ["httpserver", "http", "server"]
+    assert tokenize("心拍数を表示") == ["心拍", "拍数", "数を", "を表", "表示"]
+    assert tokenize("return self.x for the") == []
+    print("✅ tokenize")
+
+
+def test_ranking():
+    """項目に関連するファイルが上位に来ることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _workspace(tmp)
+        index = BM25Index(tmp)
+        assert index.search("心拍数のグラフを HeartRateChart に追加")[0][0] == "web-ui/src/HeartRateChart.tsx"
+        assert index.search("IoT ステータスの設定を変更")[0][0] == "ai-agent/agent/tools.py"
+        assert index.search("ファームウェアの publish 間隔")[0][0] == "firmware/src/main.cpp"
+        assert index.search("history のバッファサイズ")[0][0] == "ai-agent/agent/history.py"
+        assert index.search("zzz_unknown") == []
+    print("✅ ranking")
+
+
+def test_incremental_update():
+    """write_file で変更・追加したファイルが次の検索に反映されることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _workspace(tmp)
+        tools.set_workspace_root(tmp)
+        index = retrieval.get_index(tmp)
+        assert index.search("cadence estimator") == []
+
+        tools.write_file.invoke({"path": "ai-agent/agent/cadence.py", "content": "class CadenceEstimator:\n    pass\n"})
+        assert index.search("cadence estimator")[0][0] == "ai-agent/agent/cadence.py"
+
+        tools.write_file.invoke({"path": "ai-agent/agent/cadence.py", "content": "x = 1\n"})
+        # パスの語は残るがスコアは下がる
+        assert index.search("estimator") == []
+    print("✅ incremental update")
+
+
+def test_plan_items_and_shortlist():
+    """plan.md の項目分割と、プランナー向けの候補生成を確認"""
+    plan = "# 心拍数の改善\n\n- HeartRateChart に移動平均を表示する\n1. set_iot_status に強度を追加\n\n補足の文章\n"
+    assert plan_items(plan) == ["心拍数の改善", "HeartRateChart に移動平均を表示する", "set_iot_status に強度を追加"]
+    assert plan_items("心拍数を表示する") == ["心拍数を表示する"]
+    assert plan_items("  \n") == []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _workspace(tmp)
+        _touch(tmp, "docs/plan.md", plan)
+        plan_text, candidates = dev_graph._plan_context(tmp)
+        assert plan_text == plan
+        assert "docs/plan.md" not in candidates
+        lines = candidates.splitlines()
+        assert lines[2] == "- HeartRateChart に移動平均を表示する"
+        assert lines[3].startswith("  web-ui/src/HeartRateChart.tsx")
+        assert lines[5].startswith("  ai-agent/agent/tools.py")
+        assert dev_graph._plan_context(os.path.join(tmp, "missing")) == ("", "")
+    print("✅ plan items and shortlist")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Tokenize", test_tokenize),
+        ("Ranking", test_ranking),
+        ("Incremental update", test_incremental_update),
+        ("Plan items and shortlist", test_plan_items_and_shortlist),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
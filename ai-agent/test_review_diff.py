@@ -0,0 +1,156 @@
+"""review_diff.py（reviewer に渡す変更差分）のユニットテスト"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+from unittest.mock import AsyncMock, patch
+
+from agent import dev_graph, review_diff, tools, worktrees
+
+
+def _touch(root: str, rel: str, content: str) -> None:
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def _read_text(root: str, rel: str) -> str:
+    with open(os.path.join(root, rel), encoding="utf-8") as f:
+        return f.read()
+
+
+def test_render_diff():
+    """変更した箇所だけが前後の文脈付きで差分になることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _touch(tmp, "big.py", "".join(f"line_{i} = {i}\n" for i in range(2000)))
+        _touch(tmp, "same.py", "x = 1\n")
+        originals = review_diff.snapshot(tmp, ["big.py", "same.py", "new.py", "../outside.py"])
+        assert set(originals) == {"big.py", "same.py", "new.py"} and originals["new.py"] is None
+
+        _touch(tmp, "big.py", "".join(f"line_{i} = {i * 10 if i == 1000 else i}\n" for i in range(2000)))
+        _touch(tmp, "new.py", "created = True")
+        diff = review_diff.render(tmp, originals)
+        assert diff.startswith("変更ファイル 2 件（+2 -1 行）\n")
+        assert "--- a/big.py\n+++ b/big.py\n" in diff and "-line_1000 = 1000\n+line_1000 = 10000\n" in diff
+        assert "line_993 = 993" not in diff and "line_994 = 994" in diff and "line_1006 = 1006" in diff
+        assert "--- /dev/null\n+++ b/new.py\n" in diff and "\\ No newline at end of file" in diff
+        assert "same.py" not in diff
+        assert len(diff) < 1000   # 2000 行のファイル全体ではなく変更箇所だけ
+
+        truncated = review_diff.render(tmp, originals, max_chars=200)
+        assert "差分が長いため残り" in truncated
+        assert review_diff.render(tmp, {"same.py": "x = 1\n"}) == ""
+    print("✅ render diff")
+
+
+def test_tracks_tool_writes():
+    """track_changes 中に write_file / apply_patch で初めて書き換えたファイルの元の内容を記録することを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _touch(tmp, "a.py", "A = 1\n")
+        _touch(tmp, "b.py", "B = 1\n")
+        token = tools.set_workspace_root(tmp)
+        originals = {}
+        changes = tools.track_changes(originals)
+        tools.write_file.invoke({"path": "a.py", "content": "A = 2\n"})
+        tools.write_file.invoke({"path": "a.py", "content": "A = 3\n"})
+        tools.apply_patch.invoke({"path": "b.py", "patch": "<<<<<<< SEARCH\nB = 1\n=======\nB = 2\n>>>>>>> REPLACE\n"})
+        tools.write_file.invoke({"path": "c.py", "content": "C = 1\n"})
+        assert originals == {"a.py": "A = 1\n", "b.py": "B = 1\n", "c.py": None}
+        diff = review_diff.render(tmp, originals)
+        assert "-A = 1\n+A = 3\n" in diff and "-B = 1\n+B = 2\n" in diff and "+C = 1\n" in diff
+        tools._changes_var.reset(changes)
+        tools.reset_workspace_root(token)
+    print("✅ tracks tool writes")
+
+
+def test_reviewer_prompt_uses_diff():
+    """reviewer のプロンプトにファイル全体ではなく差分が入ることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _touch(tmp, "big.py", "".join(f"line_{i} = {i}\n" for i in range(500)))
+        originals = review_diff.snapshot(tmp, ["big.py"])
+        _touch(tmp, "big.py", "".join(f"line_{i} = {-i if i == 250 else i}\n" for i in range(500)))
+        state = {
+            "current_task": "line_250 を負にする",
+            "workspace_root": tmp,
+            "task_workspace": "",
+            "current_write_files": ["big.py"],
+            "task_originals": originals,
+            "task_index": 0,
+            "revision_count": 0,
+        }
+        response = '<review_result>{"result": "PASS", "needs_revision": false, "comment": "ok"}</review_result>'
+        with patch.object(dev_graph, "_invoke_agent", AsyncMock(return_value=response)) as invoke, \
+                patch.object(dev_graph, "broadcast", AsyncMock()), \
+                patch.object(dev_graph.session_tracker, "task_completed"):
+            result = asyncio.run(dev_graph.reviewer_node(state))
+        prompt = invoke.call_args[0][0]
+        assert "-line_250 = 250\n+line_250 = -250\n" in prompt
+        assert "line_100 = 100" not in prompt and "read_file で実装ファイルを読み込んで" not in prompt
+        assert result["needs_revision"] is False
+    print("✅ reviewer prompt uses diff")
+
+
+def test_reviewer_diff_from_worktree():
+    """worktree で作業した場合、run_shell など write_file 以外での変更も差分に入ることを確認"""
+    with tempfile.TemporaryDirectory() as tmp, \
+            patch("agent.worktrees.data_path", lambda *parts: os.path.join(tmp, "data", *parts)), \
+            patch.dict(worktrees._pools, clear=True):
+        repo = os.path.join(tmp, "repo")
+        _touch(repo, ".gitignore", "data/\n")
+        _touch(repo, "app/main.py", "".join(f"line_{i} = {i}\n" for i in range(100)))
+        _touch(repo, "app/fmt.py", "x=1\n")
+        _touch(repo, "other/outside.py", "OUTSIDE = 1\n")
+        for args in (["init", "-q"], ["add", "-A"], ["-c", "user.name=t", "-c", "user.email=t@t", "commit", "-qm", "init"]):
+            subprocess.run(["git", *args], cwd=repo, check=True)
+        state = {
+            "current_task": "line_50 を変える",
+            "workspace_root": os.path.join(repo, "app"),
+            "task_workspace": "",
+            "current_write_files": ["main.py"],
+            "task_index": 0,
+            "revision_count": 0,
+        }
+        response = '<review_result>{"result": "FAIL", "needs_revision": false, "comment": "ng"}</review_result>'
+
+        async def scenario():
+            state["task_workspace"] = await dev_graph._enter_task_workspace(state)
+            workspace = state["task_workspace"]
+            tools.write_file.invoke({"path": "main.py", "content": "".join(
+                f"line_{i} = {-i if i == 50 else i}\n" for i in range(100)
+            )})
+            # write_file を通さない変更（フォーマッタなど）と、ワークスペース外の変更
+            subprocess.run(["sed", "-i", "s/x=1/x = 1/", "fmt.py"], cwd=workspace, check=True)
+            _touch(os.path.dirname(workspace), "other/outside.py", "OUTSIDE = 2\n")
+            with patch.object(dev_graph, "_invoke_agent", AsyncMock(return_value=response)) as invoke, \
+                    patch.object(dev_graph, "broadcast", AsyncMock()), \
+                    patch.object(dev_graph.session_tracker, "task_completed"):
+                await dev_graph.reviewer_node(state)
+            return invoke.call_args[0][0]
+
+        prompt = asyncio.run(scenario())
+        assert "変更ファイル 2 件（+2 -2 行）" in prompt
+        assert "-line_50 = 50\n+line_50 = -50\n" in prompt and "line_40 = 40" not in prompt
+        assert "--- a/fmt.py\n+++ b/fmt.py\n" in prompt and "-x=1\n+x = 1\n" in prompt
+        assert "outside.py" not in prompt
+        assert _read_text(repo, "app/fmt.py") == "x=1\n"   # FAIL なので元のチェックアウトは変わらない
+    print("✅ reviewer diff from worktree")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Render diff", test_render_diff),
+        ("Tracks tool writes", test_tracks_tool_writes),
+        ("Reviewer prompt uses diff", test_reviewer_prompt_uses_diff),
+        ("Reviewer diff from worktree", test_reviewer_diff_from_worktree),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
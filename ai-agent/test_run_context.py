@@ -0,0 +1,87 @@
+"""tools.py の実行ごとの状態（contextvars）のユニットテスト"""
+import asyncio
+import os
+import sys
+import tempfile
+
+from agent import tools
+
+
+def _touch(root: str, rel: str, content: str) -> None:
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def test_concurrent_workspaces():
+    """並行する実行がそれぞれのワークスペースを基準にファイルを読み書きすることを確認"""
+    async def run(root: str, name: str, ready: asyncio.Event, other_ready: asyncio.Event) -> list[str]:
+        token = tools.set_workspace_root(root)
+        try:
+            ready.set()
+            await other_ready.wait()   # 相手の実行もワークスペースを設定した後で操作する
+            seen = [await tools.read_file.ainvoke({"path": "name.txt"})]
+            await tools.write_file.ainvoke({"path": "out.txt", "content": name})
+            await asyncio.sleep(0.01)
+            seen.append(await tools.read_file.ainvoke({"path": "out.txt"}))
+            seen.append((await tools.run_shell.ainvoke({"command": "cat name.txt"})).split("\n")[4])
+            seen.append(tools.get_workspace_root())
+            return seen
+        finally:
+            tools.reset_workspace_root(token)
+
+    async def main(a: str, b: str):
+        ready_a, ready_b = asyncio.Event(), asyncio.Event()
+        return await asyncio.gather(run(a, "a", ready_a, ready_b), run(b, "b", ready_b, ready_a))
+
+    with tempfile.TemporaryDirectory() as a, tempfile.TemporaryDirectory() as b:
+        _touch(a, "name.txt", "a")
+        _touch(b, "name.txt", "b")
+        outer = tools.set_workspace_root("")
+        seen_a, seen_b = asyncio.run(main(a, b))
+        assert seen_a == ["a", "a", "a", a] and seen_b == ["b", "b", "b", b]
+        assert tools.get_workspace_root() == ""
+        tools.reset_workspace_root(outer)
+    print("✅ concurrent workspaces")
+
+
+def test_running_flag_per_device():
+    """走行中フラグがデバイスごとに管理され、実行に紐づくデバイスのフラグを返すことを確認"""
+    tools.set_is_running(True, "runner_a")
+    tools.set_is_running(False, "runner_b")
+    try:
+        assert tools.get_is_running("runner_a") and not tools.get_is_running("runner_b")
+        assert tools.get_is_running()   # 実行にデバイスがなければいずれかが走行中か
+
+        async def in_run(device_id: str) -> bool:
+            tools.set_run_device(device_id)
+            await asyncio.sleep(0)
+            return tools.get_is_running()
+
+        async def main():
+            return await asyncio.gather(
+                asyncio.create_task(in_run("runner_a")), asyncio.create_task(in_run("runner_b"))
+            )
+
+        assert asyncio.run(main()) == [True, False]
+        assert tools.get_run_device() == ""
+    finally:
+        tools.set_is_running(False, "runner_a")
+    print("✅ running flag per device")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Concurrent workspaces", test_concurrent_workspaces),
+        ("Running flag per device", test_running_flag_per_device),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
@@ -0,0 +1,159 @@
+"""sessions.py のユニットテスト"""
+import asyncio
+import os
+import sys
+import tempfile
+
+from agent import store as sensor_store
+from agent.sessions import SessionTracker
+
+_BASE = 1_772_000_000.0
+
+
+def _run(tracker: SessionTracker, device_id: str = "esp32") -> dict:
+    tracker.start(device_id, _BASE)
+    statuses = ["Walk"] * 4 + ["Run"] * 6 + ["Walk"] * 2
+    for i, status in enumerate(statuses):
+        tracker.observe(device_id, status, 20.0 + i, _BASE + i * 5)
+    tracker.task_completed(device_id)
+    tracker.task_completed(device_id)
+    return tracker.finish(device_id, _BASE + len(statuses) * 5)
+
+
+def test_incremental_summary():
+    """ステータス滞在時間・bpm 統計・完了タスク数が逐次集計されることを確認"""
+    tracker = SessionTracker()
+    tracker.observe("esp32", "Run", 30.0, _BASE)  # セッション外のサンプルは無視される
+    summary = _run(tracker)
+    assert summary["duration_sec"] == 60.0
+    # 最後のサンプル以降の時間は次のサンプルがないので数えない
+    assert summary["status_seconds"] == {"Walk": 25.0, "Run": 30.0}
+    assert summary["bpm"]["count"] == 12
+    assert summary["bpm"]["mean"] == 25.5
+    assert summary["bpm"]["min"] == 20.0 and summary["bpm"]["max"] == 31.0
+    assert summary["tasks_completed"] == 2
+    assert tracker.active() == []
+    assert tracker.recent()[0] == summary
+    print(f"✅ summary: {summary}")
+
+
+def test_gaps_are_not_counted():
+    """受信が途切れた区間はステータス滞在時間に含めないことを確認"""
+    tracker = SessionTracker()
+    tracker.start("esp32", _BASE)
+    tracker.observe("esp32", "Run", None, _BASE)
+    tracker.observe("esp32", "Run", None, _BASE + 5)
+    tracker.observe("esp32", "Run", None, _BASE + 600)
+    summary = tracker.finish("esp32")
+    assert summary["status_seconds"] == {"Run": 5.0}
+    assert summary["duration_sec"] == 600.0
+    assert summary["bpm"] is None
+    print("✅ gaps are not counted")
+
+
+def test_persisted_sessions():
+    """終了したセッションがストアに保存され、開き直しても読めることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sensors.db")
+        sensor_store.open_store(path)
+        try:
+            tracker = SessionTracker()
+            first = _run(tracker, "a")
+            second = _run(tracker, "b")
+            assert tracker.recent() == [second, first]
+            assert tracker.recent(device_id="a") == [first]
+        finally:
+            sensor_store.close_store()
+        reopened = sensor_store.SensorStore(path)
+        assert reopened.sessions(limit=1) == [second]
+        reopened.close()
+    print("✅ persisted sessions")
+
+
+def test_notify_stop_broadcasts_summary():
+    """running_stop で session_summary イベントが配信されることを確認"""
+    from agent import graph
+    from api import events
+
+    async def scenario():
+        q = events.add_subscriber()
+        try:
+            graph.session_tracker.reset()
+            graph.session_tracker.start("esp32", _BASE)
+            graph.session_tracker.observe("esp32", "Run", 35.0, _BASE + 5)
+            await graph.notify_stop({"iot_message": {"device_id": "esp32", "timestamp": "2026-02-25T06:14:00Z"}})
+            return await asyncio.wait_for(q.get(), timeout=1.0)
+        finally:
+            events.remove_subscriber(q)
+
+    event = asyncio.run(scenario())
+    assert event["type"] == "session_summary"
+    assert event["session"]["duration_sec"] == 40.0
+    print(f"✅ broadcast: {event['type']}")
+
+
+def test_trigger_per_device():
+    """走行状態の遷移をデバイスごとに判定し、他のデバイスの None で running_start が重複しないことを確認"""
+    from unittest.mock import patch
+
+    from agent import graph
+
+    def check(device_id: str, status: str) -> str:
+        msg = {"device_id": device_id, "status": status, "timestamp": "2026-02-25T06:13:20Z"}
+        return graph.trigger_check({"iot_message": msg})["trigger"]
+
+    with patch.dict(graph._prev_running, clear=True), patch.object(graph, "session_tracker"):
+        assert check("dev-a", "Run") == "running_start"
+        assert check("dev-b", "None") == "none"
+        assert check("dev-a", "Run") == "none"
+        assert check("dev-b", "Run") == "running_start"
+        assert check("dev-a", "None") == "running_stop"
+        assert check("dev-b", "Run") == "none"
+    print("✅ trigger per device")
+
+
+def test_task_completed_counts_run_device():
+    """2台のセッションが並行しているとき、完了したタスクはそのタスクを起動したデバイスにだけ数えることを確認"""
+    from unittest.mock import AsyncMock, patch
+
+    from agent import dev_graph, tools
+
+    tracker = SessionTracker()
+    tracker.start("dev-a", _BASE)
+    tracker.start("dev-b", _BASE)
+    response = '<review_result>{"result": "PASS", "needs_revision": false, "comment": "ok"}</review_result>'
+    with tempfile.TemporaryDirectory() as tmp:
+        state = {"current_task": "タスク", "workspace_root": tmp, "current_write_files": [], "task_index": 0, "revision_count": 0}
+        token = tools.set_run_device("dev-b")
+        try:
+            with patch.object(dev_graph, "_invoke_agent", AsyncMock(return_value=response)), \
+                    patch.object(dev_graph, "broadcast", AsyncMock()), \
+                    patch.object(dev_graph, "session_tracker", tracker):
+                asyncio.run(dev_graph.reviewer_node(state))
+        finally:
+            tools.reset_run_device(token)
+    counts = {s["device_id"]: s["tasks_completed"] for s in tracker.active()}
+    assert counts == {"dev-a": 0, "dev-b": 1}
+    tracker.task_completed("")   # デバイスのない実行はどのセッションにも数えない
+    assert [s["tasks_completed"] for s in tracker.active()] == [0, 1]
+    print("✅ task completed counts run device")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Incremental summary", test_incremental_summary),
+        ("Gaps are not counted", test_gaps_are_not_counted),
+        ("Persisted sessions", test_persisted_sessions),
+        ("notify_stop broadcasts summary", test_notify_stop_broadcasts_summary),
+        ("Trigger per device", test_trigger_per_device),
+        ("Task completed counts run device", test_task_completed_counts_run_device),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
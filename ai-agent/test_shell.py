@@ -0,0 +1,150 @@
+"""shell.py（run_shell の非同期実行）のユニットテスト"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+from agent import shell, tools
+
+
+def _alive(pid: int) -> bool:
+    """pid のプロセスが動いているか（終了済みで回収待ちのゾンビは動いていないとみなす）"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+    except OSError:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        return True
+
+
+def test_truncation_and_log_file():
+    """長い出力は先頭・末尾だけを返し、全出力をログファイルに残すことを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        result = asyncio.run(shell.run("seq 1 10000; echo done >&2; exit 3", tmp))
+        assert result["exit_code"] == 3 and not result["timed_out"]
+        assert result["lines"] == 10001 and result["truncated"]
+        lines = result["output"].splitlines()
+        assert lines[:2] == ["1", "2"] and lines[-2:] == ["10000", "done"]
+        assert len(lines) == shell._HEAD_LINES + 1 + shell._TAIL_LINES
+        assert f"中略 {10001 - shell._HEAD_LINES - shell._TAIL_LINES} 行" in lines[shell._HEAD_LINES]
+        with open(result["log_path"], encoding="utf-8") as f:
+            assert len(f.read().splitlines()) == 10001
+        os.remove(result["log_path"])
+
+        result = asyncio.run(shell.run("printf 'a\\nb'", tmp))
+        assert result["output"] == "a\nb" and result["log_path"] is None
+    print("✅ truncation and log file")
+
+
+def test_streaming_events():
+    """出力行が shell_start → shell_output → shell_exit の順に送られることを確認"""
+    events = []
+
+    async def emit(event):
+        events.append(event)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(shell.run("echo one; sleep 0.5; echo two", tmp, emit=emit))
+    types = [e["type"] for e in events]
+    assert types[0] == "shell_start" and types[-1] == "shell_exit"
+    outputs = [e["lines"] for e in events if e["type"] == "shell_output"]
+    # sleep の前の行は終了を待たずに送られる
+    assert outputs == [["one"], ["two"]], outputs
+    assert events[-1]["exit_code"] == 0 and events[-1]["lines"] == 2
+    print("✅ streaming events")
+
+
+def test_timeout_kills_process_group():
+    """タイムアウト時にバックグラウンドの子プロセスも含めて終了させることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        pid_file = os.path.join(tmp, "child.pid")
+        start = time.monotonic()
+        result = asyncio.run(shell.run(f"sleep 30 & echo $! > {pid_file}; echo started; wait", tmp, timeout=0.5))
+        assert result["timed_out"] and result["output"] == "started"
+        assert time.monotonic() - start < 5
+        with open(pid_file) as f:
+            child = int(f.read())
+        time.sleep(0.1)
+        assert not _alive(child)
+    print("✅ timeout kills process group")
+
+
+def test_concurrency_limit():
+    """同時実行数が上限を超えないことを確認"""
+    async def main(tmp):
+        peak = 0
+
+        async def watch():
+            nonlocal peak
+            while True:
+                peak = max(peak, shell.LIMITER.running)
+                await asyncio.sleep(0.01)
+
+        watcher = asyncio.create_task(watch())
+        results = await asyncio.gather(*(shell.run("sleep 0.2", tmp) for _ in range(5)))
+        watcher.cancel()
+        return peak, results
+
+    with tempfile.TemporaryDirectory() as tmp:
+        peak, results = asyncio.run(main(tmp))
+    assert peak == shell.LIMITER.limit
+    assert all(r["exit_code"] == 0 for r in results)
+    assert shell.LIMITER.running == 0 and shell.LIMITER.snapshot()["queued"] == 0
+    print("✅ concurrency limit")
+
+
+def test_long_line_without_newline():
+    """改行のない大量の出力を上限の長さごとに行として扱い、全出力をログファイルに残すことを確認"""
+    with tempfile.TemporaryDirectory() as tmp, patch.object(shell, "_MAX_PARTIAL_BYTES", 1024):
+        size = 1024 * 300 + 10
+        text = "あ" * (size // 3) + "x" * (size % 3)
+        command = f"python3 -c \"import sys; sys.stdout.write('あ' * {size // 3} + 'x' * {size % 3})\""
+        result = asyncio.run(shell.run(command, tmp))
+        assert result["exit_code"] == 0 and result["truncated"]
+        assert result["lines"] == 301 and len(result["output"].splitlines()) == shell._HEAD_LINES + 1 + shell._TAIL_LINES
+        with open(result["log_path"], encoding="utf-8") as f:
+            logged = f.read().splitlines()
+        os.remove(result["log_path"])
+        # UTF-8 の文字の途中では切らない
+        assert "".join(logged) == text
+        assert all(len(line.encode("utf-8")) <= 1024 for line in logged)
+    print("✅ long line without newline")
+
+
+def test_run_shell_tool():
+    """run_shell ツールの出力形式と、空の出力・危険なコマンドの扱いを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        tools.set_workspace_root(tmp)
+        output = asyncio.run(tools.run_shell.ainvoke({"command": "true"}))
+        assert output == "=== コマンド ===\ntrue\n\n=== 出力（stdout + stderr） ===\n（出力なし）\n\n終了コード: 0"
+        output = asyncio.run(tools.run_shell.ainvoke({"command": "sleep 5", "timeout": 1}))
+        assert "タイムアウトしました（1秒）" in output
+        assert asyncio.run(tools.run_shell.ainvoke({"command": "sudo ls"})).startswith("エラー: 危険なコマンド")
+    print("✅ run_shell tool")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Truncation and log file", test_truncation_and_log_file),
+        ("Streaming events", test_streaming_events),
+        ("Timeout kills process group", test_timeout_kills_process_group),
+        ("Concurrency limit", test_concurrency_limit),
+        ("Long line without newline", test_long_line_without_newline),
+        ("run_shell tool", test_run_shell_tool),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
@@ -0,0 +1,115 @@
+"""store.py のユニットテスト"""
+import os
+import sys
+import tempfile
+import time
+
+from agent.store import SensorStore
+
+_BASE = 1_772_000_000.0  # 2026-02-25T06:13:20Z
+
+
+def _open(tmp: str) -> SensorStore:
+    return SensorStore(os.path.join(tmp, "sensors.db"))
+
+
+def test_persists_across_reopen():
+    """閉じて開き直しても生データとステータスが残ることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = _open(tmp)
+        for i in range(10):
+            store.append("motion", {"status": "Run", "bpm": 10 + i, "device_id": "esp32"}, _BASE + i)
+        store.put_status("esp32", {"status": "Run", "is_running": True})
+        store.close()
+
+        reopened = _open(tmp)
+        assert [r["bpm"] for r in reopened.latest("motion", 3)] == [17, 18, 19]
+        assert reopened.load_status() == {"esp32": {"status": "Run", "is_running": True}}
+        reopened.close()
+    print("✅ persisted across reopen")
+
+
+def test_segments_and_range_query():
+    """日単位セグメントをまたぐ範囲検索と古いセグメントの削除を確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = _open(tmp)
+        for day in range(3):
+            for i in range(4):
+                store.append("motion", {"bpm": day * 10 + i, "device_id": "a"}, _BASE + day * 86400 + i * 60)
+        store.flush()
+        assert len(store._segments) == 3
+
+        records = store.range("motion", since=_BASE + 86400, until=_BASE + 2 * 86400 + 60)
+        assert [r["bpm"] for _, r in records] == [10, 11, 12, 13, 20, 21]
+        # 範囲内の直近 n 件だけを読む（セグメントをまたいでも古い順で返す）
+        records = store.range("motion", since=_BASE + 86400, until=_BASE + 2 * 86400 + 60, limit=3, newest=True)
+        assert [r["bpm"] for _, r in records] == [13, 20, 21]
+        assert [r["bpm"] for _, r in store.range("motion", since=_BASE, limit=2)] == [0, 1]
+
+        dropped = store.drop_segments_before(_BASE + 86400)
+        assert len(dropped) == 1
+        assert len(store.latest("motion", 100)) == 8
+        # ロールアップは生データ削除後も残る
+        assert sum(r["count"] for r in store.rollups("motion", "bpm", "1h")) == 12
+        store.close()
+    print("✅ segments and range query")
+
+
+def test_bad_records_do_not_stop_writer():
+    """範囲外の時刻や書けないレコードがあっても、同じバッチの他のレコードと以降の書き込みが残ることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = _open(tmp)
+        store.append("motion", {"bpm": 1, "device_id": "a"}, _BASE)
+        store.append("motion", {"bpm": 2, "device_id": "a"}, _BASE * 1000 + 1000)   # ミリ秒の UNIX 時刻
+        store.append("motion", {"bpm": 3, "device_id": "a"}, 1e300)
+        store.append("motion", {"bpm": 4, "device_id": "a"}, float("nan"))
+        store.put_session({"device_id": "a"})   # started がないため書けない
+        store.append("motion", {"bpm": 5, "device_id": "a"}, _BASE + 2)
+        assert store.flush()
+        records = store.range("motion", since=_BASE, until=_BASE + 10)
+        assert [(ts, r["bpm"]) for ts, r in records] == [(_BASE, 1), (_BASE + 1, 2), (_BASE + 2, 5)]
+        assert sorted(r["bpm"] for r in store.latest("motion", 10)) == [1, 2, 3, 4, 5]   # 3, 4 は現在時刻で保存
+
+        # 書き込みスレッドが生きていて、以降の書き込みも反映される
+        store.append("motion", {"bpm": 6, "device_id": "a"}, _BASE + 3)
+        assert store.flush() and store.latest("motion", 1)[0]["bpm"] in (3, 4, 6)
+        assert len(store.range("motion", since=_BASE, until=_BASE + 10)) == 4
+        store.close()
+    print("✅ bad records do not stop writer")
+
+
+def test_rollups_over_months_are_fast():
+    """数か月分のロールアップ検索がミリ秒オーダーで返ることを確認"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = _open(tmp)
+        days = 90
+        for i in range(days * 24 * 6):  # 10分ごと
+            store.append("motion", {"bpm": float(i % 30), "device_id": "a"}, _BASE + i * 600)
+        store.flush(timeout=60)
+
+        start = time.perf_counter()
+        hourly = store.rollups("motion", "bpm", "1h", since=_BASE, until=_BASE + days * 86400)
+        elapsed = time.perf_counter() - start
+        assert days * 24 <= len(hourly) <= days * 24 + 1
+        assert sum(r["count"] for r in hourly) == days * 24 * 6
+        assert elapsed < 0.1, f"rollup query took {elapsed * 1000:.1f} ms"
+        store.close()
+    print(f"✅ {days}日分の1時間ロールアップ: {elapsed * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Persists across reopen", test_persists_across_reopen),
+        ("Segments and range query", test_segments_and_range_query),
+        ("Bad records do not stop writer", test_bad_records_do_not_stop_writer),
+        ("Rollups over months", test_rollups_over_months_are_fast),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
@@ -0,0 +1,110 @@
+"""tier_router.py のユニットテスト"""
+import os
+import sys
+import tempfile
+from unittest.mock import MagicMock, patch
+
+from agent import tier_router
+
+
+def _never_explore():
+    return MagicMock(random=lambda: 1.0)
+
+
+def _always_explore():
+    return MagicMock(random=lambda: 0.0)
+
+
+def _with_history_dir(func):
+    """履歴ファイルを一時ディレクトリに向けて実行する（探索はしない）"""
+    def wrapper():
+        with tempfile.TemporaryDirectory() as tmp:
+            with patch("agent.tier_router.data_path", lambda name: os.path.join(tmp, name)), \
+                    patch.object(tier_router, "_rng", _never_explore()):
+                func(tmp)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+@_with_history_dir
+def test_estimate_complexity(tmp):
+    """ファイル数とサイズから規模を推定することを確認"""
+    with open(os.path.join(tmp, "small.py"), "w") as f:
+        f.write("x = 1\n")
+    with open(os.path.join(tmp, "big.py"), "w") as f:
+        f.write("x = 1\n" * 20000)
+
+    assert tier_router.estimate_complexity(tmp, [], ["small.py"])["bucket"] == "small"
+    assert tier_router.estimate_complexity(tmp, ["big.py"], ["small.py"])["bucket"] == "large"
+    assert tier_router.estimate_complexity(tmp, ["small.py"], ["a.py", "b.py"])["bucket"] == "medium"
+    assert tier_router.estimate_complexity(tmp, [], ["a", "b", "c", "d"])["bucket"] == "large"
+    print("✅ complexity estimated")
+
+
+@_with_history_dir
+def test_select_tier_by_bucket(tmp):
+    """履歴がない場合は規模に応じたティアを返すことを確認"""
+    assert tier_router.select_tier("small", "sonnet") == "haiku"
+    assert tier_router.select_tier("medium", "sonnet") == "sonnet"
+    assert tier_router.select_tier("medium", "sonnet-3") == "sonnet-3"
+    assert tier_router.select_tier("large", "haiku") == "opus"
+    print("✅ tier selected by bucket")
+
+
+@_with_history_dir
+def test_select_tier_uses_history(tmp):
+    """一発PASS率が低ければ上げ、下位ティアで十分なら下げることを確認"""
+    for _ in range(3):
+        tier_router.record_outcome("small", "haiku", passed=False, revision_count=2)
+    assert tier_router.select_tier("small", "sonnet") == "sonnet"
+
+    for _ in range(4):
+        tier_router.record_outcome("medium", "haiku", passed=True, revision_count=0)
+    assert tier_router.select_tier("medium", "sonnet") == "haiku"
+
+    stats = tier_router.get_stats()
+    assert stats["small"]["haiku"] == {"tasks": 3, "passed": 0, "first_pass": 0, "revisions": 6}
+    print(f"✅ history applied: {stats}")
+
+
+@_with_history_dir
+def test_exploration_enables_downgrade(tmp):
+    """探索で下位ティアにも結果が入り、十分に一発PASSすれば実際に下げることを確認"""
+    # large は opus から始まるので、探索しなければ sonnet の履歴は増えない
+    assert tier_router.select_tier("large", "haiku") == "opus"
+    with patch.object(tier_router, "_rng", _always_explore()):
+        explored = tier_router.select_tier("large", "haiku")
+    assert explored == "sonnet"
+    for _ in range(3):
+        tier_router.record_outcome("large", explored, passed=True, revision_count=0)
+    assert tier_router.select_tier("large", "haiku") == "sonnet"
+
+    # 上げたままの規模でも、本来のティアを時々試して履歴を更新する
+    for _ in range(3):
+        tier_router.record_outcome("small", "haiku", passed=False, revision_count=1)
+    assert tier_router.select_tier("small", "sonnet") == "sonnet"
+    with patch.object(tier_router, "_rng", _always_explore()):
+        assert tier_router.select_tier("small", "sonnet") == "haiku"
+    for _ in range(6):
+        tier_router.record_outcome("small", "haiku", passed=True, revision_count=0)
+    assert tier_router.select_tier("small", "sonnet") == "haiku"
+    print("✅ exploration enables downgrade")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Estimate complexity", test_estimate_complexity),
+        ("Select tier by bucket", test_select_tier_by_bucket),
+        ("Select tier uses history", test_select_tier_uses_history),
+        ("Exploration enables downgrade", test_exploration_enables_downgrade),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
@@ -0,0 +1,153 @@
+"""warm_runner.py（常駐ワーカーでのテスト実行）のユニットテスト"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+from agent import tools, warm_runner
+
+
+def _touch(root: str, rel: str, content: str) -> None:
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def _project(root: str) -> None:
+    _touch(root, "pyproject.toml", "[project]\nname = 'sample'\n")
+    _touch(root, "mod.py", "VALUE = 1\n")
+    _touch(root, "test_mod.py", (
+        "import sys\n"
+        "import mod\n"
+        "print('value', mod.VALUE, sys.argv[1:])\n"
+        "print('warn', file=sys.stderr)\n"
+        "sys.exit(0 if mod.VALUE == 1 else 4)\n"
+    ))
+
+
+def test_run_script_and_reload():
+    """スクリプトの出力・終了コードと、編集したモジュールが次の実行に反映されることを確認"""
+    os.environ["WARM_RUNNER_PRELOAD"] = "json"
+    with tempfile.TemporaryDirectory() as tmp:
+        _project(tmp)
+        path = os.path.join(tmp, "test_mod.py")
+        result = asyncio.run(warm_runner.run_test(path, tmp, args=["-v"]))
+        assert result["warm"] and result["exit_code"] == 0
+        assert result["output"] == "value 1 ['-v']\nwarn"
+
+        _touch(tmp, "mod.py", "VALUE = 2\n")
+        result = asyncio.run(warm_runner.run_test(path, tmp))
+        assert result["exit_code"] == 4 and result["output"].startswith("value 2")
+
+        _touch(tmp, "test_err.py", "raise ValueError('boom')\n")
+        result = asyncio.run(warm_runner.run_test(os.path.join(tmp, "test_err.py"), tmp))
+        assert result["exit_code"] == 1 and result["output"].endswith("ValueError: boom")
+
+        worker = warm_runner._workers[os.path.realpath(tmp)]
+        assert worker.runs == 3 and worker.preloaded == ["json"]
+    warm_runner.shutdown()
+    print("✅ run script and reload")
+
+
+def test_timeout_and_restart():
+    """タイムアウトしたテストを終了させ、ワーカーはそのまま使えること、依存関係の変更で起動し直すことを確認"""
+    os.environ["WARM_RUNNER_PRELOAD"] = "json"
+    with tempfile.TemporaryDirectory() as tmp:
+        _project(tmp)
+        _touch(tmp, "test_slow.py", "import time\nprint('start', flush=True)\ntime.sleep(30)\n")
+        start = time.monotonic()
+        result = asyncio.run(warm_runner.run_test(os.path.join(tmp, "test_slow.py"), tmp, timeout=0.5))
+        assert result["timed_out"] and result["output"] == "start"
+        assert time.monotonic() - start < 5
+
+        worker = warm_runner._workers[os.path.realpath(tmp)]
+        proc = worker._proc
+        result = asyncio.run(warm_runner.run_test(os.path.join(tmp, "test_mod.py"), tmp))
+        assert result["exit_code"] == 0 and worker._proc is proc
+
+        time.sleep(0.01)
+        _touch(tmp, "pyproject.toml", "[project]\nname = 'sample'\nversion = '2'\n")
+        assert worker.stale()
+        asyncio.run(warm_runner.run_test(os.path.join(tmp, "test_mod.py"), tmp))
+        assert worker._proc is not proc and proc.poll() is not None
+    warm_runner.shutdown()
+    print("✅ timeout and restart")
+
+
+def test_run_tests_tool():
+    """run_tests ツールの出力形式と pytest での実行を確認"""
+    os.environ["WARM_RUNNER_PRELOAD"] = "pytest"
+    # テスト結果のキャッシュは一時ディレクトリに書く（開発環境の data/test_results.db を汚さない）
+    with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory() as data, \
+            patch("agent.result_cache.data_path", lambda name: os.path.join(data, name)):
+        _project(tmp)
+        _touch(tmp, "tests/test_pt.py", "def test_ok():\n    assert True\n\ndef test_ng():\n    assert False\n")
+        tools.set_workspace_root(tmp)
+        output = asyncio.run(tools.run_tests.ainvoke({"path": "test_mod.py"}))
+        assert output.startswith("=== コマンド ===\npython test_mod.py\n")
+        assert "終了コード: 0（" in output and "ウォームワーカー）" in output
+
+        output = asyncio.run(tools.run_tests.ainvoke({
+            "path": "tests/test_pt.py", "pytest": True, "arguments": ["-q", "-p", "no:cacheprovider"],
+        }))
+        assert "1 failed, 1 passed" in output and "終了コード: 1" in output
+        assert asyncio.run(tools.run_tests.ainvoke({"path": "missing.py"})).startswith("エラー")
+    warm_runner.shutdown()
+    print("✅ run_tests tool")
+
+
+def test_concurrent_start_and_fallback():
+    """並行したテストでもワーカーの起動は1回だけで、ソケットに接続できなければ通常実行に切り替えることを確認"""
+    os.environ["WARM_RUNNER_PRELOAD"] = "json"
+    starts = []
+    original_start = warm_runner.WarmWorker.start
+
+    def counting_start(self):
+        starts.append(self.project)
+        original_start(self)
+
+    async def run_both(tmp: str):
+        return await asyncio.gather(*(
+            warm_runner.run_test(os.path.join(tmp, "test_mod.py"), tmp, args=[str(i)]) for i in range(2)
+        ))
+
+    with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory() as data, \
+            patch("agent.result_cache.data_path", lambda name: os.path.join(data, name)), \
+            patch.object(warm_runner.WarmWorker, "start", counting_start):
+        _project(tmp)
+        results = asyncio.run(run_both(tmp))
+        assert [r["exit_code"] for r in results] == [0, 0] and all(r["warm"] for r in results)
+        assert starts == [os.path.realpath(tmp)]
+
+        # サーバーのソケットが消えていても通常実行で結果を返し、次回はワーカーを起動し直す
+        worker = warm_runner._workers[os.path.realpath(tmp)]
+        os.remove(worker.socket_path)
+        tools.set_workspace_root(tmp)
+        output = asyncio.run(tools.run_tests.ainvoke({"path": "test_mod.py", "use_cache": False}))
+        assert "終了コード: 0" in output and "ウォームワーカー" not in output
+        assert not worker.alive
+        asyncio.run(warm_runner.run_test(os.path.join(tmp, "test_mod.py"), tmp))
+        assert len(starts) == 2
+    warm_runner.shutdown()
+    print("✅ concurrent start and fallback")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Run script and reload", test_run_script_and_reload),
+        ("Timeout and restart", test_timeout_and_restart),
+        ("run_tests tool", test_run_tests_tool),
+        ("Concurrent start and fallback", test_concurrent_start_and_fallback),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)
@@ -0,0 +1,222 @@
+"""worktrees.py（タスクごとの git worktree）のユニットテスト"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+from agent import dev_graph, tools, worktrees
+
+
+def _touch(root: str, rel: str, content: str) -> None:
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def _read(root: str, rel: str) -> str:
+    with open(os.path.join(root, rel), encoding="utf-8") as f:
+        return f.read()
+
+
+def _repo(root: str) -> str:
+    """app/ をワークスペースとするリポジトリ（未コミットの変更と未追跡ファイルを含む）"""
+    repo = os.path.join(root, "repo")
+    _touch(repo, ".gitignore", "data/\n")
+    _touch(repo, "app/main.py", "VALUE = 1\n")
+    _touch(repo, "app/util.py", "NAME = 'a'\n")
+    for args in (["init", "-q"], ["add", "-A"], ["-c", "user.name=t", "-c", "user.email=t@t", "commit", "-qm", "init"]):
+        subprocess.run(["git", *args], cwd=repo, check=True)
+    _touch(repo, "app/main.py", "VALUE = 2\n")     # 未コミットの変更
+    _touch(repo, "app/new.py", "NEW = True\n")     # 未追跡ファイル
+    return repo
+
+
+def _status(repo: str) -> str:
+    return subprocess.run(["git", "status", "--porcelain"], cwd=repo, capture_output=True, text=True).stdout
+
+
+def test_acquire_merge_discard():
+    """割り当てた worktree に元のチェックアウトの未コミットの内容があり、PASS で反映・FAIL で破棄されることを確認"""
+    with tempfile.TemporaryDirectory() as tmp, \
+            patch("agent.worktrees.data_path", lambda *parts: os.path.join(tmp, "data", *parts)):
+        repo = _repo(tmp)
+        status = _status(repo)
+        pool = worktrees.WorktreePool(repo, size=2)
+        pool.fill()
+        assert pool.snapshot_stats()["idle"] == 2
+
+        worktree = pool.acquire(os.path.join(repo, "app"))
+        workspace = worktree.workspace
+        assert workspace == os.path.join(worktree.path, "app")
+        assert _read(workspace, "main.py") == "VALUE = 2\n" and _read(workspace, "new.py") == "NEW = True\n"
+        assert _status(repo) == status   # 元のチェックアウトの index は変えない
+
+        _touch(workspace, "main.py", "VALUE = 3\n")
+        _touch(workspace, "added.py", "ADDED = 1\n")
+        os.remove(os.path.join(workspace, "util.py"))
+        assert sorted(pool.merge(worktree)) == ["app/added.py", "app/main.py", "app/util.py"]
+        pool.release(worktree)
+        assert _read(repo, "app/main.py") == "VALUE = 3\n" and _read(repo, "app/added.py") == "ADDED = 1\n"
+        assert not os.path.exists(os.path.join(repo, "app/util.py"))
+
+        # FAIL したタスクの書き込みは元のチェックアウトに残らず、worktree は元に戻してプールに返す
+        worktree = pool.acquire(os.path.join(repo, "app"))
+        assert not os.path.exists(os.path.join(worktree.workspace, "util.py"))
+        _touch(worktree.workspace, "main.py", "broken(\n")
+        _touch(worktree.workspace, "partial.py", "x = 1\n")
+        pool.release(worktree, discarded=True)
+        assert _read(repo, "app/main.py") == "VALUE = 3\n" and not os.path.exists(os.path.join(repo, "app/partial.py"))
+        assert not os.path.exists(os.path.join(worktree.workspace, "partial.py"))
+        stats = pool.snapshot_stats()
+        assert stats["merged"] == 1 and stats["discarded"] == 1 and stats["active"] == 0
+    print("✅ acquire / merge / discard")
+
+
+def test_conflict_and_pool_speed():
+    """元のチェックアウトで同じ箇所が変わっていれば反映しないこと、プールからの割り当てが速いことを確認"""
+    with tempfile.TemporaryDirectory() as tmp, \
+            patch("agent.worktrees.data_path", lambda *parts: os.path.join(tmp, "data", *parts)):
+        repo = _repo(tmp)
+        pool = worktrees.WorktreePool(repo, size=1)
+        pool.fill()
+        worktree = pool.acquire(repo)
+        _touch(worktree.path, "app/main.py", "VALUE = 'task'\n")
+        _touch(repo, "app/main.py", "VALUE = 'user'\n")
+        try:
+            pool.merge(worktree)
+            raise AssertionError("MergeConflict が送出されませんでした")
+        except worktrees.MergeConflict:
+            pass
+        assert _read(repo, "app/main.py") == "VALUE = 'user'\n"
+        pool.release(worktree, discarded=True)
+
+        durations = []
+        for _ in range(3):
+            start = time.monotonic()
+            worktree = pool.acquire(repo)
+            durations.append(time.monotonic() - start)
+            pool.release(worktree, discarded=True)
+        print(f"  プールからの割り当て: {min(durations) * 1000:.0f}ms")
+        assert min(durations) < 1.0
+
+        # 再起動後も既存の worktree をプールに取り込む
+        while pool._filling:   # バックグラウンドでの補充を待つ
+            time.sleep(0.01)
+        again = worktrees.WorktreePool(repo, size=1)
+        assert again.snapshot_stats()["idle"] == 1
+    print("✅ conflict and pool speed")
+
+
+def test_shared_ignored_links():
+    """.gitignore された依存関係・.env が元のチェックアウトへのリンクとして worktree にあり、反映されないことを確認"""
+    with tempfile.TemporaryDirectory() as tmp, \
+            patch("agent.worktrees.data_path", lambda *parts: os.path.join(tmp, "data", *parts)):
+        repo = _repo(tmp)
+        _touch(repo, ".gitignore", "data/\n.venv/\nnode_modules/\n.env\n*.pyc\n")
+        _touch(repo, ".venv/bin/python", "#!venv\n")
+        _touch(repo, "app/node_modules/pkg/index.js", "module.exports = 1\n")
+        _touch(repo, "app/.env", "TOKEN=secret\n")
+        _touch(repo, "app/cache.pyc", "compiled")
+        pool = worktrees.WorktreePool(repo, size=1)
+        worktree = pool.acquire(os.path.join(repo, "app"))
+        assert sorted(worktree.links) == [".venv", "app/.env", "app/node_modules"]
+        assert sorted(worktree.exclude) == [".venv", "app/node_modules"]   # `dir/` のパターンはリンクに一致しない
+        assert _read(worktree.path, ".venv/bin/python") == "#!venv\n"
+        assert _read(worktree.workspace, "node_modules/pkg/index.js") == "module.exports = 1\n"
+        assert _read(worktree.workspace, ".env") == "TOKEN=secret\n"
+        assert not os.path.exists(os.path.join(worktree.workspace, "cache.pyc"))   # 共有の対象外
+
+        _touch(worktree.workspace, "main.py", "VALUE = 4\n")
+        assert pool.merge(worktree) == ["app/main.py"]   # リンクは反映しない
+        assert os.path.isdir(os.path.join(repo, ".venv")) and not os.path.islink(os.path.join(repo, ".venv"))
+        pool.release(worktree)
+
+        worktree = pool.acquire(os.path.join(repo, "app"))
+        assert sorted(worktree.links) == [".venv", "app/.env", "app/node_modules"]
+        assert _read(worktree.workspace, ".env") == "TOKEN=secret\n"
+        pool.release(worktree, discarded=True)
+        while pool._filling:   # バックグラウンドでの補充を待つ
+            time.sleep(0.01)
+    print("✅ shared ignored links")
+
+
+def test_dev_graph_task_workspace():
+    """coder / reviewer のツールが worktree で動き、PASS で反映・FAIL で破棄されることを確認"""
+    async def run_task(repo: str, content: str, passed: bool) -> None:
+        state = {"workspace_root": repo, "task_workspace": "", "task_index": 0}
+        state["task_workspace"] = await dev_graph._enter_task_workspace(state)
+        assert state["task_workspace"] and state["task_workspace"] != repo
+        tools.write_file.invoke({"path": "app/main.py", "content": content})
+        assert _read(state["task_workspace"], "app/main.py") == content
+        await dev_graph._leave_task_workspace(state, passed)
+
+    events = []
+
+    async def fake_broadcast(event):
+        events.append(event)
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            patch("agent.worktrees.data_path", lambda *parts: os.path.join(tmp, "data", *parts)), \
+            patch.object(dev_graph, "broadcast", fake_broadcast), \
+            patch.dict(worktrees._pools, clear=True):
+        repo = os.path.realpath(_repo(tmp))
+        assert tools.read_file.invoke({"path": os.path.join(repo, "app/main.py")}) == "VALUE = 2\n"
+        asyncio.run(run_task(repo, "VALUE = 'failed'\n", passed=False))
+        assert _read(repo, "app/main.py") == "VALUE = 2\n"
+        asyncio.run(run_task(repo, "VALUE = 'passed'\n", passed=True))
+        assert _read(repo, "app/main.py") == "VALUE = 'passed'\n"
+        # 反映したファイルの読み込みキャッシュは無効化される
+        assert tools.read_file.invoke({"path": os.path.join(repo, "app/main.py")}) == "VALUE = 'passed'\n"
+        assert [e["action"] for e in events] == ["discarded", "merged"]
+        assert events[1]["files"] == ["app/main.py"]
+    print("✅ dev_graph task workspace")
+
+
+def test_run_releases_worktree_on_error():
+    """reviewer に進む前にノードが例外を送出しても、割り当てた worktree を捨ててプールに返すことを確認"""
+    class FakeGraph:
+        async def ainvoke(self, state):
+            state["task_workspace"] = await dev_graph._enter_task_workspace(state)
+            tools.write_file.invoke({"path": "app/main.py", "content": "broken(\n"})
+            raise RuntimeError("coder failed")
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            patch("agent.worktrees.data_path", lambda *parts: os.path.join(tmp, "data", *parts)), \
+            patch.object(dev_graph, "dev_graph", FakeGraph()), \
+            patch.dict(worktrees._pools, clear=True):
+        repo = os.path.realpath(_repo(tmp))
+        try:
+            asyncio.run(dev_graph.run_dev_agent(repo))
+            raise AssertionError("RuntimeError が送出されませんでした")
+        except RuntimeError as e:
+            assert str(e) == "coder failed"
+        pool = worktrees._pools[repo]
+        stats = pool.snapshot_stats()
+        assert stats["active"] == 0 and stats["discarded"] == 1
+        assert _read(repo, "app/main.py") == "VALUE = 2\n"
+        while pool._filling:   # バックグラウンドでの補充を待つ
+            time.sleep(0.01)
+    print("✅ run releases worktree on error")
+
+
+if __name__ == "__main__":
+    tests = [
+        ("Acquire / merge / discard", test_acquire_merge_discard),
+        ("Conflict and pool speed", test_conflict_and_pool_speed),
+        ("Shared ignored links", test_shared_ignored_links),
+        ("dev_graph task workspace", test_dev_graph_task_workspace),
+        ("Run releases worktree on error", test_run_releases_worktree_on_error),
+    ]
+    failed = 0
+    for name, test_func in tests:
+        print(f"\n[TEST] {name}")
+        try:
+            test_func()
+        except Exception as e:
+            print(f"❌ Test failed with exception: {e}")
+            failed += 1
+    sys.exit(0 if failed == 0 else 1)